@@ -0,0 +1,354 @@
+"""
+PANOPTES - Offline batch analysis of archived footage.
+
+Runs the same pose -> track -> behavior pipeline as the live server over video
+files (or whole directories) as fast as the hardware allows: no real-time
+throttling, decode-ahead thread, batched inference and one worker process per
+file. Per-track action timelines are written as JSONL and one embedding per
+action segment goes to the vector store in bulk. Progress is checkpointed so an
+interrupted overnight run resumes where it stopped.
+
+Usage:
+    python batch_process.py /archive/cam01 /archive/extra.mp4 --out batch_out --workers 2 --batch 16
+"""
+import os
+import sys
+import json
+import time
+import queue
+import hashlib
+import argparse
+import threading
+import logging
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+os.environ.setdefault("PYTORCH_ENABLE_MPS_FALLBACK", "1")
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+VIDEO_EXTS = (".mp4", ".avi", ".mkv", ".mov", ".m4v", ".ts", ".webm", ".mpg")
+
+log = logging.getLogger("panoptes.batch")
+
+
+def find_videos(inputs):
+    videos = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                videos.extend(os.path.join(root, f) for f in files if f.lower().endswith(VIDEO_EXTS))
+        elif os.path.isfile(item):
+            videos.append(item)
+        else:
+            log.warning(f"Skipping missing input {item}")
+    return sorted(set(os.path.abspath(v) for v in videos))
+
+
+def _job_name(path):
+    # Unique, filesystem-safe name for outputs/checkpoints of one video
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return f"{stem}-{hashlib.md5(os.path.dirname(path).encode()).hexdigest()[:8]}"
+
+
+class FrameReader(threading.Thread):
+    """Decode-ahead thread: keeps `prefetch` frames ready so decode overlaps inference."""
+    def __init__(self, cap, start_frame, stride=1, prefetch=64):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.index = start_frame
+        self.stride = stride
+        self.queue = queue.Queue(maxsize=prefetch)
+        self.running = True
+
+    def run(self):
+        while self.running:
+            if self.index % self.stride:
+                # Skipped frames are only grabbed, never decoded to BGR
+                ok = self.cap.grab()
+                frame = None
+            else:
+                ok, frame = self.cap.read()
+            if not ok:
+                break
+            if frame is not None:
+                self.queue.put((self.index, frame))
+            self.index += 1
+        self.queue.put(None)
+
+    def stop(self):
+        self.running = False
+        # Unblock a put() on a full queue so the thread exits before cap.release()
+        while self.is_alive():
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                self.join(timeout=0.1)
+
+
+class TimelineBuilder:
+    """
+    Turns per-frame detections into per-track action segments
+    {id, action, start, end, frames}. A segment closes when the action of
+    the track changes or the track disappears for longer than `gap` seconds.
+    id_offset shifts the tracker ids (ByteTrack restarts at 1 after a resume).
+    """
+    def __init__(self, source, out_file, embedder=None, gap=1.0, id_offset=0):
+        self.source = source
+        self.out = out_file
+        self.embedder = embedder
+        self.gap = gap
+        self.id_offset = id_offset
+        self.max_id = id_offset
+        self.open = {}    # {track_id: segment}
+        self.rows = []    # pending vector store rows
+        self.segments = 0
+
+    def state(self):
+        """Open segments + highest id, for the checkpoint."""
+        segments = [dict(seg, vector=[float(v) for v in seg["vector"]]) for seg in self.open.values()]
+        return {"open": segments, "max_id": self.max_id}
+
+    def restore(self, state):
+        self.open = {seg["id"]: seg for seg in state.get("open", [])}
+        self.max_id = max(self.max_id, state.get("max_id", 0))
+
+    def update(self, detections, timestamp, frame):
+        for det in detections:
+            t_id = det["id"] + self.id_offset
+            self.max_id = max(self.max_id, t_id)
+            seg = self.open.get(t_id)
+            if seg is not None and seg["action"] != det["action"]:
+                self._close(t_id)
+                seg = None
+            if seg is None:
+                seg = self.open[t_id] = {
+                    "id": t_id, "action": det["action"], "start": timestamp, "end": timestamp, "frames": 0,
+                    "vector": self.embedder.embed(frame, det["box"]) if self.embedder else [],
+                }
+            seg["end"] = timestamp
+            seg["frames"] += 1
+
+        for t_id in [k for k, s in self.open.items() if timestamp - s["end"] > self.gap]:
+            self._close(t_id)
+
+    def close_all(self):
+        for t_id in list(self.open):
+            self._close(t_id)
+
+    def _close(self, t_id):
+        from detectors.knowledge_base import get_policy
+        seg = self.open.pop(t_id)
+        vector = seg.pop("vector")
+        seg["duration"] = round(seg["end"] - seg["start"], 3)
+        seg["source"] = self.source
+        self.out.write(json.dumps(seg) + "\n")
+        self.segments += 1
+        self.rows.append({
+            "person_id": t_id,
+            "timestamp": seg["start"],
+            "vector": vector,
+            "metadata": {"action": seg["action"], "policy": get_policy(seg["action"]), "end": seg["end"],
+                         "duration": seg["duration"], "source": self.source, "mode": "BATCH"}
+        })
+
+
+def process_file(path, opts):
+    """Worker entry point: analyzes one video. Returns a summary dict."""
+    import cv2
+    from core.inference_engine import InferenceEngine
+
+    name = _job_name(path)
+    ckpt_path = os.path.join(opts["out"], name + ".ckpt.json")
+    ckpt = {}
+    if os.path.exists(ckpt_path) and not opts["restart"]:
+        with open(ckpt_path) as f:
+            ckpt = json.load(f)
+        if ckpt.get("done"):
+            return {"file": path, "status": "skipped (done)", "frames": 0, "segments": 0, "seconds": 0.0}
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        return {"file": path, "status": "unreadable", "frames": 0, "segments": 0, "seconds": 0.0}
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    # Archive files are closed when the recording ends: mtime - duration ~ recording start
+    base_ts = opts["start_time"] if opts["start_time"] is not None else os.path.getmtime(path) - total / fps
+    start_frame = int(ckpt.get("frame", 0))
+    if start_frame:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+
+    engine = reader = timeline_file = None
+    try:
+        engine = InferenceEngine(model_path=opts["model"], settings={"conf_threshold": opts["conf"]}, imgsz=opts["imgsz"])
+        engine.load_model()
+
+        db = embedder = None
+        if not opts["no_db"]:
+            from database.vector_store import VectorDB
+            from detectors.embedding import EmbeddingExtractor
+            db = VectorDB(dim=opts["dim"])
+            embedder = EmbeddingExtractor(dim=opts["dim"])
+
+        # Resume: drop what was written after the checkpoint (closed segments are
+        # written as they close), bring back the segments open at that time and
+        # number the new tracks after every id already written
+        timeline_path = os.path.join(opts["out"], name + ".timeline.jsonl")
+        resume = bool(start_frame) and os.path.exists(timeline_path)
+        timeline_file = open(timeline_path, "r+" if resume else "w")
+        if resume:
+            if "timeline_bytes" in ckpt: # Older checkpoints did not record it
+                timeline_file.truncate(ckpt["timeline_bytes"])
+            timeline_file.seek(0, os.SEEK_END)
+        timeline = TimelineBuilder(path, timeline_file, embedder=embedder, id_offset=ckpt.get("max_id", 0) if resume else 0)
+        if resume:
+            timeline.restore(ckpt)
+
+        reader = FrameReader(cap, start_frame, stride=opts["stride"])
+        reader.start()
+        return _run_file(path, opts, ckpt_path, engine, db, timeline, reader, fps, total, base_ts, start_frame)
+    finally:
+        if reader is not None:
+            reader.stop()
+        if engine is not None:
+            # Weights stay cached in this worker's ModelRegistry for its next file
+            engine.release_model()
+        if timeline_file is not None:
+            timeline_file.close()
+        cap.release()
+
+
+def _run_file(path, opts, ckpt_path, engine, db, timeline, reader, fps, total, base_ts, start_frame):
+    """Inference loop of process_file (which owns and closes the resources)."""
+    import numpy as np
+    from core.roi import RoiLayout
+
+    timeline_file = timeline.out
+    layout = None
+    batch_size = opts["batch"]
+    batch_buf = None
+    frames_done = 0
+    persist = False  # First call of every file resets ByteTrack
+    last_ckpt = start_frame
+    t0 = time.time()
+
+    def checkpoint(frame_index, done=False):
+        if db is not None and timeline.rows:
+            db.insert_behaviors(timeline.rows)
+            timeline.rows = []
+        timeline_file.flush()
+        state = {"file": path, "frame": frame_index, "done": done, "updated": time.time(),
+                 "timeline_bytes": os.fstat(timeline_file.fileno()).st_size}
+        state.update(timeline.state())
+        tmp = ckpt_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, ckpt_path)
+
+    end_of_stream = False
+    while not end_of_stream:
+        items = []
+        while len(items) < batch_size:
+            item = reader.queue.get()
+            if item is None:
+                end_of_stream = True
+                break
+            items.append(item)
+        if not items:
+            break
+
+        frame0 = items[0][1]
+        if layout is None or not layout.matches([], frame0.shape, opts["imgsz"]):
+            layout = RoiLayout([], frame0.shape, size=opts["imgsz"], num_buffers=1)
+            batch_buf = np.empty((batch_size,) + layout.canvas_shape, dtype=np.uint8)
+        for i, (_, frame) in enumerate(items):
+            batch_buf[i] = layout.build(frame)
+
+        timestamps = [base_ts + idx / fps for idx, _ in items]
+        try:
+            results = engine.analyze(batch_buf[:len(items)], layout, timestamps, persist=persist)
+        except Exception as e:
+            log.error(f"{os.path.basename(path)}: inference error at frame {items[0][0]}: {e}")
+            results = [[] for _ in items]
+        persist = True
+
+        for (idx, frame), dets, ts in zip(items, results, timestamps):
+            timeline.update(dets, ts, frame)
+        frames_done += len(items)
+
+        current = items[-1][0] + 1
+        if current - last_ckpt >= opts["checkpoint_every"]:
+            checkpoint(current)
+            last_ckpt = current
+            elapsed = time.time() - t0
+            log.info(f"{os.path.basename(path)}: {current}/{total or '?'} frames ({frames_done / elapsed:.1f} FPS)")
+
+    timeline.close_all()
+    checkpoint(reader.index, done=True)
+
+    elapsed = time.time() - t0
+    return {"file": path, "status": "done", "frames": frames_done, "segments": timeline.segments, "seconds": elapsed}
+
+
+def _worker(path, opts):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        return process_file(path, opts)
+    except Exception as e:
+        return {"file": path, "status": f"error: {e}", "frames": 0, "segments": 0, "seconds": 0.0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PANOPTES offline batch analysis")
+    parser.add_argument("inputs", nargs="+", help="Video files and/or directories (searched recursively)")
+    parser.add_argument("--out", default="batch_out", help="Output dir for timelines and checkpoints")
+    parser.add_argument("--workers", type=int, default=1, help="Parallel file workers (one model per process)")
+    parser.add_argument("--batch", type=int, default=16, help="Frames per inference call")
+    parser.add_argument("--stride", type=int, default=1, help="Analyze every Nth frame")
+    parser.add_argument("--model", default="yolo11n-pose.pt")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--conf", type=float, default=0.4)
+    parser.add_argument("--dim", type=int, default=int(os.getenv("EMBED_DIM", 128)))
+    parser.add_argument("--checkpoint-every", type=int, default=900, help="Frames between checkpoints")
+    parser.add_argument("--start-time", type=float, default=None, help="Epoch of the first frame (default: mtime - duration)")
+    parser.add_argument("--no-db", action="store_true", help="Only write timelines, skip embeddings/vector store")
+    parser.add_argument("--restart", action="store_true", help="Ignore existing checkpoints")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    os.makedirs(args.out, exist_ok=True)
+    videos = find_videos(args.inputs)
+    if not videos:
+        print("No videos found.")
+        return 1
+
+    opts = {
+        "out": args.out, "batch": max(1, args.batch), "stride": max(1, args.stride), "model": args.model,
+        "imgsz": args.imgsz, "conf": args.conf, "dim": args.dim, "checkpoint_every": args.checkpoint_every,
+        "start_time": args.start_time, "no_db": args.no_db, "restart": args.restart,
+    }
+    print(f"--- PANOPTES BATCH: {len(videos)} video(s), {args.workers} worker(s) ---")
+
+    t0 = time.time()
+    summaries = []
+    if args.workers <= 1:
+        for v in videos:
+            summaries.append(_worker(v, opts))
+            print(f"[BATCH] {summaries[-1]}")
+    else:
+        # spawn: CUDA/MPS and Ultralytics are not fork-safe
+        with ProcessPoolExecutor(max_workers=args.workers, mp_context=mp.get_context("spawn")) as pool:
+            futures = [pool.submit(_worker, v, opts) for v in videos]
+            for fut in as_completed(futures):
+                summaries.append(fut.result())
+                print(f"[BATCH] {summaries[-1]}")
+
+    frames = sum(s["frames"] for s in summaries)
+    elapsed = time.time() - t0
+    print(f"--- DONE: {frames} frames in {elapsed:.1f}s ({frames / max(elapsed, 1e-6):.1f} FPS aggregate), "
+          f"{sum(s['segments'] for s in summaries)} segments ---")
+    return 0 if all(not s["status"].startswith("error") for s in summaries) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
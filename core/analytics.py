@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+import numpy as np
+from detectors.knowledge_base import get_policy, BEHAVIOR_DB
+
+log = logging.getLogger("panoptes.analytics")
+
+# Dwell-time histogram bin edges (seconds): <5s, 5-15s, 15s-1m, 1-5m, 5-15m, >15m
+DWELL_EDGES = (5.0, 15.0, 60.0, 300.0, 900.0)
+DANGER = ("HIGH", "CRITICAL")
+WARNING = ("WARNING", "RESTRICTED")
+
+
+class AnalyticsAggregator:
+    """
+    Incremental aggregates of the behavior stream for /analytics and /history.
+    - update() is O(N tracks of the frame): only action TRANSITIONS of a track
+      are counted (per action, severity and policy), so a 10 minute FIGHT is one
+      incident, not 18000 frames.
+    - Minute buckets are a fixed ring (`window_minutes` slots indexed by
+      minute % window): incrementing and reading a trend never scans history.
+    - Dwell time (first -> last seen) goes to a fixed histogram when a track
+      expires; unique tracks is a counter bumped on the first sighting.
+    - Incidents (policy not ALLOWED) are kept in a bounded deque for /history.
+    - State is snapshotted as JSON every `snapshot_interval` seconds (background
+      thread) and reloaded on start, so counters survive restarts.
+    """
+    def __init__(self, window_minutes=1440, history_size=500, track_ttl=5.0,
+                 snapshot_interval=60.0, snapshot_path=None):
+        self.window = window_minutes
+        self.track_ttl = track_ttl
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_path = snapshot_path or os.getenv('ANALYTICS_SNAPSHOT', 'analytics_snapshot.json')
+        self.lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+        self.by_action = {}
+        self.by_severity = {}
+        self.by_policy = {}
+        self.total_events = 0
+        self.total_incidents = 0
+        self.unique_tracks = 0
+        # Ring of per-minute counts: [minute stamp, events, incidents]
+        self.minute_stamp = np.full(window_minutes, -1, dtype=np.int64)
+        self.minute_events = np.zeros(window_minutes, dtype=np.int64)
+        self.minute_incidents = np.zeros(window_minutes, dtype=np.int64)
+        self.dwell_hist = np.zeros(len(DWELL_EDGES) + 1, dtype=np.int64)
+        self.history = deque(maxlen=history_size)
+
+        self.tracks = {} # {(camera, track_id): {"action", "first", "last"}}
+        self._last_prune = 0.0
+        self._last_snapshot = time.time()
+        self._load()
+
+    # --- stream --------------------------------------------------------------
+    def update(self, detections, timestamp, camera="0"):
+        with self.lock:
+            for det in detections:
+                key = (camera, det["id"])
+                track = self.tracks.get(key)
+                if track is None:
+                    track = self.tracks[key] = {"action": None, "first": timestamp, "last": timestamp}
+                    self.unique_tracks += 1
+                track["last"] = timestamp
+                action = det.get("action", "NEUTRAL")
+                if action != track["action"]:
+                    track["action"] = action
+                    self._count(det, action, timestamp, camera)
+
+            # Expire lost tracks at most once per second (dwell histogram)
+            if timestamp - self._last_prune >= 1.0:
+                self._last_prune = timestamp
+                for key in [k for k, t in self.tracks.items() if timestamp - t["last"] > self.track_ttl]:
+                    t = self.tracks.pop(key)
+                    self.dwell_hist[np.searchsorted(DWELL_EDGES, t["last"] - t["first"])] += 1
+
+        if time.time() - self._last_snapshot >= self.snapshot_interval and not self._save_lock.locked():
+            self._last_snapshot = time.time()
+            state = self.to_dict()
+            threading.Thread(target=self._save, args=(state,), daemon=True).start()
+
+    def _count(self, det, action, timestamp, camera):
+        policy = det.get("policy") or get_policy(action)
+        severity = det.get("severity") or BEHAVIOR_DB.get(action, {}).get("severity", "INFO")
+        self.by_action[action] = self.by_action.get(action, 0) + 1
+        self.by_severity[severity] = self.by_severity.get(severity, 0) + 1
+        self.by_policy[policy] = self.by_policy.get(policy, 0) + 1
+        self.total_events += 1
+
+        minute = int(timestamp // 60)
+        slot = minute % self.window
+        if self.minute_stamp[slot] != minute:
+            # Slot held a minute from a previous lap of the ring
+            self.minute_stamp[slot] = minute
+            self.minute_events[slot] = 0
+            self.minute_incidents[slot] = 0
+        self.minute_events[slot] += 1
+
+        if policy not in ("ALLOWED", "UNKNOWN"):
+            self.total_incidents += 1
+            self.minute_incidents[slot] += 1
+            self.history.append({
+                "timestamp": timestamp, "camera": camera, "track_id": det["id"],
+                "global_id": det.get("global_id"), "action": action,
+                "policy": policy, "severity": severity,
+            })
+
+    # --- queries (independent of history length) ---------------------------
+    def trend(self, minutes=60, bucket=1, now=None, incidents=False):
+        """
+        Counts per `bucket` minutes over the last `minutes` (oldest first).
+        Always ceil(minutes / bucket) values: a partial oldest bucket is padded
+        with minutes outside the window, which count as 0.
+        """
+        if bucket < 1:
+            raise ValueError(f"bucket must be >= 1 minute, got {bucket}")
+        now_minute = int((now or time.time()) // 60)
+        minutes = -(-min(minutes, self.window) // bucket) * bucket
+        wanted = np.arange(now_minute - minutes + 1, now_minute + 1)
+        slots = wanted % self.window
+        values = self.minute_incidents if incidents else self.minute_events
+        with self.lock:
+            counts = np.where(self.minute_stamp[slots] == wanted, values[slots], 0)
+        return counts.reshape(-1, bucket).sum(axis=1).tolist()
+
+    def summary(self, now=None):
+        trend = self.trend(min(1440, self.window), 60, now) # Last 24h, hourly
+        with self.lock:
+            return {
+                "total_incidents": self.total_incidents,
+                "danger_count": sum(self.by_severity.get(s, 0) for s in DANGER),
+                "warning_count": sum(self.by_policy.get(p, 0) for p in WARNING),
+                "total_events": self.total_events,
+                "unique_tracks": self.unique_tracks,
+                "active_tracks": len(self.tracks),
+                "by_action": dict(self.by_action),
+                "by_severity": dict(self.by_severity),
+                "by_policy": dict(self.by_policy),
+                "dwell_histogram": {"edges": list(DWELL_EDGES), "counts": self.dwell_hist.tolist()},
+                "activity_trend": trend,
+            }
+
+    def recent(self, limit=50):
+        """Latest incidents, newest first."""
+        with self.lock:
+            items = list(self.history)
+        return items[::-1][:limit]
+
+    # --- persistence -----------------------------------------------------------
+    def to_dict(self):
+        with self.lock:
+            return {
+                "by_action": dict(self.by_action), "by_severity": dict(self.by_severity),
+                "by_policy": dict(self.by_policy), "total_events": self.total_events,
+                "total_incidents": self.total_incidents, "unique_tracks": self.unique_tracks,
+                "minute_stamp": self.minute_stamp.tolist(), "minute_events": self.minute_events.tolist(),
+                "minute_incidents": self.minute_incidents.tolist(), "dwell_hist": self.dwell_hist.tolist(),
+                "history": list(self.history),
+            }
+
+    def _save(self, state):
+        tmp = self.snapshot_path + ".tmp"
+        with self._save_lock:
+            try:
+                with open(tmp, "w") as f:
+                    json.dump(state, f)
+                os.replace(tmp, self.snapshot_path)
+            except Exception as e:
+                log.warning(f"Could not save analytics snapshot: {e}")
+
+    def save(self):
+        self._save(self.to_dict())
+
+    def _load(self):
+        try:
+            with open(self.snapshot_path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            log.warning(f"Ignoring analytics snapshot: {e}")
+            return
+        self.by_action = state.get("by_action", {})
+        self.by_severity = state.get("by_severity", {})
+        self.by_policy = state.get("by_policy", {})
+        self.total_events = int(state.get("total_events", 0))
+        self.total_incidents = int(state.get("total_incidents", 0))
+        self.unique_tracks = int(state.get("unique_tracks", 0))
+        if len(state.get("minute_stamp", [])) == self.window:
+            self.minute_stamp[:] = state["minute_stamp"]
+            self.minute_events[:] = state["minute_events"]
+            self.minute_incidents[:] = state["minute_incidents"]
+        if len(state.get("dwell_hist", [])) == len(self.dwell_hist):
+            self.dwell_hist[:] = state["dwell_hist"]
+        self.history.extend(state.get("history", []))
@@ -1,14 +1,10 @@
 import numpy as np
 import time
-from collections import deque, Counter
-
-class RollingAverage:
-    def __init__(self, window_size=5):
-        self.window = deque(maxlen=window_size)
-    
-    def update(self, value):
-        self.window.append(value)
-        return np.mean(self.window, axis=0)
+from detectors.predictive_brain import KinematicsEngine
+from detectors.rule_engine import RuleEngine, is_high_priority
+from detectors.knowledge_base import BEHAVIOR_DB, get_policy
+from detectors.temporal_action import TemporalActionModel
+from core.kalman import KalmanSmoother
 
 class StateDecay:
     def __init__(self, decay_seconds=0.5):
@@ -18,7 +14,7 @@ class StateDecay:
         
     def update(self, proposed_state, timestamp):
         # Immediate transition to High Priority states
-        if proposed_state in ["MANOS_ARRIBA", "AGRESION", "GOLPE"]:
+        if proposed_state == "GOLPE" or is_high_priority(proposed_state):
              self.current_state = proposed_state
              self.last_seen = timestamp
              return proposed_state
@@ -26,7 +22,7 @@ class StateDecay:
         # Decay Check
         if (timestamp - self.last_seen) < self.decay:
             # Keep holding the high priority state
-            if self.current_state != "NEUTRAL":
+            if is_high_priority(self.current_state):
                  return self.current_state
         
         # Otherwise accept proposed (likely NEUTRAL or common state)
@@ -35,68 +31,137 @@ class StateDecay:
         return proposed_state
 
 class BehaviorEngine:
-    def __init__(self):
+    def __init__(self, ref_width=640, track_ttl=5.0):
         self.track_data = {} # {id: {'params'...}}
+        # Box (4) + 17 keypoints (x, y) per track, one batched Kalman state for all tracks.
+        # Keypoints are noisier than boxes -> larger measurement noise.
+        self.smoother = KalmanSmoother(dims=4 + 34, meas_std=[0.004] * 4 + [0.008] * 34)
+        self.track_ttl = track_ttl
+        # Speed / running / loitering for all tracks in one vectorized update.
+        # Positions are fed in pixels of a `ref_width`-wide frame so the
+        # thresholds (px/sec) don't depend on the camera resolution.
+        self.kinematics = KinematicsEngine()
+        self.ref_width = ref_width
+        # Learned temporal classifier (optional: disabled if no ONNX model is exported)
+        self.temporal = TemporalActionModel()
+        self.temporal_threshold = 0.6
+        # Compiled BEHAVIOR_DB rules (shared by every track)
+        self.rules = RuleEngine()
         
-    def process(self, detection_id, keypoints, box, timestamp):
+    def process_batch(self, track_ids, keypoints, boxes, timestamp, kpt_conf=None, frame_shape=None):
         """
-        Main entry point for behavior logic per person.
-        Returns: (smoothed_box, action_label)
+        Main entry point for behavior logic, all persons of a frame at once.
+        track_ids: N ids, keypoints: (N, 17, 2) normalized (0 = missing) or None,
+        boxes: (N, 4) normalized, kpt_conf: optional (N, 17), frame_shape: (h, w) for speed scaling.
+        Returns: (smoothed_boxes (N, 4), smoothed_kpts (N, 17, 2) or None, actions [N], info)
+        info: dict of per-track lists: speed, is_running, is_loitering, policy, severity.
         """
-        # Init Track State
-        if detection_id not in self.track_data:
-            self.track_data[detection_id] = {
-                "box_avg": RollingAverage(window_size=5),
-                "kpts_avg": RollingAverage(window_size=5),
-                "decay": StateDecay(decay_seconds=0.5),
-                "classifier": ActionClassifier()
-            }
-            
-        t = self.track_data[detection_id]
+        n = len(track_ids)
+        if n == 0:
+            return np.zeros((0, 4)), None, [], {k: [] for k in ("speed", "is_running", "is_loitering", "policy", "severity")}
         
-        # 1. Smooth Data
-        smooth_box = t["box_avg"].update(np.array(box))
-        smooth_kpts = None
-        if len(keypoints) > 0:
-            smooth_kpts = t["kpts_avg"].update(np.array(keypoints))
-            
-        # 2. Classify
-        raw_action = "NEUTRAL"
-        if smooth_kpts is not None:
-            raw_action = t["classifier"].classify(smooth_kpts)
-            
-        # 3. Apply State Decay (Anti-Freeze)
-        final_action = t["decay"].update(raw_action, timestamp)
+        # 1. Smooth Data (Kalman, vectorized over tracks)
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(n, 4)
+        has_kpts = keypoints is not None and len(keypoints) == n and np.size(keypoints) > 0
+        kp = np.asarray(keypoints, dtype=np.float64)[..., :2].reshape(n, 34) if has_kpts else np.zeros((n, 34))
+        kp_valid = np.repeat(kp.reshape(n, 17, 2).any(axis=2), 2, axis=1)
+        weight = np.ones((n, 38))
+        if kpt_conf is not None:
+            weight[:, 4:] = np.repeat(np.asarray(kpt_conf, dtype=np.float64).reshape(n, 17), 2, axis=1)
+        valid = np.concatenate([np.ones((n, 4), dtype=bool), kp_valid], axis=1)
         
-        return smooth_box, final_action
-
-class ActionClassifier:
-    def classify(self, lm):
-        # lm is (17, 2) or (17, 3) normalized
-        if len(lm) < 17: return "NEUTRAL"
+        smooth = self.smoother.update(track_ids, np.concatenate([boxes, kp], axis=1), timestamp,
+                                      valid=valid, weight=weight)
+        smooth_boxes = smooth[:, :4]
+        # Keep missing joints at 0 so renderers/classifiers skip them
+        smooth_kpts = np.where(kp_valid, smooth[:, 4:], 0.0).reshape(n, 17, 2) if has_kpts else None
+        conf = weight[:, 4::2] if kpt_conf is not None else None
         
-        # Helpers
-        def p(i): return np.array([lm[i][0], lm[i][1]]) # X, Y
+        # 2. Kinematics (speed / running / loitering), all tracks at once
+        h, w = frame_shape[:2] if frame_shape is not None else (9, 16)
+        scale = np.array([self.ref_width, self.ref_width * h / w])
+        centers = (smooth_boxes[:, :2] + smooth_boxes[:, 2:]) / 2 * scale
+        dyn = self.kinematics.update(track_ids, centers, timestamp)
         
-        nose = p(0)
-        l_wr = p(9); r_wr = p(10)
-        l_sh = p(5); r_sh = p(6)
+        # 3a. Rules from knowledge_base, evaluated as array predicates over all tracks
+        if smooth_kpts is not None:
+            rule_actions, _, _ = self.rules.evaluate(smooth_kpts, conf, dyn)
+        else:
+            rule_actions = ["NEUTRAL"] * n
+        
+        # 3b. Temporal model: one batched call over every track with a full window
+        temporal = {}
+        if smooth_kpts is not None and self.temporal.enabled:
+            temporal = self.temporal.update(track_ids, smooth_kpts, conf)
         
-        # 1. Manos Arriba (Wrists above nose)
-        # Note: Y increases downwards in screen coords. So Above means Y < Noise_Y
-        if (l_wr[1] < nose[1]) and (r_wr[1] < nose[1]):
-            return "MANOS_ARRIBA"
+        actions = []
+        for i, t_id in enumerate(track_ids):
+            # Init Track State
+            decay = self.track_data.get(t_id)
+            if decay is None:
+                decay = self.track_data[t_id] = StateDecay(decay_seconds=0.5)
             
-        # 2. Agresion (Fighting Stance) - Wrists near shoulders/face
-        # Distance check
-        torso_scale = np.linalg.norm(l_sh - r_sh) * 2 # Approximate torso height ref
-        if torso_scale == 0: torso_scale = 1.0
+            # Learned temporal label wins when confident
+            raw_action = rule_actions[i]
+            label, prob = temporal.get(t_id, ("NEUTRAL", 0.0))
+            if label != "NEUTRAL" and prob >= self.temporal_threshold:
+                raw_action = label
+                
+            # 4. Apply State Decay (Anti-Freeze)
+            actions.append(decay.update(raw_action, timestamp))
         
-        d_l = np.linalg.norm(l_wr - nose)
-        d_r = np.linalg.norm(r_wr - nose)
+        # 5. Forget lost tracks
+        for t_id in self.smoother.prune(timestamp, self.track_ttl):
+            self.track_data.pop(t_id, None)
+            self.temporal.remove(t_id)
+            self.kinematics.remove(t_id)
         
-        if (d_l < 0.3 * torso_scale) or (d_r < 0.3 * torso_scale):
-             # Also check they are NOT down at hips (handled by distance to nose)
-             return "AGRESION"
-             
-        return "NEUTRAL"
+        info = {
+            "speed": [round(float(v), 1) for v in dyn["speed"]],
+            "is_running": [bool(v) for v in dyn["is_running"]],
+            "is_loitering": [bool(v) for v in dyn["is_loitering"]],
+            "policy": [get_policy(a) for a in actions],
+            "severity": [BEHAVIOR_DB.get(a, {}).get("severity", "INFO") for a in actions],
+        }
+        return smooth_boxes, smooth_kpts, actions, info
+
+    def process(self, detection_id, keypoints, box, timestamp):
+        """
+        Single-person entry point (legacy). Returns: (smoothed_box, action_label)
+        """
+        kpts = np.asarray(keypoints, dtype=np.float64)[None] if len(keypoints) > 0 else None
+        boxes, _, actions, _ = self.process_batch([detection_id], kpts, [box], timestamp)
+        return boxes[0], actions[0]
+
+    def predict_detections(self, detections, timestamp):
+        """
+        Copies of `detections` with boxes/keypoints extrapolated by the Kalman
+        filter to `timestamp` (e.g. capture time of the frame being rendered).
+        """
+        predicted = self.smoother.predict(timestamp, [d["id"] for d in detections])
+        out = []
+        for det in detections:
+            state = predicted.get(det["id"])
+            if state is None:
+                out.append(det)
+                continue
+            det = dict(det)
+            det["box_norm"] = state[:4].tolist()
+            if det.get("keypoints_norm"):
+                kp = state[4:].reshape(17, 2)
+                missing = ~np.asarray(det["keypoints_norm"], dtype=np.float64)[:, :2].any(axis=1)
+                kp[missing] = 0.0
+                det["keypoints_norm"] = kp.tolist()
+            out.append(det)
+        return out
+
+class ActionClassifier:
+    """Single-skeleton view over the shared RuleEngine (knowledge_base driven)."""
+    def __init__(self, engine=None):
+        self.engine = engine or RuleEngine()
+        
+    def classify(self, lm, dynamics=None):
+        # lm is (17, 2) or (17, 3) normalized
+        if len(lm) < 17: return "NEUTRAL"
+        actions, _, _ = self.engine.evaluate(np.asarray(lm, dtype=np.float32)[None], dynamics=dynamics)
+        return actions[0]
@@ -0,0 +1,275 @@
+import time
+import platform
+import shutil
+import threading
+import logging
+import cv2
+import numpy as np
+from core.sources import is_paced_source, open_paced_source
+
+log = logging.getLogger("panoptes.capture")
+
+
+def is_network_source(source):
+    return isinstance(source, str) and source.split("://")[0].lower() in ("rtsp", "rtsps", "rtmp", "http", "https", "udp", "tcp")
+
+
+class OpenCVCapture:
+    """
+    cv2.VideoCapture wrapper with explicit grab()/retrieve() separation.
+    With latest_only=True (default for RTSP/IP cameras) a grabber thread keeps
+    draining the device/network buffer with grab(), and read() only decodes
+    (retrieve) the most recent frame, so a slow consumer never sees stale video.
+    """
+    def __init__(self, source=0, width=None, height=None, fps=None, fourcc=None,
+                 latest_only=None, hw_accel=True):
+        self.source = source
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.fourcc = fourcc
+        self.latest_only = is_network_source(source) if latest_only is None else latest_only
+        self.hw_accel = hw_accel
+        self.cap = None
+        self.timestamp = 0.0
+
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._reader_waiting = False
+        self._grabbed = threading.Event()
+        self._grab_seq = 0
+        self._read_seq = 0
+        self._grab_ts = 0.0
+        self._grab_failed = False
+        self._grabber = None
+
+    def open(self):
+        if is_network_source(self.source) and self.hw_accel and hasattr(cv2, "CAP_PROP_HW_ACCELERATION"):
+            cap = cv2.VideoCapture(self.source, cv2.CAP_FFMPEG,
+                                   [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
+        else:
+            cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            cap.release()
+            return False
+
+        # Negotiation order matters: FourCC first (e.g. MJPG unlocks 1080p@30 on USB), then size, then FPS
+        if self.fourcc:
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.fourcc))
+        if self.width:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        if self.height:
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        cap.set(cv2.CAP_PROP_FPS, self.fps or 60)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        log.info(f"Capture negotiated {int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))}x{int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))}"
+                 f" @ {cap.get(cv2.CAP_PROP_FPS):.1f} FPS (source={self.source})")
+
+        self.cap = cap
+        if self.latest_only:
+            self._grab_failed = False
+            self._grabber = threading.Thread(target=self._grab_loop, daemon=True)
+            self._grabber.start()
+        return True
+
+    def isOpened(self):
+        return self.cap is not None and self.cap.isOpened() and not self._grab_failed
+
+    def _grab_loop(self):
+        while self.cap is not None:
+            with self._cond:
+                # Locks are not fair: without this the grabber could re-take the
+                # lock right after every grab() and starve read()'s retrieve()
+                while self._reader_waiting and self.cap is not None:
+                    self._cond.wait(0.1)
+                ok = self.cap is not None and self.cap.grab()
+            if not ok:
+                self._grab_failed = True
+                self._grabbed.set()
+                return
+            self._grab_seq += 1
+            self._grab_ts = time.time()
+            self._grabbed.set()
+
+    def read(self, timeout=2.0):
+        if self.cap is None:
+            return False, None
+
+        if not self.latest_only:
+            if not self.cap.grab():
+                return False, None
+            self.timestamp = time.time()
+            return self.cap.retrieve()
+
+        # Wait for a frame newer than the last one we decoded
+        while self._grab_seq == self._read_seq:
+            if self._grab_failed or not self._grabbed.wait(timeout):
+                return False, None
+            self._grabbed.clear()
+        if self._grab_failed:
+            return False, None
+        self._reader_waiting = True # Grabber yields the lock after its current grab()
+        with self._cond:
+            self._reader_waiting = False
+            self._cond.notify_all()
+            if self.cap is None:
+                return False, None
+            self._read_seq = self._grab_seq
+            self.timestamp = self._grab_ts
+            return self.cap.retrieve()
+
+    def release(self):
+        cap, self.cap = self.cap, None
+        if cap is not None:
+            with self._lock:
+                cap.release()
+        if self._grabber is not None:
+            self._grabbed.set()
+            self._grabber.join(timeout=1.0)
+            self._grabber = None
+
+
+class FFmpegCapture:
+    """
+    Decodes the source in an FFmpeg subprocess (via ffmpeg-python) and reads
+    raw BGR frames from its stdout straight into preallocated buffers.
+    A small ring of buffers is rotated so a published frame is never
+    overwritten while consumers may still be copying it. Frames older than
+    the ring ARE overwritten: anything kept longer must be copied
+    (reuses_buffers, see VisionThread._prepare_preview).
+    """
+    reuses_buffers = True
+    def __init__(self, source, width=None, height=None, fps=None, fourcc=None,
+                 latest_only=None, hw_accel=True, num_buffers=3):
+        self.source = source
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.fourcc = fourcc
+        self.hw_accel = hw_accel
+        self.num_buffers = num_buffers
+        self.proc = None
+        self.timestamp = 0.0
+        self._buffers = []
+        self._idx = 0
+
+    # CAMERA_FOURCC -> FFmpeg device input format
+    FOURCC_FORMATS = {"MJPG": "mjpeg", "H264": "h264", "YUYV": "yuyv422", "YUY2": "yuyv422"}
+
+    def _input_args(self):
+        """(input name, demuxer options) shared by ffprobe and the decoder."""
+        opts = {}
+        source = self.source
+        if isinstance(source, int):
+            # Local devices
+            if platform.system() == "Darwin":
+                opts["f"] = "avfoundation"
+                source = str(source)
+            else:
+                opts["f"] = "v4l2"
+                source = f"/dev/video{source}"
+            if self.fourcc:
+                fmt = self.FOURCC_FORMATS.get(self.fourcc.upper(), self.fourcc.lower())
+                if opts["f"] == "v4l2":
+                    opts["input_format"] = fmt
+                else:
+                    opts["vcodec"] = fmt
+        elif source.lower().startswith("rtsp"):
+            opts["rtsp_transport"] = "tcp"
+        if is_network_source(self.source):
+            opts["fflags"] = "nobuffer"
+            opts["flags"] = "low_delay"
+        return source, opts
+
+    def _input(self, ffmpeg):
+        source, opts = self._input_args()
+        if self.hw_accel:
+            opts["hwaccel"] = "auto"
+        return ffmpeg.input(source, **opts)
+
+    def open(self):
+        try:
+            import ffmpeg
+        except ImportError:
+            log.error("ffmpeg-python not installed, FFmpeg capture unavailable")
+            return False
+
+        width, height = self.width, self.height
+        if not (width and height):
+            try:
+                source, opts = self._input_args() # Same demuxer as the decoder (avfoundation, v4l2...)
+                probe = ffmpeg.probe(source, **opts)
+                video = next(s for s in probe["streams"] if s.get("codec_type") == "video")
+                width = width or int(video["width"])
+                height = height or int(video["height"])
+            except Exception as e:
+                log.error(f"ffprobe failed for {self.source}: {e}")
+                return False
+
+        stream = self._input(ffmpeg)
+        if self.fps:
+            stream = stream.filter("fps", fps=self.fps)
+        if self.width or self.height:
+            stream = stream.filter("scale", width, height)
+        try:
+            self.proc = (
+                stream.output("pipe:", format="rawvideo", pix_fmt="bgr24")
+                .global_args("-loglevel", "error", "-nostdin")
+                .run_async(pipe_stdout=True)
+            )
+        except Exception as e:
+            log.error(f"FFmpeg spawn failed: {e}")
+            return False
+
+        self.width, self.height = width, height
+        self._buffers = [np.empty((height, width, 3), dtype=np.uint8) for _ in range(self.num_buffers)]
+        log.info(f"FFmpeg capture {width}x{height} (source={self.source})")
+        return True
+
+    def isOpened(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def read(self):
+        if self.proc is None:
+            return False, None
+        frame = self._buffers[self._idx]
+        self._idx = (self._idx + 1) % self.num_buffers
+        view = memoryview(frame.reshape(-1))
+        got = 0
+        while got < len(view):
+            n = self.proc.stdout.readinto(view[got:])
+            if not n:
+                return False, None
+            got += n
+        self.timestamp = time.time()
+        return True, frame
+
+    def release(self):
+        proc, self.proc = self.proc, None
+        if proc is not None:
+            try:
+                proc.kill()
+                proc.wait(timeout=1.0)
+            except Exception:
+                pass
+
+
+def open_capture(source, backend="opencv", **options):
+    """
+    Factory for capture backends. backend: "opencv" | "ffmpeg" | "auto".
+    "auto" uses FFmpeg for network streams when the binary is available.
+    "synthetic", "replay://file" and "images://dir" sources need no camera
+    (see core.sources).
+    Returns an opened capture or None.
+    """
+    if is_paced_source(source):
+        return open_paced_source(source, **options)
+    if backend == "auto":
+        backend = "ffmpeg" if is_network_source(source) and shutil.which("ffmpeg") else "opencv"
+    cls = FFmpegCapture if backend == "ffmpeg" else OpenCVCapture
+    cap = cls(source, **options)
+    if not cap.open():
+        cap.release()
+        return None
+    return cap
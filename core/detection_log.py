@@ -0,0 +1,205 @@
+import io
+import json
+import mmap
+import struct
+import time
+import logging
+import numpy as np
+
+log = logging.getLogger("panoptes.detlog")
+
+MAGIC = b"PDET"
+CHUNK = b"CHNK"
+VERSION = 1
+HAS_KPTS, HAS_CONF = 1, 2
+
+# Per chunk of F frames / N detections, columns back to back (little endian):
+#   timestamp float64[F] | height uint16[F] | width uint16[F] | count uint16[F] | flags uint8[F]
+#   id int32[N] | box float32[N, 4] | kpts uint16[N, 17, 2] | conf uint8[N, 17]
+# kpts are normalized coordinates * 65535 (0 = missing joint, like the model
+# output), conf * 255. About 105 bytes per detection.
+FRAME_COLUMNS = (("timestamp", "<f8", ()), ("height", "<u2", ()), ("width", "<u2", ()),
+                 ("count", "<u2", ()), ("flags", "u1", ()))
+DET_COLUMNS = (("id", "<i4", ()), ("box", "<f4", (4,)), ("kpts", "<u2", (17, 2)), ("conf", "u1", (17,)))
+
+
+class DetectionWriter:
+    """
+    Records the model output of every frame (track ids, boxes, keypoints,
+    confidences, timestamp: exactly what BehaviorEngine.process_batch gets)
+    into a compact columnar file. Frames are buffered and written
+    `chunk_frames` at a time, so write() is a few list appends.
+    """
+    def __init__(self, path, chunk_frames=512, meta=None):
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.file = open(path, "wb")
+        header = json.dumps(dict(meta or {}, created=time.time())).encode()
+        self.file.write(MAGIC + struct.pack("<II", VERSION, len(header)) + header)
+        self.frames = []
+        self.total_frames = 0
+        self.total_dets = 0
+
+    def write(self, timestamp, frame_shape, ids, boxes, kpts=None, kconf=None):
+        n = len(ids)
+        flags = (HAS_KPTS if kpts is not None else 0) | (HAS_CONF if kconf is not None else 0)
+        self.frames.append((timestamp, frame_shape[0], frame_shape[1], n, flags,
+                            np.asarray(ids, dtype=np.int32).reshape(n),
+                            np.asarray(boxes, dtype=np.float32).reshape(n, 4),
+                            None if kpts is None else np.asarray(kpts, dtype=np.float32)[..., :2].reshape(n, 17, 2),
+                            None if kconf is None else np.asarray(kconf, dtype=np.float32).reshape(n, 17)))
+        if len(self.frames) >= self.chunk_frames:
+            self.flush()
+
+    def flush(self):
+        if not self.frames or self.file is None:
+            return
+        frames, self.frames = self.frames, []
+        n = sum(f[3] for f in frames)
+        ids = np.concatenate([f[5] for f in frames]) if n else np.zeros(0, np.int32)
+        boxes = np.concatenate([f[6] for f in frames]) if n else np.zeros((0, 4), np.float32)
+        kpts = np.zeros((n, 17, 2), dtype=np.uint16)
+        conf = np.zeros((n, 17), dtype=np.uint8)
+        off = 0
+        for f in frames:
+            if f[7] is not None:
+                kpts[off:off + f[3]] = np.round(np.clip(f[7], 0.0, 1.0) * 65535)
+            if f[8] is not None:
+                conf[off:off + f[3]] = np.round(np.clip(f[8], 0.0, 1.0) * 255)
+            off += f[3]
+
+        buf = io.BytesIO()
+        for i, (_, dtype, _) in enumerate(FRAME_COLUMNS):
+            buf.write(np.array([f[i] for f in frames], dtype=dtype).tobytes())
+        for column, (_, dtype, _) in zip((ids, boxes, kpts, conf), DET_COLUMNS):
+            buf.write(np.ascontiguousarray(column, dtype=dtype).tobytes())
+        payload = buf.getvalue()
+        self.file.write(CHUNK + struct.pack("<III", len(frames), n, len(payload)) + payload)
+        self.total_frames += len(frames)
+        self.total_dets += n
+
+    def close(self):
+        if self.file is None:
+            return
+        self.flush()
+        self.file.close()
+        self.file = None
+        log.info(f"Detection log {self.path}: {self.total_frames} frames, {self.total_dets} detections")
+
+
+class DetectionLog:
+    """
+    Memory-mapped reader of a DetectionWriter file. Columns are numpy views
+    over the map (no parsing); frames() dequantizes one chunk at a time.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:4] != MAGIC:
+            raise ValueError(f"{path} is not a detection log")
+        version, meta_len = struct.unpack_from("<II", self.map, 4)
+        if version != VERSION:
+            raise ValueError(f"Unsupported detection log version {version}")
+        self.meta = json.loads(self.map[12:12 + meta_len])
+        self.chunks = []
+        pos = 12 + meta_len
+        while pos + 16 <= len(self.map):
+            if self.map[pos:pos + 4] != CHUNK:
+                log.warning(f"{path}: corrupt chunk at {pos}, ignoring the rest")
+                break
+            n_frames, n_dets, size = struct.unpack_from("<III", self.map, pos + 4)
+            if pos + 16 + size > len(self.map):
+                log.warning(f"{path}: truncated last chunk")
+                break
+            self.chunks.append(self._columns(pos + 16, n_frames, n_dets))
+            pos += 16 + size
+
+    def _columns(self, offset, n_frames, n_dets):
+        cols = {}
+        for columns, rows in ((FRAME_COLUMNS, n_frames), (DET_COLUMNS, n_dets)):
+            for name, dtype, shape in columns:
+                dt = np.dtype(dtype)
+                count = rows * int(np.prod(shape, dtype=np.int64))
+                cols[name] = np.frombuffer(self.map, dtype=dt, count=count, offset=offset).reshape((rows,) + shape)
+                offset += count * dt.itemsize
+        return cols
+
+    @property
+    def num_frames(self):
+        return sum(len(c["timestamp"]) for c in self.chunks)
+
+    @property
+    def num_detections(self):
+        return sum(len(c["id"]) for c in self.chunks)
+
+    @property
+    def duration(self):
+        if not self.chunks:
+            return 0.0
+        return float(self.chunks[-1]["timestamp"][-1] - self.chunks[0]["timestamp"][0])
+
+    def frames(self, dequantize=True):
+        """
+        Yields (timestamp, (h, w), ids, boxes (N, 4), kpts (N, 17, 2) or None,
+        conf (N, 17) or None) per frame. dequantize=False yields the stored
+        uint16 / uint8 columns.
+        """
+        for c in self.chunks:
+            kpts_all = c["kpts"].astype(np.float32) / 65535 if dequantize else c["kpts"]
+            conf_all = c["conf"].astype(np.float32) / 255 if dequantize else c["conf"]
+            ends = np.cumsum(c["count"], dtype=np.int64)
+            starts = ends - c["count"]
+            for i, (ts, h, w, flags) in enumerate(zip(c["timestamp"].tolist(), c["height"].tolist(),
+                                                      c["width"].tolist(), c["flags"].tolist())):
+                s, e = starts[i], ends[i]
+                yield (ts, (h, w), c["id"][s:e].tolist(), c["box"][s:e],
+                       kpts_all[s:e] if flags & HAS_KPTS else None,
+                       conf_all[s:e] if flags & HAS_CONF else None)
+
+    def close(self):
+        self.chunks = []
+        try:
+            self.map.close()
+        except BufferError:
+            pass # Frames still referenced by the caller: unmapped when they are freed
+
+
+def replay(detection_log, engine=None, repeat=1, step=None):
+    """
+    Feeds a recorded log to BehaviorEngine.process_batch as fast as it goes
+    (or to `step(ts, shape, ids, boxes, kpts, conf)` for other stacks).
+    Each repeat shifts the timestamps past the previous pass, so time never
+    goes backwards for the engine. Returns throughput and per-frame latency.
+    """
+    if step is None:
+        if engine is None:
+            from core.behavior import BehaviorEngine
+            engine = BehaviorEngine()
+        def step(ts, shape, ids, boxes, kpts, conf):
+            engine.process_batch(ids, kpts, boxes, ts, conf, frame_shape=shape)
+    frames = list(detection_log.frames()) # Decode outside the timed loop
+    span = detection_log.duration + 1.0
+    latencies = np.empty(len(frames) * repeat, dtype=np.float64)
+    dets = 0
+    k = 0
+    start = time.perf_counter()
+    for r in range(repeat):
+        shift = r * span
+        for ts, shape, ids, boxes, kpts, conf in frames:
+            t0 = time.perf_counter()
+            step(ts + shift, shape, ids, boxes, kpts, conf)
+            latencies[k] = time.perf_counter() - t0
+            k += 1
+            dets += len(ids)
+    elapsed = time.perf_counter() - start
+    ms = latencies * 1000
+    return {
+        "frames": k,
+        "detections": dets,
+        "seconds": round(elapsed, 3),
+        "fps": round(k / elapsed, 1) if elapsed else None,
+        "detections_per_minute": round(dets / elapsed * 60) if elapsed else None,
+        "frame_ms": {"mean": round(float(ms.mean()), 3), "p50": round(float(np.percentile(ms, 50)), 3),
+                     "p99": round(float(np.percentile(ms, 99)), 3), "max": round(float(ms.max()), 3)} if k else None,
+    }
@@ -0,0 +1,242 @@
+import math
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+log = logging.getLogger("panoptes.heatmap")
+
+KINDS = ("occupancy", "trajectory")
+
+
+class _CameraGrids:
+    """Per-camera state: time-bucketed grids, decayed live grids and last foot-points."""
+    def __init__(self, shape):
+        self.buckets = OrderedDict() # {bucket index: (2, gh, gw) float32 [occupancy, trajectory]}
+        self.live = np.zeros((2,) + shape, dtype=np.float32)
+        self.live_t = None
+        self.last_t = None
+        self.last_wall = 0.0 # time.time() when last_t arrived
+        self.prev = {} # {track_id: (x, y, t)}
+        self.aspect = 16 / 9
+        self.version = 0
+
+
+class HeatmapAccumulator:
+    """
+    "Where do people stand / walk" per camera, off the inference thread.
+    - update() only copies foot-points (bottom-center of each box, like
+      core.zones) into a bounded queue; a worker thread does the binning.
+    - Grids are (gh, gw) float32 per `bucket_seconds` time bucket, two layers:
+      occupancy (person-seconds per cell: each foot-point weighted by the frame
+      interval) and trajectory (path of each track rasterized between frames).
+      Binning is one np.bincount per layer and batch.
+    - A `live` grid decays exponentially (`half_life` seconds) for "recent
+      activity" views, decayed to the query time; range queries sum the stored
+      buckets.
+    - render_png() colorizes a grid as an RGBA overlay (transparent where
+      empty) cached per (query, grid version).
+    """
+    def __init__(self, grid=(72, 128), bucket_seconds=300, max_buckets=288, half_life=300.0,
+                 track_ttl=2.0, cache_size=32):
+        self.shape = tuple(grid)
+        self.bucket_seconds = bucket_seconds
+        self.max_buckets = max_buckets # 288 x 5 min = 24h
+        self.half_life = half_life
+        self.track_ttl = track_ttl
+        self.cameras = {}
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.cache_size = cache_size
+
+        self.jobs = queue.Queue(maxsize=64) # Drop frames rather than lag behind
+        self.dropped = 0
+        self.running = False
+        self.thread = None
+
+    # --- lifecycle ---------------------------------------------------------
+    def start(self):
+        if self.running: return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="heatmap", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1.0)
+
+    # --- inference thread ----------------------------------------------------
+    def update(self, camera, detections, timestamp, frame_shape=None):
+        """Queues the foot-points of a frame (a few array copies, no binning)."""
+        if not self.running:
+            self.start()
+        if detections:
+            boxes = np.array([d["box_norm"] for d in detections], dtype=np.float32)
+            feet = np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, boxes[:, 3]], axis=1)
+            ids = np.array([d["id"] for d in detections], dtype=np.int64)
+        else:
+            feet, ids = np.zeros((0, 2), dtype=np.float32), np.zeros(0, dtype=np.int64)
+        try:
+            self.jobs.put_nowait((camera, timestamp, ids, feet, frame_shape))
+        except queue.Full:
+            self.dropped += 1
+
+    # --- worker thread -------------------------------------------------------
+    def _run(self):
+        while self.running:
+            try:
+                job = self.jobs.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            try:
+                self._accumulate(*job)
+            except Exception as e:
+                log.warning(f"Heatmap error: {e}")
+
+    def _bin(self, points, weights=None):
+        gh, gw = self.shape
+        cols = np.clip((points[:, 0] * gw).astype(np.int64), 0, gw - 1)
+        rows = np.clip((points[:, 1] * gh).astype(np.int64), 0, gh - 1)
+        return np.bincount(rows * gw + cols, weights=weights, minlength=gh * gw).reshape(self.shape)
+
+    def _segments(self, cam, ids, feet, timestamp):
+        """Samples (about one per cell) along each track's path since its previous frame."""
+        prev = [cam.prev.get(int(t)) for t in ids]
+        k = [i for i, p in enumerate(prev) if p is not None and timestamp - p[2] <= 1.0]
+        if not k:
+            return np.zeros((0, 2), dtype=np.float32)
+        a = np.array([prev[i][:2] for i in k], dtype=np.float32)
+        b = feet[k]
+        delta = b - a
+        # Re-assigned track ids / tracker jumps are not paths
+        ok = np.abs(delta).max(axis=1) < 0.25
+        a, delta = a[ok], delta[ok]
+        steps = np.maximum(np.ceil(np.abs(delta) * (self.shape[1], self.shape[0])).max(axis=1).astype(np.int64), 1)
+        t = np.arange(steps.max() if len(steps) else 1)
+        valid = t[None] < steps[:, None]
+        frac = t[None] / steps[:, None]
+        pts = a[:, None] + frac[..., None] * delta[:, None]
+        return pts[valid]
+
+    def _accumulate(self, camera, timestamp, ids, feet, frame_shape):
+        with self.lock:
+            cam = self.cameras.get(camera)
+            if cam is None:
+                cam = self.cameras[camera] = _CameraGrids(self.shape)
+        if frame_shape:
+            cam.aspect = frame_shape[1] / frame_shape[0]
+
+        # Occupancy weight = time this frame stands for (person-seconds)
+        dt = min(timestamp - cam.last_t, 1.0) if cam.last_t is not None else 0.0
+        cam.last_t, cam.last_wall = timestamp, time.time()
+        layers = np.zeros((2,) + self.shape, dtype=np.float32)
+        if len(ids):
+            if dt > 0:
+                layers[0] = self._bin(feet, np.full(len(feet), dt))
+            path = self._segments(cam, ids, feet, timestamp)
+            if len(path):
+                layers[1] = self._bin(path)
+            for t_id, (x, y) in zip(ids.tolist(), feet.tolist()):
+                cam.prev[t_id] = (x, y, timestamp)
+        for t_id in [t for t, p in cam.prev.items() if timestamp - p[2] > self.track_ttl]:
+            del cam.prev[t_id]
+        if not layers.any():
+            return
+
+        bucket = int(timestamp // self.bucket_seconds)
+        with self.lock:
+            grid = cam.buckets.get(bucket)
+            if grid is None:
+                grid = cam.buckets[bucket] = np.zeros((2,) + self.shape, dtype=np.float32)
+                while len(cam.buckets) > self.max_buckets:
+                    cam.buckets.popitem(last=False)
+            grid += layers
+            if cam.live_t is not None:
+                cam.live *= 0.5 ** (max(timestamp - cam.live_t, 0.0) / self.half_life)
+            cam.live += layers
+            cam.live_t = timestamp
+            cam.version += 1
+
+    # --- queries -------------------------------------------------------------
+    def _now(self, cam):
+        # Camera clock (timestamps may be virtual, see core.sources), still
+        # running when frames stop so an idle live grid keeps fading
+        return cam.last_t + max(time.time() - cam.last_wall, 0.0) if cam.last_t is not None else None
+
+    def _live(self, cam, layer):
+        """Live grid decayed to now (it is only decayed on writes)."""
+        grid = cam.live[layer].copy()
+        now = self._now(cam)
+        if cam.live_t is not None and now is not None:
+            grid *= 0.5 ** (max(now - cam.live_t, 0.0) / self.half_life)
+        return grid
+
+    def query(self, camera, start=None, end=None, kind="occupancy"):
+        """
+        (gh, gw) float32 grid. start/end (epoch seconds) sum the buckets that
+        overlap the range; without a range, the decayed live grid.
+        """
+        layer = KINDS.index(kind)
+        with self.lock:
+            cam = self.cameras.get(str(camera))
+            if cam is None:
+                return np.zeros(self.shape, dtype=np.float32)
+            if start is None and end is None:
+                return self._live(cam, layer)
+            lo = -math.inf if start is None else int(start // self.bucket_seconds)
+            hi = math.inf if end is None else int(end // self.bucket_seconds)
+            out = np.zeros(self.shape, dtype=np.float32)
+            for b, grid in cam.buckets.items():
+                if lo <= b <= hi:
+                    out += grid[layer]
+            return out
+
+    def render_png(self, camera, start=None, end=None, kind="occupancy", width=640):
+        """RGBA PNG overlay (frame aspect ratio) of query(); cached until the grid changes."""
+        camera = str(camera)
+        with self.lock:
+            cam = self.cameras.get(camera)
+            version = cam.version if cam else 0
+            aspect = cam.aspect if cam else 16 / 9
+            live = None
+            if start is None and end is None and cam and cam.last_t is not None:
+                # The live grid fades between writes: re-render every 1/32 half-life
+                live = int(self._now(cam) // max(self.half_life / 32, 1.0))
+            # A range that ended before the newest bucket no longer changes
+            if cam and cam.buckets and end is not None and end // self.bucket_seconds < next(reversed(cam.buckets)):
+                version = -1
+        key = (camera, start, end, kind, width, live)
+        with self.cache_lock:
+            hit = self.cache.get(key)
+            if hit is not None and hit[0] == version:
+                self.cache.move_to_end(key)
+                return hit[1]
+
+        grid = self.query(camera, start, end, kind)
+        # Smooth at grid resolution (cheap), then upscale to the overlay size
+        grid = cv2.GaussianBlur(grid, (0, 0), 1.0)
+        h = max(1, int(round(width / aspect)))
+        grid = np.maximum(cv2.resize(grid, (width, h), interpolation=cv2.INTER_LINEAR), 0.0)
+        peak = float(grid.max())
+        # log scale: a doorway used all day shouldn't hide everything else
+        norm = np.log1p(grid / peak * 100) / math.log1p(100) if peak > 0 else grid
+        u8 = (np.clip(norm, 0.0, 1.0) * 255).astype(np.uint8)
+        rgba = cv2.cvtColor(cv2.applyColorMap(u8, cv2.COLORMAP_JET), cv2.COLOR_BGR2BGRA)
+        rgba[..., 3] = np.minimum(u8.astype(np.uint16) * 2, 200).astype(np.uint8)
+        ok, buf = cv2.imencode(".png", rgba)
+        png = buf.tobytes() if ok else b""
+
+        with self.cache_lock:
+            self.cache[key] = (version, png)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return png
+
+    def summary(self):
+        with self.lock:
+            return {camera: {"buckets": len(c.buckets), "version": c.version} for camera, c in self.cameras.items()}
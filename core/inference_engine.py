@@ -1,46 +1,74 @@
+import os
 import time
 import threading
-import torch
 import logging
-from ultralytics import YOLO
 from core.shared_state import SharedState
+from core.model_registry import ModelRegistry, default_device
 from core.behavior import BehaviorEngine
+from core.zones import ZoneMonitor
+from core.detection_log import DetectionWriter
 
 class InferenceEngine:
-    def __init__(self, model_path="yolo11n-pose.pt"):
+    def __init__(self, model_path="yolo11n-pose.pt", settings=None, source=0, imgsz=640, reid=None, analytics=None, heatmap=None, recorder=None,
+                 detection_log=None):
         self.running = False
         self.shared = SharedState()
         self.behavior = BehaviorEngine()
         self.thread = None
         self.model_path = model_path
         self.model = None
+        self.handle = None # core.model_registry.ModelHandle (shared weights + inference lock)
+        # Live reference to Orchestrator.settings (updated from /update_settings)
+        self.settings = settings if settings is not None else {}
+        self.source = source
+        self.imgsz = imgsz # Square model input built by VisionThread (see core.roi)
+        self.zones = ZoneMonitor()
+        self.emotions = None # TrackEmotionAnalyzer, created when settings["emotion_enabled"]
+        self.reid = reid # core.reid.ReIDService shared by all cameras (settings["reid_enabled"])
+        self.analytics = analytics # core.analytics.AnalyticsAggregator (incremental /analytics, /history)
+        self.heatmap = heatmap # core.heatmap.HeatmapAccumulator (binning runs in its own thread)
+        self.recorder = recorder # core.recorder.ClipRecorder (settings["record_enabled"])
+        # Model output of every frame -> columnar file for tests/replay_detections.py
+        self.detection_log_path = detection_log or os.getenv('DETECTION_LOG') or None
+        self.detection_log = None
         
-        # Hardware Acceleration Check
-        if torch.backends.mps.is_available():
-            self.device = "mps"
-            print("[BRAIN] 🚀 MPS (Apple Metal) Acceleration ENABLED")
-        elif torch.cuda.is_available():
-            self.device = "cuda"
-            print("[BRAIN] 🚀 CUDA Acceleration ENABLED")
-        else:
-            self.device = "cpu"
-            print("[BRAIN] ⚠️ Running on CPU")
+        self.device = None # Resolved in load_model (imports torch lazily)
 
     def load_model(self):
+        if self.handle is not None: return
         try:
-            # Verbose=False prevents log spam
-            self.model = YOLO(self.model_path)
-            self.model.to(self.device)
-            # Warmup
-            print("[BRAIN] Warming up model...")
-            self.model.predict("https://ultralytics.com/images/bus.jpg", verbose=False, device=self.device)
+            # Hardware Acceleration Check
+            self.device = default_device()
+            if self.device == "mps":
+                print("[BRAIN] 🚀 MPS (Apple Metal) Acceleration ENABLED")
+            elif self.device == "cuda":
+                print("[BRAIN] 🚀 CUDA Acceleration ENABLED")
+            else:
+                print("[BRAIN] ⚠️ Running on CPU")
+
+            # Shared, warmed-up weights. Own scope per source: the tracker state
+            # lives on the predictor, so each stream gets its own view of them.
+            print("[BRAIN] Loading + warming up model...")
+            self.handle = ModelRegistry().acquire(self.model_path, self.device, scope=f"track:{self.source}", imgsz=self.imgsz)
+            self.model = self.handle.model
+            self.device = self.handle.device
             print("[BRAIN] Model Ready.")
         except Exception as e:
             print(f"[BRAIN] Model Load Failed: {e}")
 
+    def release_model(self):
+        """Drops this engine's reference (the registry keeps the weights cached)."""
+        if self.handle is not None:
+            self.handle.release()
+            self.handle = None
+            self.model = None
+
     def start(self):
         if self.running: return
         self.load_model()
+        if self.detection_log_path and self.detection_log is None:
+            self.detection_log = DetectionWriter(self.detection_log_path, meta={"source": str(self.source),
+                                                                                "model": self.model_path})
         self.running = True
         self.thread = threading.Thread(target=self._inference_loop, daemon=True)
         self.thread.start()
@@ -49,56 +77,140 @@ class InferenceEngine:
         self.running = False
         if self.thread:
             self.thread.join(timeout=1.0)
+        if self.thread is None or not self.thread.is_alive():
+            self._close_detection_log()
+        # else: still mid-frame, _inference_loop closes the log (with that frame) on exit
+        self.release_model()
+
+    def _close_detection_log(self):
+        if self.detection_log is not None:
+            self.detection_log.close()
+            self.detection_log = None
 
     def _inference_loop(self):
+        try:
+            self._process_frames()
+        finally:
+            if not self.running: # Not restarted meanwhile (the new thread owns the log)
+                self._close_detection_log()
+
+    def _process_frames(self):
         last_processed_id = -1
         
         while self.running:
-            # 1. Get Frame
-            frame, frame_id = self.shared.get_frame_for_ai()
+            # 0. Tell the Vision Thread which ROIs / model size to prepare
+            self.shared.set_model_config(self._camera_setting("rois", []), self.imgsz)
+            
+            # 1. Get Model Input (letterboxed RGB, already model-sized by VisionThread)
+            model_input, layout, frame_id, timestamp = self.shared.get_model_input()
             
             # 2. Skip if no new frame
-            if frame is None or frame_id == last_processed_id:
+            if model_input is None or frame_id == last_processed_id:
                 time.sleep(0.01) # Poll interval
                 continue
+            if self.model is None:
+                time.sleep(0.5) # Model failed to load (DEGRADED): video only, nothing to infer
+                continue
                 
             last_processed_id = frame_id
             start_time = time.time()
             
-            # 3. Resize for Speed (Standard 640 for YOLO)
-            # Actually YOLO handles this, but manual resize avoids transfer overhead if frame is massive (4K)
-            # Assuming webcam is 720p/1080p, let's let YOLO handle it or resize to 640x360 explicit?
-            # Explicit resize often faster.
-            # h, w = frame.shape[:2]
-            # input_frame = cv2.resize(frame, (640, 640)) 
-            
             try:
-                # 4. Inference
-                # device=self.device is critical
-                # verbose=False
-                results = self.model.track(
-                    frame, 
-                    persist=True, 
-                    verbose=False, 
-                    device=self.device, 
-                    tracker="bytetrack.yaml",
-                    conf=0.4
-                )
+                # 3-5. Inference + Parse (canvas pixels -> full-frame normalized)
+                # timestamp = capture time of the frame (same clock the renderer predicts to)
+                detections = self.analyze(model_input, layout, [timestamp])[0]
+                frame_shape = (layout.frame_h, layout.frame_w)
+                
+                # 6. Zone Events (entry/exit/loitering per zone)
+                events = self._update_zones(detections, frame_shape, timestamp)
+                
+                # 7. Facial emotion of tracked persons (optional, every N frames per track)
+                self._update_emotions(detections, frame_shape)
+                
+                # 8. Global identities across track breaks / cameras (embedding runs in background)
+                if self.reid is not None and self.settings.get("reid_enabled"):
+                    self.reid.update(str(self.source), detections, timestamp, self.shared.get_frame_crops)
+                
+                # 9. Incremental analytics (counts action transitions only)
+                if self.analytics is not None:
+                    self.analytics.update(detections, timestamp, str(self.source))
+                if self.heatmap is not None:
+                    self.heatmap.update(str(self.source), detections, timestamp, frame_shape)
                 
-                # 5. Parse Results
-                detections = self._parse_results(results, frame.shape)
+                # 10. Event clips (pre-roll buffered / written by the recorder's threads)
+                if self.recorder is not None:
+                    if self.settings.get("record_enabled"):
+                        self.recorder.trigger(detections, timestamp, self.settings.get("record_actions", ()))
+                    elif self.recorder.running:
+                        self.recorder.stop()
                 
-                # 6. Push Update
+                # 11. Push Update
                 fps = 1.0 / (time.time() - start_time + 0.0001)
-                self.shared.update_detections(detections, fps)
+                self.shared.update_detections(detections, fps, events, frame_id, timestamp)
                 
             except Exception as e:
                 print(f"[BRAIN] Inference Error: {e}")
                 time.sleep(0.1)
 
-    def _parse_results(self, results, shape):
+    def _to_tensor(self, model_input):
+        # HWC / BHWC uint8 RGB -> BCHW float 0-1. Ultralytics skips its own
+        # letterbox/BGR->RGB for tensor input.
+        import torch
+        t = torch.from_numpy(model_input).to(self.device, non_blocking=True)
+        if t.ndim == 3:
+            t = t.unsqueeze(0)
+        return t.permute(0, 3, 1, 2).float().div_(255.0)
+
+    def analyze(self, model_inputs, layout, timestamps, persist=True):
+        """
+        Pose + track + behavior over prepared model inputs (HWC or BHWC RGB, see core.roi).
+        A batch must hold consecutive frames of ONE camera/video: ByteTrack consumes
+        them in order. persist=False resets the tracker (new video).
+        Returns one detections list per frame.
+        """
+        with self.handle.lock:
+            results = self.model.track(
+                self._to_tensor(model_inputs),
+                persist=persist,
+                verbose=False,
+                device=self.device,
+                tracker="bytetrack.yaml",
+                conf=self.settings.get("conf_threshold", 0.4)
+            )
+        shape = (layout.frame_h, layout.frame_w)
+        return [self._parse_results([r], shape, layout, ts) for r, ts in zip(results, timestamps)]
+
+    def _camera_setting(self, key, default):
+        # Settings may be global or keyed per camera source: {"0": [...], "rtsp://...": [...]}
+        value = self.settings.get(key, default)
+        if isinstance(value, dict) and key == "rois":
+            value = value.get(str(self.source), default)
+        return value
+
+    def _update_emotions(self, detections, shape):
+        if not self.settings.get("emotion_enabled"):
+            return
+        interval = int(self.settings.get("emotion_interval", 15))
+        if self.emotions is None:
+            from detectors.emotion_detector import TrackEmotionAnalyzer
+            self.emotions = TrackEmotionAnalyzer(interval=interval)
+        self.emotions.interval = interval
+        # Crops come from the latest full-res frame (at most a frame or two newer
+        # than the detections; the head box margin absorbs the motion)
+        self.emotions.update(detections, self.shared.get_frame_crops, shape)
+
+    def _update_zones(self, detections, shape, timestamp):
+        zones = dict(self.settings.get("zones") or {})
+        if self.settings.get("intrusion_zone"):
+            zones.setdefault("INTRUSION", self.settings["intrusion_zone"])
+        self.zones.configure(zones, shape, loitering_time=self.settings.get("loitering_time"))
+        return self.zones.update(detections, timestamp)
+
+    def _parse_results(self, results, shape, layout, timestamp=None):
         h, w = shape[:2]
         output = []
+        # Frame time (video time in batch/replay, wall clock when live)
+        if timestamp is None: timestamp = time.time()
         
         if not results: return output
         
@@ -106,33 +218,38 @@ class InferenceEngine:
         if r.boxes is None or r.boxes.id is None:
             return output
             
-        boxes = r.boxes.xyxyn.cpu().numpy() # Normalized 0-1
+        # Canvas pixels -> full-frame normalized 0-1 (identity when no ROIs)
+        boxes_px = r.boxes.xyxy.cpu().numpy()
         ids = r.boxes.id.int().cpu().numpy()
+        tiles = layout.tile_of(boxes_px)
+        boxes = layout.to_frame_norm(boxes_px.reshape(-1, 2, 2), tiles).reshape(-1, 4)
         
         # Keypoints
-        kpts = None
+        kpts = kconf = None
         if r.keypoints is not None:
-             kpts = r.keypoints.xyn.cpu().numpy() # Normalized 0-1
-             
-        for i, (box, track_id) in enumerate(zip(boxes, ids)):
-            kp = kpts[i] if kpts is not None else []
-            t_id = int(track_id)
-            
-            # --- BEHAVIOR & SMOOTHING ---
-            timestamp = time.time()
-            # Normalize keypoints for behavior? Behavior expects raw or norm?
-            # My behavior engine expects raw/norm consistent usage. 
-            # ActionClassifier.classify uses logic like 'wrists < nose'. 
-            # If norm 0-1 (y increases down), nose is e.g. 0.2, wrist 0.5.
-            # My ActionClassifier logic: if l_wr[1] < nose[1] => Wrist ABOVE nose.
-            # So normalize is fine.
-            
-            final_box, action = self.behavior.process(t_id, kp, box, timestamp)
-            
-            final_box = final_box.tolist()
-            # Calculate Pixels for Frontend (640x360 default reference or actual scale?)
-            # The frontend likely expects pixels relative to the video frame or a specific size.
-            # We have h, w from parse_results(results, frame.shape)
+             kpts_px = r.keypoints.xy.cpu().numpy()
+             missing = (kpts_px[..., 0] <= 0) & (kpts_px[..., 1] <= 0)
+             kpts = layout.to_frame_norm(kpts_px, tiles) # Normalized 0-1
+             kpts[missing] = 0.0
+             if r.keypoints.conf is not None:
+                 kconf = r.keypoints.conf.cpu().numpy()
+        
+        keep = tiles >= 0 # Center fell in canvas padding -> drop
+        ids = [int(t) for t in ids[keep]]
+        if kpts is not None: kpts = kpts[keep]
+        if kconf is not None: kconf = kconf[keep]
+        
+        if self.detection_log is not None:
+            self.detection_log.write(timestamp, shape, ids, boxes[keep], kpts, kconf)
+        
+        # --- BEHAVIOR & SMOOTHING (all tracks in one batched call) ---
+        # Keypoints stay normalized 0-1 (y increases down): 'wrist above nose' = l_wr[1] < nose[1].
+        final_boxes, final_kpts, actions, info = self.behavior.process_batch(
+            ids, kpts, boxes[keep], timestamp, kconf, frame_shape=shape)
+        
+        for i, t_id in enumerate(ids):
+            final_box = final_boxes[i].tolist()
+            # Pixels for Frontend, relative to the full video frame
             x1 = int(final_box[0] * w)
             y1 = int(final_box[1] * h)
             x2 = int(final_box[2] * w)
@@ -142,8 +259,13 @@ class InferenceEngine:
                 "id": t_id,
                 "box_norm": final_box, 
                 "box": [x1, y1, x2, y2], # RESTORED for Frontend
-                "keypoints_norm": kp.tolist() if len(kp) > 0 else [],
-                "action": action,
+                "keypoints_norm": final_kpts[i].tolist() if final_kpts is not None else [],
+                "action": actions[i],
+                "policy": info["policy"][i],
+                "severity": info["severity"][i],
+                "speed": info["speed"][i],
+                "is_running": info["is_running"][i],
+                "is_loitering": info["is_loitering"][i],
                 "timestamp": timestamp
             })
             
@@ -0,0 +1,160 @@
+import io
+import os
+import time
+import logging
+from collections import deque
+import cv2
+
+log = logging.getLogger("panoptes.jpeg")
+
+SUBSAMPLING = ("444", "422", "420")
+
+
+def _simplejpeg():
+    import simplejpeg
+    def encode(frame, quality, subsampling):
+        return simplejpeg.encode_jpeg(frame, quality=quality, colorspace="BGR",
+                                      colorsubsampling=subsampling, fastdct=True)
+    return encode
+
+
+def _turbojpeg():
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_444, TJSAMP_422, TJSAMP_420
+    jpeg = TurboJPEG()
+    samp = {"444": TJSAMP_444, "422": TJSAMP_422, "420": TJSAMP_420}
+    def encode(frame, quality, subsampling):
+        return jpeg.encode(frame, quality=quality, pixel_format=TJPF_BGR, jpeg_subsample=samp[subsampling])
+    return encode
+
+
+def _pil():
+    from PIL import Image
+    samp = {"444": 0, "422": 1, "420": 2}
+    def encode(frame, quality, subsampling):
+        buf = io.BytesIO()
+        Image.fromarray(frame[..., ::-1]).save(buf, "JPEG", quality=quality, subsampling=samp[subsampling])
+        return buf.getvalue()
+    return encode
+
+
+def _cv2():
+    samp = {"444": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444, "422": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_422,
+            "420": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420}
+    def encode(frame, quality, subsampling):
+        ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality,
+                                               cv2.IMWRITE_JPEG_SAMPLING_FACTOR, samp[subsampling]])
+        if not ok:
+            raise RuntimeError("cv2.imencode failed")
+        return buf.tobytes()
+    return encode
+
+
+# Fastest first: simplejpeg / PyTurboJPEG call libjpeg-turbo directly on BGR
+# (no channel swap, no extra copy); PIL needs an RGB view copy
+BACKENDS = {"simplejpeg": _simplejpeg, "turbojpeg": _turbojpeg, "cv2": _cv2, "pil": _pil}
+
+
+def load_backend(name="auto"):
+    """(name, encode(frame_bgr, quality, subsampling) -> bytes). 'auto' picks the first importable."""
+    names = list(BACKENDS) if name == "auto" else [name]
+    for n in names:
+        try:
+            return n, BACKENDS[n]()
+        except Exception as e:
+            if name != "auto":
+                log.warning(f"JPEG backend {n} unavailable ({e}), using cv2")
+    return "cv2", _cv2()
+
+
+class JpegEncoder:
+    """
+    JPEG encoding for one output stream (MJPEG feed, clip recorder...).
+    - backend: simplejpeg | turbojpeg | cv2 | pil | auto (env JPEG_BACKEND).
+    - subsampling: 444 | 422 | 420 chroma (env JPEG_SUBSAMPLING); 420 is about
+      a third smaller than 444 at the same quality.
+    - budget_kbps: bytes/second target (env STREAM_BUDGET_KBPS, 0 = off). Once a
+      second the measured output rate is compared with it: quality is lowered
+      first (down to min_quality), then the frame is downscaled (down to
+      min_scale); with headroom, scale is restored first, then quality.
+    metrics() reports the chosen settings and the measured encode time.
+    """
+    def __init__(self, quality=None, backend=None, subsampling=None, budget_kbps=None,
+                 min_quality=40, min_scale=0.4, adapt_interval=1.0):
+        self.backend, self._encode = load_backend(backend or os.getenv('JPEG_BACKEND', 'auto'))
+        self.max_quality = int(quality or os.getenv('JPEG_QUALITY', 85))
+        self.subsampling = str(subsampling or os.getenv('JPEG_SUBSAMPLING', '420'))
+        if self.subsampling not in SUBSAMPLING:
+            raise ValueError(f"subsampling must be one of {SUBSAMPLING}")
+        self.budget_kbps = float(budget_kbps if budget_kbps is not None else os.getenv('STREAM_BUDGET_KBPS', 0))
+        self.min_quality = min_quality
+        self.min_scale = min_scale
+        self.adapt_interval = adapt_interval
+
+        self.quality = self.max_quality
+        self.scale = 1.0
+        self.window = deque() # (time, bytes) of the last second
+        self.window_bytes = 0
+        self.encode_ms = 0.0 # EMA
+        self.frames = 0
+        self._last_adapt = time.time()
+
+    def configure(self, budget_kbps=None, quality=None, subsampling=None):
+        """Runtime changes (e.g. from settings); None leaves a value unchanged."""
+        if budget_kbps is not None:
+            self.budget_kbps = float(budget_kbps)
+            if not self.budget_kbps:
+                self.quality, self.scale = self.max_quality, 1.0
+        if quality is not None:
+            self.max_quality = int(quality)
+            self.quality = min(self.quality, self.max_quality) if self.budget_kbps else self.max_quality
+        if subsampling is not None and str(subsampling) in SUBSAMPLING:
+            self.subsampling = str(subsampling)
+
+    def encode(self, frame):
+        t0 = time.perf_counter()
+        if self.scale < 1.0:
+            h, w = frame.shape[:2]
+            frame = cv2.resize(frame, (max(2, int(w * self.scale)), max(2, int(h * self.scale))),
+                               interpolation=cv2.INTER_AREA)
+        data = self._encode(frame, self.quality, self.subsampling)
+        elapsed = (time.perf_counter() - t0) * 1000
+        self.encode_ms = elapsed if self.frames == 0 else 0.9 * self.encode_ms + 0.1 * elapsed
+        self.frames += 1
+
+        now = time.time()
+        self.window.append((now, len(data)))
+        self.window_bytes += len(data)
+        while self.window and self.window[0][0] < now - 1.0:
+            self.window_bytes -= self.window.popleft()[1]
+        if self.budget_kbps and now - self._last_adapt >= self.adapt_interval:
+            self._last_adapt = now
+            self._adapt()
+        return data
+
+    def _adapt(self):
+        rate = self.window_bytes * 8 / 1000 # kbit/s over the last second
+        budget = self.budget_kbps
+        if rate > budget * 1.05:
+            if self.quality > self.min_quality:
+                # Bytes fall roughly linearly with quality in the 40-90 range
+                self.quality = max(self.min_quality, int(self.quality - max(5, (self.quality - self.min_quality) * (1 - budget / rate))))
+            elif self.scale > self.min_scale:
+                # Bytes scale with pixel count
+                self.scale = max(self.min_scale, round(self.scale * max(0.75, (budget / rate) ** 0.5), 3))
+        elif rate < budget * 0.8:
+            if self.scale < 1.0:
+                self.scale = min(1.0, round(self.scale / 0.9, 3))
+            elif self.quality < self.max_quality:
+                self.quality = min(self.max_quality, self.quality + 5)
+
+    def metrics(self):
+        return {
+            "backend": self.backend,
+            "quality": self.quality,
+            "scale": self.scale,
+            "subsampling": self.subsampling,
+            "budget_kbps": self.budget_kbps or None,
+            "kbps": round(self.window_bytes * 8 / 1000, 1),
+            "encode_ms": round(self.encode_ms, 2),
+            "frames": self.frames,
+        }
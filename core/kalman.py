@@ -0,0 +1,139 @@
+import threading
+import numpy as np
+
+class KalmanSmoother:
+    """
+    Constant-velocity Kalman filter for ALL tracks at once.
+    Each track is a row; each row has D independent coordinates (box x1,y1,x2,y2
+    and optionally 17 keypoints x,y) with state [position, velocity].
+    Because the coordinates share the same dynamics, the 2x2 covariance is kept
+    as three (capacity, D) arrays (P00, P01, P11) and predict/update are plain
+    NumPy expressions over the whole batch - no per-track Python work.
+
+    Besides smoothing (no lag on fast motion, unlike a moving average), the
+    filter can extrapolate positions to any time between inference frames so
+    the renderer draws smooth boxes at display rate while the model runs slower.
+    """
+    def __init__(self, dims, capacity=64, meas_std=0.004, accel_std=2.0, max_extrapolation=0.3):
+        self.dims = dims
+        # meas_std: per-coordinate measurement noise (normalized 0-1 units), scalar or (D,)
+        self.r = np.broadcast_to(np.asarray(meas_std, dtype=np.float64) ** 2, (dims,)).copy()
+        self.q = accel_std ** 2 # White-noise acceleration spectral density
+        self.max_extrapolation = max_extrapolation
+        self.lock = threading.Lock()
+
+        self.slots = {} # {track_id: row}
+        self.free = []
+        self.capacity = 0
+        self._alloc(capacity)
+
+    def _alloc(self, capacity):
+        old = self.capacity
+        def grow(name, shape, dtype=np.float64):
+            arr = np.zeros(shape, dtype=dtype)
+            if old:
+                arr[:old] = getattr(self, name)
+            setattr(self, name, arr)
+        D = self.dims
+        for name in ("pos", "vel", "p00", "p01", "p11"):
+            grow(name, (capacity, D))
+        grow("ready", (capacity, D), bool) # Coordinate has been initialized
+        grow("t", capacity)
+        self.free.extend(range(capacity - 1, old - 1, -1))
+        self.capacity = capacity
+
+    def _rows(self, track_ids):
+        rows = np.empty(len(track_ids), dtype=np.int64)
+        for i, t_id in enumerate(track_ids):
+            row = self.slots.get(t_id)
+            if row is None:
+                if not self.free:
+                    self._alloc(self.capacity * 2)
+                row = self.slots[t_id] = self.free.pop()
+                self.ready[row] = False
+            rows[i] = row
+        return rows
+
+    def _predict(self, rows, dt):
+        dt = dt[:, None]
+        q = self.q
+        self.pos[rows] += self.vel[rows] * dt
+        p00, p01, p11 = self.p00[rows], self.p01[rows], self.p11[rows]
+        self.p00[rows] = p00 + dt * (2 * p01 + dt * p11) + q * dt ** 3 / 3
+        self.p01[rows] = p01 + dt * p11 + q * dt ** 2 / 2
+        self.p11[rows] = p11 + q * dt
+
+    def update(self, track_ids, measurements, timestamp, valid=None, weight=None):
+        """
+        track_ids: N ids, measurements: (N, D), timestamp: frame time.
+        valid: (N, D) bool mask of observed coordinates (missing keypoints = False).
+        weight: (N, D) confidence in (0, 1]; measurement noise is scaled by 1/weight^2.
+        Returns (N, D) filtered positions (unobserved, never-seen coords stay 0).
+        """
+        z = np.asarray(measurements, dtype=np.float64).reshape(len(track_ids), self.dims)
+        valid = np.ones(z.shape, dtype=bool) if valid is None else np.asarray(valid, dtype=bool)
+        r = self.r if weight is None else self.r / np.clip(weight, 0.05, 1.0) ** 2
+        r = np.broadcast_to(r, z.shape)
+
+        with self.lock:
+            rows = self._rows(track_ids)
+            dt = np.maximum(timestamp - self.t[rows], 0.0)
+            dt[~self.ready[rows].any(axis=1)] = 0.0
+            self._predict(rows, dt)
+
+            # Fresh coordinates: init at the measurement, velocity unknown
+            init = valid & ~self.ready[rows]
+            upd = valid & self.ready[rows]
+
+            pos, vel = self.pos[rows], self.vel[rows]
+            p00, p01, p11 = self.p00[rows], self.p01[rows], self.p11[rows]
+
+            s = p00 + r
+            k0, k1 = p00 / s, p01 / s
+            y = z - pos
+            pos = np.where(upd, pos + k0 * y, pos)
+            vel = np.where(upd, vel + k1 * y, vel)
+            n00 = np.where(upd, (1 - k0) * p00, p00)
+            n01 = np.where(upd, (1 - k0) * p01, p01)
+            n11 = np.where(upd, p11 - k1 * p01, p11)
+
+            pos = np.where(init, z, pos)
+            vel = np.where(init, 0.0, vel)
+            n00 = np.where(init, r, n00)
+            n01 = np.where(init, 0.0, n01)
+            n11 = np.where(init, 1.0, n11) # Large: ~1 frame-width/sec uncertainty
+
+            self.pos[rows], self.vel[rows] = pos, vel
+            self.p00[rows], self.p01[rows], self.p11[rows] = n00, n01, n11
+            self.ready[rows] |= valid
+            self.t[rows] = timestamp
+
+            return np.where(self.ready[rows], pos, 0.0)
+
+    def predict(self, timestamp, track_ids=None):
+        """
+        Extrapolated positions at `timestamp` without touching the filter state.
+        Returns {track_id: (D,) array}. Extrapolation is capped at max_extrapolation s.
+        """
+        with self.lock:
+            ids = list(self.slots.keys()) if track_ids is None else [i for i in track_ids if i in self.slots]
+            if not ids:
+                return {}
+            rows = np.array([self.slots[i] for i in ids], dtype=np.int64)
+            dt = np.clip(timestamp - self.t[rows], 0.0, self.max_extrapolation)[:, None]
+            out = np.where(self.ready[rows], self.pos[rows] + self.vel[rows] * dt, 0.0)
+        return dict(zip(ids, out))
+
+    def remove(self, track_id):
+        with self.lock:
+            row = self.slots.pop(track_id, None)
+            if row is not None:
+                self.free.append(row)
+
+    def prune(self, timestamp, max_age=5.0):
+        """Frees tracks not updated for `max_age` seconds. Returns removed ids."""
+        with self.lock:
+            gone = [t_id for t_id, row in self.slots.items() if timestamp - self.t[row] > max_age]
+            for t_id in gone:
+                self.free.append(self.slots.pop(t_id))
+        return gone
@@ -0,0 +1,211 @@
+import gc
+import copy
+import logging
+import threading
+import numpy as np
+
+log = logging.getLogger("panoptes.models")
+
+
+def default_device():
+    """Best available torch device: mps (Apple Metal) > cuda > cpu."""
+    import torch
+    if torch.backends.mps.is_available():
+        return "mps"
+    if torch.cuda.is_available():
+        return "cuda"
+    return "cpu"
+
+
+def _backend_of(path):
+    # Exported formats run on their own runtime; ultralytics picks it from the suffix
+    for suffix, backend in ((".onnx", "onnx"), (".engine", "tensorrt"), ("_openvino_model", "openvino"),
+                            (".mlpackage", "coreml"), (".torchscript", "torchscript")):
+        if str(path).rstrip("/").endswith(suffix):
+            return backend
+    return "torch"
+
+
+def _scoped_view(model):
+    """
+    A second YOLO object over the same nn.Module: shares the weights but gets
+    its own predictor (and so its own ByteTrack state) on first predict/track.
+    """
+    view = copy.copy(model)
+    view.predictor = None
+    view.overrides = dict(model.overrides)
+    view.callbacks = {event: list(fns) for event, fns in model.callbacks.items()} # track() registers here
+    return view
+
+
+class ModelHandle:
+    """
+    A client's reference to a shared model.
+    Use `with handle.lock:` around predict()/track(): Ultralytics predictors
+    keep per-call state and are not safe to run concurrently on one instance.
+    """
+    def __init__(self, registry, key, entry):
+        self._registry = registry
+        self.key = key
+        self.model = entry["model"]
+        self.lock = entry["lock"]
+        self.device = entry["device"] # Actual device (may have fallen back to cpu)
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._registry.release(self)
+
+
+class ModelRegistry:
+    """
+    Process-wide Singleton of loaded YOLO models.
+    - Weights are keyed by (path, device, backend): loaded (and warmed up on a
+      blank image) once, on the first acquire() of any scope.
+    - `scope` separates what must not be shared: ByteTrack state lives on the
+      model's predictor, so each tracked stream uses its own scope (e.g.
+      "track:0"). A scope is a light view over the shared weights with its own
+      predictor and inference lock; plain predict() clients use "shared".
+    - Reference counted: release() decrements; models stay cached at 0 references
+      (cheap re-acquire, e.g. one batch worker processing many files) until
+      unload() / unload_unused() frees them. The weights go with their last scope.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super(ModelRegistry, cls).__new__(cls)
+                    cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized: return
+        self.lock = threading.Lock()
+        self.entries = {} # {key: {"model", "lock", "device", "refs", "loading"}}, one per scope
+        self.weights = {} # {(path, device, backend): {"model", "device", "scopes", "loading"}}
+        self._initialized = True
+
+    def key(self, path, device=None, backend=None, scope="shared"):
+        device = device or default_device()
+        return (str(path), device, backend or _backend_of(path), scope)
+
+    def acquire(self, path, device=None, backend=None, scope="shared", imgsz=640, warmup=True):
+        """Returns a ModelHandle, loading the model on first use. Raises if loading fails."""
+        key = self.key(path, device, backend, scope)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = {"model": None, "lock": threading.Lock(), "device": key[1],
+                                             "refs": 0, "loading": threading.Lock()}
+            entry["refs"] += 1
+
+        # Load outside the registry lock so other models can load in parallel;
+        # the entry's own lock makes concurrent acquirers of THIS key wait.
+        with entry["loading"]:
+            if entry["model"] is None:
+                try:
+                    weights = self._weights(key[:3], imgsz, warmup)
+                    entry["model"], entry["device"] = _scoped_view(weights["model"]), weights["device"]
+                except Exception:
+                    with self.lock:
+                        entry["refs"] -= 1
+                        if entry["refs"] <= 0 and entry["model"] is None:
+                            self.entries.pop(key, None)
+                    raise
+        return ModelHandle(self, key, entry)
+
+    def _weights(self, wkey, imgsz, warmup):
+        """Shared weights of (path, device, backend), loading them once. Counts the new scope."""
+        with self.lock:
+            weights = self.weights.get(wkey)
+            if weights is None:
+                weights = self.weights[wkey] = {"model": None, "device": wkey[1], "scopes": 0,
+                                                "loading": threading.Lock()}
+            weights["scopes"] += 1
+        with weights["loading"]:
+            if weights["model"] is None:
+                try:
+                    self._load(weights, wkey, imgsz, warmup)
+                except Exception:
+                    with self.lock:
+                        weights["scopes"] -= 1
+                        if weights["scopes"] <= 0 and weights["model"] is None:
+                            self.weights.pop(wkey, None)
+                    raise
+        return weights
+
+    def _load(self, entry, key, imgsz, warmup):
+        from ultralytics import YOLO
+        path, device, backend = key
+        log.info(f"Loading {path} ({backend}) on {device}...")
+        model = YOLO(path)
+        if backend == "torch":
+            model.to(device)
+        if warmup:
+            # Blank frame: no network access, exercises the same shapes as live frames
+            dummy = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+            try:
+                model.predict(dummy, verbose=False, device=device, imgsz=imgsz)
+            except Exception as e:
+                if device == "cpu":
+                    raise
+                log.warning(f"Warmup of {path} failed on {device}: {e}. Falling back to CPU.")
+                device = "cpu"
+                if backend == "torch":
+                    model.to(device)
+                model.predict(dummy, verbose=False, device=device, imgsz=imgsz)
+        entry["model"], entry["device"] = model, device
+        log.info(f"{path} ready on {device}")
+
+    def release(self, handle):
+        with self.lock:
+            entry = self.entries.get(handle.key)
+            if entry is not None and entry["refs"] > 0:
+                entry["refs"] -= 1
+
+    def unload(self, path, device=None, backend=None, scope="shared", force=False):
+        """Frees a model with no references (or regardless, with force=True). Returns True if freed."""
+        return self._unload(self.key(path, device, backend, scope), force)
+
+    def unload_unused(self):
+        """Frees every model with no references. Returns the freed keys."""
+        with self.lock:
+            keys = [k for k, e in self.entries.items() if e["refs"] <= 0]
+        return [k for k in keys if self._unload(k, False)]
+
+    def _unload(self, key, force):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or (entry["refs"] > 0 and not force):
+                return False
+            self.entries.pop(key)
+        # Wait for an in-flight inference before dropping this scope's view
+        with entry["lock"]:
+            loaded, entry["model"] = entry["model"] is not None, None
+        freed = False
+        with self.lock:
+            weights = self.weights.get(key[:3])
+            if weights is not None and loaded:
+                weights["scopes"] -= 1
+                if weights["scopes"] <= 0:
+                    self.weights.pop(key[:3])
+                    weights["model"] = None
+                    freed = True
+        if freed:
+            gc.collect()
+            if key[1] == "cuda":
+                import torch
+                torch.cuda.empty_cache()
+        log.info(f"Unloaded {key[0]} ({key[1]}, {key[3]}){' and its weights' if freed else ''}")
+        return True
+
+    def stats(self):
+        with self.lock:
+            return [{"path": k[0], "device": e["device"], "backend": k[2], "scope": k[3],
+                     "refs": e["refs"], "loaded": e["model"] is not None,
+                     "weights_shared_by": self.weights[k[:3]]["scopes"] if k[:3] in self.weights else 0}
+                    for k, e in self.entries.items()]
@@ -0,0 +1,211 @@
+import os
+import time
+import queue
+import shutil
+import logging
+import threading
+from collections import deque
+import cv2
+import numpy as np
+from core.shared_state import SharedState
+from core.jpeg_encoder import JpegEncoder
+from detectors.knowledge_base import BEHAVIOR_DB
+
+log = logging.getLogger("panoptes.recorder")
+
+
+class ClipRecorder:
+    """
+    Event clips (pre-roll + post-roll) without touching capture or inference.
+    - A recorder thread samples the preview stream at `fps`, JPEG-encodes it
+      once and keeps a ring bounded by `pre_roll` seconds AND `max_bytes`.
+    - trigger() (inference thread, O(N) set lookups) opens a clip when a track
+      enters one of the configured actions; more triggers extend it up to
+      `max_clip` seconds. The clip = ring contents + `post_roll` seconds.
+    - Finished clips go to a writer thread that muxes the JPEGs into an MP4 in
+      an FFmpeg subprocess (ffmpeg-python, no re-encode on our side) or, without
+      FFmpeg, an MJPG AVI via OpenCV, and indexes them in the local SQLite DB.
+    """
+    def __init__(self, out_dir=None, fps=10, pre_roll=5.0, post_roll=5.0, max_clip=60.0,
+                 max_bytes=32 * 1024 * 1024, quality=80, db=None, camera="0"):
+        self.out_dir = out_dir or os.getenv('CLIPS_DIR', 'clips')
+        self.fps = fps
+        self.pre_roll = pre_roll
+        self.post_roll = post_roll
+        self.max_clip = max_clip
+        self.max_bytes = max_bytes
+        self.jpeg = JpegEncoder(quality=quality, budget_kbps=0) # Fixed quality: clips are archived
+        self.camera = str(camera)
+        self.db = db # database.vector_store.SQLiteDB (created in the writer thread)
+        self.shared = SharedState()
+
+        self.lock = threading.Lock()
+        self.ring = deque() # [(timestamp, jpeg bytes)]
+        self.ring_bytes = 0
+        self.clip = None # Open clip: {"frames", "start", "until", "action", ...}
+        self.active = {} # {track_id: action} currently in a trigger action
+
+        self.jobs = queue.Queue(maxsize=4)
+        self.running = False
+        self.threads = []
+        self.stats = {"clips": 0, "dropped_clips": 0, "frames": 0}
+
+    # --- lifecycle ---------------------------------------------------------
+    def start(self):
+        if self.running: return
+        self.running = True
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.threads = [threading.Thread(target=self._record_loop, name="recorder", daemon=True),
+                        threading.Thread(target=self._write_loop, name="clip-writer", daemon=True)]
+        for t in self.threads:
+            t.start()
+
+    def stop(self):
+        if not self.running: return
+        with self.lock:
+            if self.clip is not None:
+                self._close_clip()
+        self.running = False
+        for t in self.threads:
+            t.join(timeout=2.0)
+        with self.lock: # The recorder thread may still be in _push after the join timeout
+            self.ring.clear()
+            self.ring_bytes = 0
+
+    # --- inference thread ----------------------------------------------------
+    def trigger(self, detections, timestamp, actions):
+        """Opens / extends a clip when a track ENTERS one of `actions`."""
+        if not self.running:
+            self.start()
+        actions = set(actions)
+        fired = []
+        current = {}
+        for det in detections:
+            if det.get("action") in actions:
+                current[det["id"]] = det["action"]
+                if self.active.get(det["id"]) != det["action"]:
+                    fired.append(det)
+        self.active = current
+        if not fired and not current:
+            return
+
+        with self.lock:
+            if self.clip is None and fired:
+                first = fired[0]
+                # Pre-roll: what is already encoded (shared bytes, no copy)
+                self.clip = {"frames": list(self.ring), "start": timestamp, "until": timestamp + self.post_roll,
+                             "action": first["action"], "severity": first.get("severity") or
+                             BEHAVIOR_DB.get(first["action"], {}).get("severity", "INFO"),
+                             "tracks": set(), "actions": set()}
+            if self.clip is not None:
+                # Still happening: keep recording (bounded by max_clip)
+                self.clip["until"] = min(max(self.clip["until"], timestamp + self.post_roll),
+                                         self.clip["start"] + self.max_clip)
+                self.clip["tracks"].update(current)
+                self.clip["actions"].update(current.values())
+
+    # --- recorder thread -----------------------------------------------------
+    def _record_loop(self):
+        last_id = -1
+        period = 1.0 / self.fps
+        while self.running:
+            t0 = time.time()
+            frame, last_id, ts = self.shared.get_preview(last_id)
+            if frame is not None:
+                try:
+                    self._push(ts, self.jpeg.encode(frame))
+                except Exception as e:
+                    log.warning(f"Recorder encode failed: {e}")
+            time.sleep(max(period - (time.time() - t0), 0.005))
+
+    def _push(self, ts, jpeg):
+        with self.lock:
+            self.ring.append((ts, jpeg))
+            self.ring_bytes += len(jpeg)
+            while self.ring and (self.ring_bytes > self.max_bytes or self.ring[0][0] < ts - self.pre_roll):
+                self.ring_bytes -= len(self.ring.popleft()[1])
+            self.stats["frames"] += 1
+            if self.clip is not None:
+                self.clip["frames"].append((ts, jpeg))
+                if ts >= self.clip["until"]:
+                    self._close_clip()
+
+    def _close_clip(self):
+        clip, self.clip = self.clip, None
+        try:
+            self.jobs.put_nowait(clip)
+        except queue.Full:
+            self.stats["dropped_clips"] += 1
+            log.warning("Clip writer busy, clip dropped")
+
+    # --- writer thread -------------------------------------------------------
+    def _write_loop(self):
+        while self.running or not self.jobs.empty():
+            try:
+                clip = self.jobs.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            try:
+                self._write(clip)
+            except Exception as e:
+                log.error(f"Clip write failed: {e}")
+
+    def _write(self, clip):
+        frames = clip["frames"]
+        if not frames:
+            return
+        start, end = frames[0][0], frames[-1][0]
+        name = time.strftime("%Y%m%d_%H%M%S", time.localtime(clip["start"])) + f"_{self.camera}_{clip['action']}"
+        # Effective rate of what was sampled, so the clip plays in real time
+        fps = (len(frames) - 1) / (end - start) if end > start else self.fps
+        path = self._mux_ffmpeg(frames, os.path.join(self.out_dir, name + ".mp4"), fps) if shutil.which("ffmpeg") else None
+        if path is None:
+            path = self._mux_opencv(frames, os.path.join(self.out_dir, name + ".avi"), fps)
+
+        if self.db is None:
+            from database.vector_store import SQLiteDB
+            self.db = SQLiteDB()
+        clip_id = self.db.insert_clip({
+            "camera": self.camera, "start": start, "end": end, "action": clip["action"],
+            "severity": clip["severity"], "path": path, "trigger_time": clip["start"],
+            "tracks": sorted(int(t) for t in clip["tracks"]), "actions": sorted(clip["actions"]),
+            "frames": len(frames), "bytes": os.path.getsize(path),
+        })
+        self.stats["clips"] += 1
+        log.info(f"Clip #{clip_id}: {path} ({len(frames)} frames, {end - start:.1f}s)")
+
+    @staticmethod
+    def _mux_ffmpeg(frames, path, fps):
+        try:
+            import ffmpeg
+        except ImportError:
+            return None
+        process = (
+            ffmpeg.input("pipe:", format="image2pipe", vcodec="mjpeg", framerate=round(fps, 3))
+            .output(path, vcodec="libx264", pix_fmt="yuv420p", preset="veryfast", movflags="+faststart")
+            .overwrite_output()
+            .global_args("-loglevel", "error")
+            .run_async(pipe_stdin=True)
+        )
+        for _, jpeg in frames:
+            process.stdin.write(jpeg)
+        process.stdin.close()
+        return path if process.wait() == 0 else None
+
+    @staticmethod
+    def _mux_opencv(frames, path, fps):
+        first = cv2.imdecode(np.frombuffer(frames[0][1], np.uint8), cv2.IMREAD_COLOR)
+        h, w = first.shape[:2]
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (w, h))
+        for _, jpeg in frames:
+            frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+            if frame.shape[:2] != (h, w):
+                frame = cv2.resize(frame, (w, h))
+            writer.write(frame)
+        writer.release()
+        return path
+
+    def summary(self):
+        with self.lock:
+            return dict(self.stats, ring_frames=len(self.ring), ring_bytes=self.ring_bytes,
+                        recording=self.clip is not None, jpeg=self.jpeg.metrics())
@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+import numpy as np
+
+log = logging.getLogger("panoptes.reid")
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+class ReIDService:
+    """
+    Stable global person IDs across ByteTrack ID resets and cameras.
+
+    - update() (inference thread, O(N) dict lookups): stamps `global_id` on the
+      detections and queues head-to-toe crops of tracks that need an embedding
+      (new tracks immediately, known tracks every `interval` seconds).
+    - A background thread embeds the queued crops in one batch and matches them
+      against the HOT GALLERY: recent identities as one contiguous (capacity, dim)
+      matrix of L2-normalized vectors, so all queries are a single matmul.
+    - Misses fall back to the vector store (Milvus ANN or brute-force SQLite)
+      restricted to re-ID rows; a hit there is promoted into the hot gallery.
+      Still unmatched -> new global ID, persisted as a "REID" row.
+    """
+    KIND = "REID"
+
+    def __init__(self, db=None, embedder=None, dim=None, match_threshold=0.75, interval=1.0,
+                 capacity=512, momentum=0.9, persist_interval=30.0, track_ttl=5.0, state_path=None):
+        self.dim = dim or int(os.getenv('EMBED_DIM', 128))
+        self.db = db
+        self.embedder = embedder
+        self.match_threshold = match_threshold
+        self.interval = interval # Seconds between re-embeddings of a known track
+        self.momentum = momentum # EMA of the gallery vector (appearance drifts slowly)
+        self.persist_interval = persist_interval
+        self.track_ttl = track_ttl
+        # Relative to the repo, not the cwd: a reset counter would reissue stored IDs
+        self.state_path = os.path.join(ROOT, state_path or os.getenv('REID_STATE') or 'reid_state.json')
+        self.lock = threading.Lock()
+
+        # Hot gallery
+        self.capacity = capacity
+        self.gallery = np.zeros((capacity, self.dim), dtype=np.float32)
+        self.gallery_ids = np.full(capacity, -1, dtype=np.int64)
+        self.gallery_seen = np.zeros(capacity, dtype=np.float64)
+        self.rows = {} # {global_id: row}
+        self.persisted = {} # {global_id: last persist time}
+
+        # (camera, track_id) -> {"gid", "embedded"}
+        self.tracks = {}
+        self.next_id = self._load_next_id()
+        self._next_id_saved = (self.next_id, time.time()) # Written every persist_interval, not per new ID
+
+        self.jobs = queue.Queue(maxsize=8) # Drop work instead of lagging behind
+        self.running = False
+        self.thread = None
+        self.stats = {"hot_hits": 0, "store_hits": 0, "new": 0, "dropped": 0}
+
+    # --- lifecycle ---------------------------------------------------------
+    def start(self):
+        if self.running: return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="reid", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1.0)
+        self._save_next_id()
+
+    def _load_next_id(self):
+        try:
+            with open(self.state_path) as f:
+                return int(json.load(f)["next_id"])
+        except Exception:
+            return 1
+
+    def _save_next_id(self, force=True):
+        with self.lock:
+            next_id = self.next_id
+        now = time.time()
+        if next_id == self._next_id_saved[0] or (not force and now - self._next_id_saved[1] < self.persist_interval):
+            return
+        tmp = self.state_path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"next_id": next_id}, f)
+            os.replace(tmp, self.state_path)
+            self._next_id_saved = (next_id, now)
+        except Exception as e:
+            log.warning(f"Could not save re-ID state: {e}")
+
+    # --- inference thread ----------------------------------------------------
+    def update(self, camera, detections, timestamp, get_crops):
+        """
+        camera: source key, detections: InferenceEngine output (id, box_norm),
+        get_crops: callable(list of normalized boxes) -> BGR crops (SharedState.get_frame_crops).
+        Annotates detections with `global_id` (None until the first match).
+        """
+        if not self.running:
+            self.start()
+        due = []
+        with self.lock:
+            for det in detections:
+                key = (camera, det["id"])
+                entry = self.tracks.get(key)
+                if entry is None:
+                    entry = self.tracks[key] = {"gid": None, "embedded": -np.inf, "seen": timestamp}
+                entry["seen"] = timestamp
+                det["global_id"] = entry["gid"]
+                if timestamp - entry["embedded"] >= self.interval:
+                    due.append(det)
+            # Forget tracks ByteTrack has dropped
+            for key in [k for k, e in self.tracks.items() if k[0] == camera and timestamp - e["seen"] > self.track_ttl]:
+                del self.tracks[key]
+
+        if not due or self.jobs.full():
+            if due: self._count("dropped")
+            return detections
+        crops = get_crops([d["box_norm"] for d in due])
+        job = [(d["id"], c) for d, c in zip(due, crops) if c is not None and c.size]
+        if job:
+            with self.lock:
+                for d in due:
+                    self.tracks[(camera, d["id"])]["embedded"] = timestamp
+            self.jobs.put_nowait((camera, timestamp, job))
+        return detections
+
+    # --- worker thread -------------------------------------------------------
+    def _ensure_backends(self):
+        if self.embedder is None:
+            from detectors.embedding import EmbeddingExtractor
+            self.embedder = EmbeddingExtractor(dim=self.dim)
+        if self.db is None:
+            from database.vector_store import VectorDB
+            self.db = VectorDB(dim=self.dim)
+
+    def _run(self):
+        try:
+            self._ensure_backends()
+        except Exception as e:
+            log.error(f"Re-ID disabled: {e}")
+            self.running = False
+            return
+        while self.running:
+            self._save_next_id(force=False)
+            try:
+                camera, timestamp, job = self.jobs.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            try:
+                vecs = self.embedder.embed_crops([c for _, c in job])
+                self._assign(camera, [t for t, _ in job], vecs, timestamp)
+            except Exception as e:
+                log.warning(f"Re-ID error: {e}")
+
+    def _assign(self, camera, track_ids, vecs, timestamp):
+        vecs = np.asarray(vecs, dtype=np.float32)
+        vecs /= np.linalg.norm(vecs, axis=1, keepdims=True) + 1e-12
+        with self.lock:
+            current = [self.tracks.get((camera, t), {}).get("gid") for t in track_ids]
+            # An identity held by ANOTHER live track of the same camera can't be matched
+            # again (overlapping cameras may legitimately see the same person)
+            busy = {e["gid"]: k for k, e in self.tracks.items() if e["gid"] is not None and k[0] == camera}
+            sims = vecs @ self.gallery.T # (K, capacity), one matmul for all queries
+            sims[:, self.gallery_ids < 0] = -1.0
+            for gid, holder in busy.items():
+                row = self.rows.get(gid)
+                if row is None:
+                    continue
+                for k, t in enumerate(track_ids):
+                    if holder != (camera, t):
+                        sims[k, row] = -1.0
+
+        # Gallery writes wait until every query is matched: _gallery_put may evict
+        # a row and reuse it for a new identity, which `sims` would not reflect
+        puts = []
+        taken = set()
+        for k, t_id in enumerate(track_ids):
+            gid = None
+            order = np.argsort(-sims[k])
+            for row in order[:3]:
+                if sims[k, row] < self.match_threshold:
+                    break
+                if int(self.gallery_ids[row]) not in taken:
+                    gid = int(self.gallery_ids[row])
+                    self._count("hot_hits")
+                    break
+            if gid is None and current[k] is not None and current[k] not in taken:
+                gid = current[k] # Keep the track's identity; appearance just changed
+            if gid is None:
+                blocked = taken | {g for g, holder in busy.items() if holder != (camera, t_id)}
+                gid = self._search_store(vecs[k], blocked)
+            if gid is None:
+                with self.lock:
+                    gid = self.next_id
+                    self.next_id += 1
+                    self.stats["new"] += 1
+            taken.add(gid)
+            puts.append((t_id, gid, vecs[k]))
+
+        persist = []
+        with self.lock:
+            for t_id, gid, vec in puts:
+                self._gallery_put(gid, vec, timestamp)
+                entry = self.tracks.get((camera, t_id))
+                if entry is not None:
+                    entry["gid"] = gid
+            for t_id, gid, _ in puts:
+                if timestamp - self.persisted.get(gid, -np.inf) >= self.persist_interval and gid in self.rows:
+                    self.persisted[gid] = timestamp
+                    persist.append({"person_id": gid, "timestamp": timestamp,
+                                    "vector": self.gallery[self.rows[gid]].tolist(),
+                                    "metadata": {"type": self.KIND, "global_id": gid, "camera": camera, "track_id": t_id}})
+        if persist:
+            self.db.insert_behaviors(persist)
+
+    def _search_store(self, vec, blocked):
+        hits = self.db.search_behavior(vec.tolist(), limit=5, kind=self.KIND)
+        for hit in hits:
+            gid = (hit.get("metadata") or {}).get("global_id")
+            if gid is not None and hit["score"] >= self.match_threshold and int(gid) not in blocked:
+                self._count("store_hits")
+                return int(gid)
+        return None
+
+    def _count(self, stat):
+        # Caller and worker threads both count; summary() reads from the server
+        with self.lock:
+            self.stats[stat] += 1
+
+    def _gallery_put(self, gid, vec, timestamp):
+        row = self.rows.get(gid)
+        if row is None:
+            # Free row, else evict the least recently seen identity (still in the store)
+            row = int(np.argmin(self.gallery_seen))
+            old = int(self.gallery_ids[row])
+            if old >= 0:
+                self.rows.pop(old, None)
+            self.rows[gid] = row
+            self.gallery_ids[row] = gid
+            self.gallery[row] = vec
+        else:
+            v = self.momentum * self.gallery[row] + (1 - self.momentum) * vec
+            self.gallery[row] = v / (np.linalg.norm(v) + 1e-12)
+        self.gallery_seen[row] = timestamp
+
+    def summary(self):
+        with self.lock:
+            return dict(self.stats, identities=len(self.rows), live_tracks=len(self.tracks), next_id=self.next_id)
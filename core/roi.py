@@ -0,0 +1,129 @@
+import cv2
+import numpy as np
+
+
+def to_norm_rect(rect, frame_w, frame_h):
+    """
+    Converts a zone/ROI rectangle [x1, y1, x2, y2] to normalized 0-1 coords.
+    Rects whose values are all <= 1.0 are assumed to be normalized already,
+    anything else is treated as pixels of the current frame.
+    """
+    x1, y1, x2, y2 = [float(v) for v in rect]
+    if max(x1, y1, x2, y2) > 1.0:
+        x1, x2 = x1 / frame_w, x2 / frame_w
+        y1, y2 = y1 / frame_h, y2 / frame_h
+    x1, x2 = sorted((min(max(x1, 0.0), 1.0), min(max(x2, 0.0), 1.0)))
+    y1, y2 = sorted((min(max(y1, 0.0), 1.0), min(max(y2, 0.0), 1.0)))
+    return [x1, y1, x2, y2]
+
+
+class RoiLayout:
+    """
+    Packs the regions of interest of a camera into a single canvas so the model
+    (and its ByteTrack state) sees all ROIs in ONE call, then maps canvas pixel
+    coordinates back to full-frame normalized space.
+
+    With `size` set, the packed tiles are letterboxed into a size x size canvas
+    (gray 114 padding, like Ultralytics) in RGB, i.e. a tensor-ready model input.
+    With size=None the tiles keep their native resolution and BGR order.
+
+    Each tile stores: src origin in the frame, dst origin in the canvas and scale.
+    frame_px = (canvas_px - dst) / scale + src
+    With no ROIs the layout is a single tile covering the whole frame.
+    """
+    def __init__(self, rois, frame_shape, size=None, rgb=None, num_buffers=3):
+        self.frame_h, self.frame_w = frame_shape[:2]
+        self.rois = [to_norm_rect(r, self.frame_w, self.frame_h) for r in (rois or [])]
+        self.rois = [r for r in self.rois if r[2] > r[0] and r[3] > r[1]]
+        self.full_frame = len(self.rois) == 0
+        self.size = size
+        self.rgb = (size is not None) if rgb is None else rgb
+        # Rotating canvases: the published one is never rewritten by the next build()
+        self.num_buffers = num_buffers
+        self._buffers = []
+        self._idx = 0
+        self._plan()
+
+    def _plan(self):
+        w, h = self.frame_w, self.frame_h
+        if self.full_frame:
+            src = np.array([[0, 0, w, h]], dtype=np.int32)
+        else:
+            src = np.array([[int(r[0] * w), int(r[1] * h), int(np.ceil(r[2] * w)), int(np.ceil(r[3] * h))]
+                            for r in self.rois], dtype=np.int32)
+        sizes = src[:, 2:] - src[:, :2]
+
+        # Tiles side by side (left to right), top aligned
+        dst = np.zeros((len(src), 2), dtype=np.float32)
+        dst[1:, 0] = np.cumsum(sizes[:-1, 0])
+        mosaic_w, mosaic_h = int(sizes[:, 0].sum()), int(sizes[:, 1].max())
+
+        if self.size is None:
+            scale = 1.0
+            canvas_w, canvas_h = mosaic_w, mosaic_h
+            pad = np.zeros(2, dtype=np.float32)
+        else:
+            # Letterbox the whole mosaic into size x size, centered
+            scale = min(self.size / mosaic_w, self.size / mosaic_h)
+            canvas_w = canvas_h = self.size
+            pad = np.array([(self.size - mosaic_w * scale) / 2, (self.size - mosaic_h * scale) / 2], dtype=np.float32)
+
+        self.src = src
+        self.dst = np.round(dst * scale + pad).astype(np.int32)
+        self.scale = np.full(len(src), scale, dtype=np.float32)
+        self.dst_sizes = np.maximum(np.round(sizes * scale).astype(np.int32), 1)
+        self.canvas_shape = (canvas_h, canvas_w, 3)
+
+    def matches(self, rois, frame_shape, size=None):
+        if frame_shape[:2] != (self.frame_h, self.frame_w) or size != self.size:
+            return False
+        other = [to_norm_rect(r, self.frame_w, self.frame_h) for r in (rois or [])]
+        other = [r for r in other if r[2] > r[0] and r[3] > r[1]]
+        return other == self.rois
+
+    def _next_canvas(self, dtype):
+        if not self._buffers or self._buffers[0].dtype != dtype:
+            self._buffers = [np.full(self.canvas_shape, 114, dtype=dtype) for _ in range(self.num_buffers)]
+        canvas = self._buffers[self._idx]
+        self._idx = (self._idx + 1) % self.num_buffers
+        return canvas
+
+    def build(self, frame):
+        """Returns the model input as a C-contiguous HWC uint8 array."""
+        if self.full_frame and self.size is None and not self.rgb:
+            return frame
+        canvas = self._next_canvas(frame.dtype)
+        for (x1, y1, x2, y2), (dx, dy), (tw, th) in zip(self.src, self.dst, self.dst_sizes):
+            crop = frame[y1:y2, x1:x2]
+            if (tw, th) != (x2 - x1, y2 - y1):
+                crop = cv2.resize(crop, (int(tw), int(th)), interpolation=cv2.INTER_AREA if tw < x2 - x1 else cv2.INTER_LINEAR)
+            canvas[dy:dy + th, dx:dx + tw] = crop
+        if self.rgb:
+            cv2.cvtColor(canvas, cv2.COLOR_BGR2RGB, dst=canvas)
+        return canvas
+
+    def tile_of(self, boxes_px):
+        """Tile index for each canvas box (N, 4), chosen by box center. -1 = padding."""
+        cx = (boxes_px[:, 0] + boxes_px[:, 2]) / 2
+        cy = (boxes_px[:, 1] + boxes_px[:, 3]) / 2
+        x0, y0 = self.dst[:, 0], self.dst[:, 1]
+        tw, th = self.dst_sizes[:, 0], self.dst_sizes[:, 1]
+        inside = ((cx[:, None] >= x0) & (cx[:, None] < x0 + tw) &
+                  (cy[:, None] >= y0) & (cy[:, None] < y0 + th))
+        idx = np.argmax(inside, axis=1)
+        idx[~inside.any(axis=1)] = -1
+        return idx
+
+    def to_frame_norm(self, xy, tiles):
+        """
+        xy: (N, K, 2) canvas pixels, tiles: (N,) tile index per row.
+        Returns (N, K, 2) normalized to the full frame, clipped to each tile's ROI.
+        """
+        t = np.maximum(tiles, 0)
+        scale = self.scale[t][:, None, None]
+        dst = self.dst[t][:, None, :]
+        src = self.src[t]
+        out = (xy - dst) / scale + src[:, None, :2]
+        out = np.clip(out, src[:, None, :2], src[:, None, 2:])
+        out = out / np.array([self.frame_w, self.frame_h], dtype=np.float32)
+        return out.astype(np.float32)
@@ -1,6 +1,7 @@
 import threading
 import time
 import numpy as np
+from collections import deque
 
 class SharedState:
     """
@@ -22,33 +23,56 @@ class SharedState:
 
     def __init__(self):
         if self._initialized: return
-        
+
         self.lock = threading.Lock()
-        
+
         # VIDEO STATE
-        self.latest_frame = None
+        self.latest_frame = None # Full resolution BGR (recording / crops)
+        self.latest_preview = None # Downscaled BGR for MJPEG / dashboards
+        self.latest_model_input = None # Letterboxed RGB model-size buffer
+        self.model_layout = None # core.roi.RoiLayout that produced latest_model_input
         self.frame_id = 0 # Monotonic counter to detect new frames
         self.frame_timestamp = 0.0
-        
+
+        # MODEL INPUT CONFIG (written by Brain, read by Vision on every capture)
+        self.model_rois = []
+        self.model_imgsz = 640
+
         # AI STATE
         self.latest_detections = [] # List of dicts
         self.ai_timestamp = 0.0
+        self.ai_frame_id = None # Frame the latest detections were computed on
+        self.ai_frame_timestamp = None
         self.inference_fps = 0.0
-        
+        self.zone_events = deque(maxlen=100) # Recent ZONE_ENTRY / ZONE_EXIT / LOITERING
+
         # SYSTEM STATE
         self.cam_active = False
         self.system_status = "INITIALIZING"
-        
+
         self._initialized = True
 
-    def update_frame(self, frame):
-        """Called by Vision Thread (60 FPS)"""
+    def update_frame(self, frame, model_input=None, layout=None, preview=None, timestamp=None):
+        """Called by Vision Thread (60 FPS). timestamp: capture time (default: now)"""
         with self.lock:
             self.latest_frame = frame
+            self.latest_model_input = model_input
+            self.model_layout = layout
+            self.latest_preview = preview
             self.frame_id += 1
-            self.frame_timestamp = time.time()
+            self.frame_timestamp = time.time() if timestamp is None else timestamp
             self.cam_active = True
 
+    def set_model_config(self, rois, imgsz):
+        """Called by Brain Thread: what the Vision Thread should prepare for the model"""
+        with self.lock:
+            self.model_rois = rois
+            self.model_imgsz = imgsz
+
+    def get_model_config(self):
+        with self.lock:
+            return self.model_rois, self.model_imgsz
+
     def get_frame_for_ai(self):
         """Called by Brain Thread"""
         with self.lock:
@@ -58,20 +82,67 @@ class SharedState:
             # But let's copy to be safe if AI modifies it.
             return self.latest_frame.copy(), self.frame_id
 
-    def update_detections(self, detections, fps):
-        """Called by Brain Thread"""
+    def get_frame_crops(self, boxes_norm):
+        """
+        Called by Brain Thread. Copies of full-resolution regions [x1, y1, x2, y2]
+        (normalized 0-1) of the latest frame; None for empty regions.
+        Copying only the crops avoids copying the whole frame.
+        """
+        with self.lock:
+            if self.latest_frame is None: return [None] * len(boxes_norm)
+            h, w = self.latest_frame.shape[:2]
+            crops = []
+            for x1, y1, x2, y2 in boxes_norm:
+                x1, x2 = max(int(x1 * w), 0), min(int(x2 * w), w)
+                y1, y2 = max(int(y1 * h), 0), min(int(y2 * h), h)
+                crops.append(self.latest_frame[y1:y2, x1:x2].copy() if x2 > x1 and y2 > y1 else None)
+            return crops
+
+    def get_preview(self, after_id=-1):
+        """
+        Called by background consumers (clip recorder). (preview BGR, frame_id, frame_timestamp)
+        if a frame newer than `after_id` exists, else (None, after_id, 0.0). No copy: the
+        Vision Thread publishes a preview it never writes again (it copies frames of captures
+        that reuse their buffers, see VisionThread._prepare_preview). Treat it as read-only.
+        """
+        with self.lock:
+            if self.latest_frame is None or self.frame_id == after_id: return None, after_id, 0.0
+            frame = self.latest_preview if self.latest_preview is not None else self.latest_frame
+            return frame, self.frame_id, self.frame_timestamp
+
+    def get_model_input(self):
+        """
+        Called by Brain Thread. Returns (model_input, layout, frame_id, frame_timestamp).
+        Copying the 640x640 buffer is far cheaper than copying the full frame.
+        """
+        with self.lock:
+            if self.latest_model_input is None: return None, None, -1, 0.0
+            return self.latest_model_input.copy(), self.model_layout, self.frame_id, self.frame_timestamp
+
+    def update_detections(self, detections, fps, events=None, frame_id=None, frame_timestamp=None):
+        """Called by Brain Thread. frame_id / frame_timestamp: the frame the detections belong to."""
         with self.lock:
             self.latest_detections = detections
+            self.ai_frame_id = frame_id
+            self.ai_frame_timestamp = frame_timestamp
             self.ai_timestamp = time.time()
             self.inference_fps = fps
+            if events:
+                self.zone_events.extend(events)
 
     def get_snapshot(self):
         """Called by Visualizer/Server (UI Thread)"""
         with self.lock:
             if self.latest_frame is None: return None
+            frame = self.latest_preview if self.latest_preview is not None else self.latest_frame
             return {
-                "frame": self.latest_frame.copy(), # Costly? optimization possible
+                "frame": frame.copy(), # Preview resolution, cheap to copy
+                "frame_id": self.frame_id,
+                "frame_timestamp": self.frame_timestamp,
                 "detections": self.latest_detections, # Reference copy
+                "detections_frame_id": self.ai_frame_id,
+                "detections_timestamp": self.ai_frame_timestamp,
+                "zone_events": list(self.zone_events),
                 "fps": self.inference_fps,
                 "status": self.system_status,
                 "cam_active": self.cam_active
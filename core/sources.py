@@ -0,0 +1,287 @@
+import glob
+import os
+import time
+import logging
+from urllib.parse import urlsplit, parse_qsl
+import cv2
+import numpy as np
+
+log = logging.getLogger("panoptes.capture")
+
+# COCO keypoints drawn by the synthetic source (same topology as core.visualizer)
+LIMBS = ((5, 7), (7, 9), (6, 8), (8, 10), (5, 6), (11, 12), (5, 11), (6, 12),
+         (11, 13), (13, 15), (12, 14), (14, 16))
+
+
+def parse_source(value):
+    """CAMERA_SOURCE string -> device index (digits) or the string itself."""
+    value = str(value).strip()
+    return int(value) if value.isdigit() else value
+
+
+def _param(value):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return {"true": True, "false": False}.get(value.lower(), value)
+
+
+class PacedSource:
+    """
+    Base of the file / generated sources. Frame n carries the VIRTUAL timestamp
+    epoch + n / fps (not the wall clock), so two runs over the same input feed
+    the pipeline identical timestamps. `rate` paces delivery: 1 = real time,
+    4 = four times faster, 0 = as fast as the consumer reads. `epoch` defaults
+    to the wall time at open(); pass one for fully reproducible runs. With the
+    default epoch and rate=1 the timestamps follow the wall clock (`wall_clock`),
+    so latency can be measured against time.time().
+    loop=False sources set `finished` at the end of the input (read() fails):
+    VisionThread stops instead of reopening them.
+    Same interface as the camera captures (open / isOpened / read / release /
+    timestamp).
+    """
+    def __init__(self, fps=30.0, rate=1.0, epoch=None, loop=True):
+        self.fps = float(fps)
+        self.rate = float(rate)
+        self.epoch = epoch
+        self.wall_clock = epoch is None and self.rate == 1.0
+        self.loop = bool(loop)
+        self.finished = False
+        self.index = 0 # Frames delivered since open()
+        self.timestamp = 0.0
+        self._opened = False
+        self._start = 0.0
+
+    def open(self):
+        if not self._open():
+            return False
+        self.index = 0
+        self._start = time.time()
+        if self.epoch is None:
+            self.epoch = self._start
+        self._opened = True
+        return True
+
+    def isOpened(self):
+        return self._opened
+
+    def read(self):
+        if not self._opened:
+            return False, None
+        if self.rate > 0:
+            # Pace against the start time: no drift, and a slow consumer makes
+            # frames late (never bursts to catch up with skipped ones)
+            delay = self._start + self.index / (self.fps * self.rate) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -1.0:
+                self._start -= delay
+                if self.wall_clock:
+                    self.epoch -= delay # Skip the lost time, timestamps stay on the wall clock
+        frame = self._frame(self.index)
+        if frame is None:
+            self.finished = not self.loop
+            return False, None
+        self.timestamp = self.epoch + self.index / self.fps
+        self.index += 1
+        return True, frame
+
+    def release(self):
+        self._opened = False
+
+    def _open(self):
+        return True
+
+    def _frame(self, index):
+        raise NotImplementedError
+
+
+class SyntheticCapture(PacedSource):
+    """
+    Stick figures walking over a static background (CAMERA_SOURCE=synthetic,
+    or synthetic://?people=8&width=1920&height=1080&fps=30&seed=1).
+    Frame n depends only on (n, seed, size, people): fully deterministic.
+    """
+    def __init__(self, source="synthetic", width=None, height=None, fps=None, people=4, seed=0,
+                 rate=1.0, epoch=None, **_):
+        super().__init__(fps=fps or 30, rate=rate, epoch=epoch)
+        self.source = source
+        self.width = int(width or 1280)
+        self.height = int(height or 720)
+        self.people = int(people)
+        rng = np.random.default_rng(int(seed))
+        # Per person: lane (y), speed (widths/s), phase, stride frequency, height, color
+        n = self.people
+        self.lanes = rng.uniform(0.45, 0.95, n)
+        self.speeds = rng.uniform(0.04, 0.15, n) * rng.choice((-1, 1), n)
+        self.phases = rng.uniform(0, 1, n)
+        self.strides = rng.uniform(1.2, 2.2, n)
+        self.scales = rng.uniform(0.7, 1.0, n)
+        self.colors = [tuple(int(c) for c in rng.integers(80, 256, 3)) for _ in range(n)]
+
+    def _open(self):
+        h, w = self.height, self.width
+        # Vertical gradient "floor" + a few fixed objects, rendered once
+        ramp = np.linspace(40, 110, h, dtype=np.float32)[:, None, None]
+        self.background = np.broadcast_to(ramp * (0.8, 0.9, 1.0), (h, w, 3)).astype(np.uint8).copy()
+        for i in range(6):
+            x = int(w * (i + 0.5) / 6)
+            cv2.rectangle(self.background, (x - 30, int(h * 0.15)), (x + 30, int(h * 0.35)), (70, 70, 80), -1)
+        log.info(f"Synthetic capture {w}x{h} @ {self.fps:g} FPS ({self.people} people)")
+        return True
+
+    def keypoints(self, index):
+        """(people, 17, 2) pixel keypoints of frame `index` (ground truth for tests)."""
+        t = index / self.fps
+        h, w = self.height, self.width
+        n = self.people
+        body = h * 0.35 * self.scales # Standing height in px
+        # Walk across and wrap around
+        x = ((self.phases + self.speeds * t) % 1.0) * (w + 2 * body.max()) - body.max()
+        y = self.lanes * h # Feet
+        swing = np.sin(2 * np.pi * (self.strides * t + self.phases)) * 0.35 # Leg / arm swing (rad)
+        k = np.zeros((n, 17, 2), dtype=np.float32)
+        u = body[:, None] # Unit = body height
+        hip_y = y[:, None] - 0.5 * u
+        sh_y = y[:, None] - 0.8 * u
+        k[:, 0] = np.stack([x, y - 0.93 * body], 1) # Nose
+        for j, dx in ((1, -0.02), (2, 0.02), (3, -0.04), (4, 0.04)): # Eyes / ears
+            k[:, j] = np.stack([x + dx * body, y - 0.95 * body], 1)
+        for side, j_sh, j_el, j_wr, j_hip, j_kn, j_an in ((-1, 5, 7, 9, 11, 13, 15), (1, 6, 8, 10, 12, 14, 16)):
+            s = swing * side
+            k[:, j_sh] = np.stack([x + side * 0.1 * body, sh_y[:, 0]], 1)
+            k[:, j_el] = k[:, j_sh] + np.stack([np.sin(-s) * 0.15 * body, np.cos(s) * 0.15 * body], 1)
+            k[:, j_wr] = k[:, j_el] + np.stack([np.sin(-s) * 0.14 * body, np.cos(s) * 0.14 * body], 1)
+            k[:, j_hip] = np.stack([x + side * 0.06 * body, hip_y[:, 0]], 1)
+            k[:, j_kn] = k[:, j_hip] + np.stack([np.sin(s) * 0.25 * body, np.cos(s) * 0.25 * body], 1)
+            k[:, j_an] = k[:, j_kn] + np.stack([np.sin(s) * 0.25 * body, np.cos(s) * 0.25 * body], 1)
+        return k
+
+    def _frame(self, index):
+        frame = self.background.copy() # Consumers keep references to published frames
+        kpts = self.keypoints(index).astype(np.int32)
+        thick = max(2, self.height // 120)
+        # Far (small y) first so nearer people overlap them
+        for i in np.argsort(self.lanes):
+            color = self.colors[i]
+            k = kpts[i]
+            cv2.polylines(frame, [k[list(limb)] for limb in LIMBS], False, color, thick, cv2.LINE_AA)
+            neck = (k[5] + k[6]) // 2
+            cv2.line(frame, tuple(neck.tolist()), tuple(((k[11] + k[12]) // 2).tolist()), color, thick, cv2.LINE_AA)
+            head_r = max(3, int(abs(k[0][1] - neck[1]) * 0.6))
+            cv2.circle(frame, tuple(k[0].tolist()), head_r, color, -1, cv2.LINE_AA)
+        cv2.putText(frame, f"SYNTHETIC #{index}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+        return frame
+
+
+class FileReplayCapture(PacedSource):
+    """
+    Looping video file replay at native (rate=1) or accelerated rate:
+    replay://path/to/video.mp4?rate=4&loop=1. fps defaults to the container's.
+    Timestamps keep growing across loops.
+    """
+    def __init__(self, source, fps=None, rate=1.0, epoch=None, loop=True, width=None, height=None, **_):
+        super().__init__(fps=fps or 30, rate=rate, epoch=epoch, loop=loop)
+        self.source = source
+        self.fixed_fps = fps
+        self.size = (int(width), int(height)) if width and height else None
+        self.cap = None
+
+    def _open(self):
+        self.cap = cv2.VideoCapture(self.source)
+        if not self.cap.isOpened():
+            log.error(f"Cannot open {self.source}")
+            return False
+        if not self.fixed_fps:
+            self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        log.info(f"Replaying {self.source} @ {self.fps:g} FPS x{self.rate:g} (loop={self.loop})")
+        return True
+
+    def _frame(self, index):
+        ok, frame = self.cap.read()
+        if not ok and self.loop and index > 0:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.cap.read()
+        if not ok:
+            return None
+        if self.size and (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        return frame
+
+    def release(self):
+        super().release()
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+
+class ImageSequenceCapture(PacedSource):
+    """
+    Sorted image files played as video: images://frames_dir?fps=10 or
+    images://frames/*.jpg. preload=1 decodes everything once (benchmarks that
+    must not measure disk / JPEG decode).
+    """
+    PATTERNS = ("*.jpg", "*.jpeg", "*.png", "*.bmp")
+
+    def __init__(self, source, fps=None, rate=1.0, epoch=None, loop=True, preload=False,
+                 width=None, height=None, **_):
+        super().__init__(fps=fps or 10, rate=rate, epoch=epoch, loop=loop)
+        self.source = source
+        self.preload = bool(preload)
+        self.size = (int(width), int(height)) if width and height else None
+        self.files = []
+        self.cache = None
+
+    def _open(self):
+        if os.path.isdir(self.source):
+            self.files = sorted(f for p in self.PATTERNS for f in glob.glob(os.path.join(self.source, p)))
+        else:
+            self.files = sorted(glob.glob(self.source))
+        if not self.files:
+            log.error(f"No images in {self.source}")
+            return False
+        if self.preload:
+            self.cache = [self._load(f) for f in self.files]
+        log.info(f"Image sequence {self.source}: {len(self.files)} frames @ {self.fps:g} FPS x{self.rate:g}")
+        return True
+
+    def _load(self, path):
+        frame = cv2.imread(path, cv2.IMREAD_COLOR)
+        if frame is not None and self.size and (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        return frame
+
+    def _frame(self, index):
+        if index >= len(self.files) and not self.loop:
+            return None
+        i = index % len(self.files)
+        return self.cache[i] if self.cache is not None else self._load(self.files[i])
+
+
+SOURCES = {"synthetic": SyntheticCapture, "replay": FileReplayCapture, "images": ImageSequenceCapture}
+
+
+def is_paced_source(source):
+    return isinstance(source, str) and source.split(":", 1)[0].lower() in SOURCES
+
+
+def open_paced_source(source, **options):
+    """
+    "synthetic", "synthetic://?people=8", "replay://clip.mp4?rate=4",
+    "images:///abs/dir?fps=5&preload=1" -> opened source or None.
+    Query parameters override `options` (the capture settings from .env).
+    """
+    scheme, _, rest = source.partition(":")
+    parts = urlsplit(source) if rest.startswith("//") else None
+    path = (parts.netloc + parts.path) if parts else rest
+    params = {k: _param(v) for k, v in parse_qsl(parts.query)} if parts else {}
+    kwargs = {k: v for k, v in options.items() if v is not None}
+    kwargs.update(params)
+    cls = SOURCES[scheme.lower()]
+    cap = cls(path or source, **kwargs)
+    if not cap.open():
+        cap.release()
+        return None
+    return cap
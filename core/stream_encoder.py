@@ -0,0 +1,299 @@
+import os
+import time
+import queue
+import shutil
+import struct
+import logging
+import threading
+from collections import deque
+import cv2
+from core.shared_state import SharedState
+
+log = logging.getLogger("panoptes.stream")
+
+TS_PACKET = 188
+
+
+def iter_mp4_segments(read):
+    """
+    Splits a fragmented MP4 byte stream (ffmpeg -movflags frag_keyframe+empty_moov)
+    into ("init", ftyp+moov) and then ("segment", [styp/prft...] moof+mdat) items.
+    read(n) returns exactly n bytes or fewer at EOF.
+    """
+    init, pending = b"", b""
+    while True:
+        header = read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack(">I4s", header)
+        if size == 1: # 64-bit largesize
+            ext = read(8)
+            if len(ext) < 8:
+                return
+            size = struct.unpack(">Q", ext)[0]
+            header += ext
+        body = read(size - len(header)) if size else b""
+        box = header + body
+        if kind in (b"ftyp", b"moov"):
+            init += box
+            if kind == b"moov":
+                yield "init", init
+        elif kind == b"mdat":
+            yield "segment", pending + box
+            pending = b""
+        else:
+            pending += box
+
+
+def _ts_random_access(packet):
+    # adaptation_field_control has an adaptation field + random_access_indicator set
+    return packet[3] & 0x20 and packet[4] > 0 and packet[5] & 0x40
+
+
+def iter_ts_segments(read, chunk_packets=64):
+    """
+    Splits an MPEG-TS stream into ("init", PAT+PMT) and ("segment", packets) items.
+    A segment is cut right before every random-access (keyframe) packet, so a
+    segment starting with one is a valid join point.
+    """
+    pat = pmt = None
+    pmt_pid = None
+    rest = b""
+    while True:
+        data = read(TS_PACKET * chunk_packets)
+        if not data:
+            return
+        data, start = rest + data, 0
+        end = len(data) - len(data) % TS_PACKET
+        rest = data[end:]
+        for off in range(0, end, TS_PACKET):
+            packet = data[off:off + TS_PACKET]
+            pid = ((packet[1] & 0x1F) << 8) | packet[2]
+            if pid == 0:
+                pat = packet
+                # First program entry of the PAT -> PMT pid
+                section = packet[5 + packet[4]:]
+                pmt_pid = ((section[10] & 0x1F) << 8) | section[11]
+            elif pid == pmt_pid:
+                first = pmt is None
+                pmt = packet
+                if first:
+                    yield "init", pat + pmt
+            if _ts_random_access(packet) and off > start:
+                yield "segment", data[start:off]
+                start = off
+        if end > start:
+            yield "segment", data[start:end]
+
+
+class _Viewer:
+    def __init__(self, max_pending):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.waiting_key = True # Joins (and re-joins after falling behind) at a keyframe
+
+
+class LiveEncoder:
+    """
+    One H.264 encode of the preview stream shared by every viewer.
+    - A feeder thread pushes preview frames at a constant `fps` (repeating the
+      last frame if capture is slower) into ONE FFmpeg subprocess
+      (ffmpeg-python), which emits fragmented MP4 (fmp4) or MPEG-TS (mpegts).
+    - A reader thread cuts the output into segments that start at keyframes
+      (GOP = `gop_seconds`) and fans them out to the viewers' bounded queues.
+    - New viewers get the init segment (ftyp+moov / PAT+PMT) and join at the
+      next keyframe; a viewer that falls behind is re-synced the same way
+      instead of slowing down the others.
+    - FFmpeg starts with the first viewer and stops `idle_timeout` seconds
+      after the last one leaves.
+    The video carries no HUD: clients draw it from /ws/telemetry. `info()`
+    maps stream time to capture time (epoch + n / fps).
+    """
+    FORMATS = {"fmp4": ("mp4", "video/mp4"), "mpegts": ("mpegts", "video/mp2t")}
+
+    def __init__(self, fmt="fmp4", fps=None, bitrate=None, gop_seconds=1.0, idle_timeout=10.0, max_pending=30):
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Unknown stream format {fmt}")
+        self.fmt = fmt
+        self.media_type = self.FORMATS[fmt][1]
+        self.fps = int(fps or os.getenv('STREAM_FPS', 15))
+        self.bitrate = bitrate or os.getenv('STREAM_BITRATE', '1500k')
+        self.gop = max(1, int(round(self.fps * gop_seconds)))
+        self.idle_timeout = idle_timeout
+        self.max_pending = max_pending
+        self.shared = SharedState()
+
+        self.lock = threading.Lock()
+        self.viewers = set()
+        self.init_segment = None
+        self.init_ready = threading.Event()
+        self.proc = None
+        self.size = None
+        self.epoch = None # Capture time of stream frame 0
+        self.written = 0
+        self.frame_ids = deque(maxlen=256) # (stream frame index, frame_id, capture ts)
+        self.running = False
+        self.threads = []
+        self.last_viewer = time.time()
+        self.stats = {"segments": 0, "bytes": 0, "resyncs": 0}
+
+    @staticmethod
+    def available():
+        if not shutil.which("ffmpeg"):
+            return False
+        try:
+            import ffmpeg
+            return True
+        except ImportError:
+            return False
+
+    # --- viewers -------------------------------------------------------------
+    def stream(self, timeout=10.0):
+        """Generator of bytes for one HTTP viewer (init segment, then live segments)."""
+        viewer = _Viewer(self.max_pending)
+        with self.lock:
+            self.viewers.add(viewer)
+            self.last_viewer = time.time()
+        try:
+            self.start()
+            if not self.init_ready.wait(timeout):
+                log.warning("Live encoder produced no init segment")
+                return
+            yield self.init_segment
+            while self.running:
+                try:
+                    data = viewer.queue.get(timeout=timeout)
+                except queue.Empty:
+                    return
+                yield data
+        finally:
+            with self.lock:
+                self.viewers.discard(viewer)
+                self.last_viewer = time.time()
+
+    def _broadcast(self, data, key):
+        self.stats["segments"] += 1
+        self.stats["bytes"] += len(data)
+        with self.lock:
+            viewers = list(self.viewers)
+        for viewer in viewers:
+            if viewer.waiting_key:
+                if not key:
+                    continue
+                viewer.waiting_key = False
+            try:
+                viewer.queue.put_nowait(data)
+            except queue.Full:
+                # Too slow: skip to the next keyframe rather than stall everyone
+                viewer.waiting_key = True
+                self.stats["resyncs"] += 1
+
+    # --- encoder -------------------------------------------------------------
+    def start(self):
+        with self.lock:
+            if self.running: return
+            self.running = True
+        self.threads = [threading.Thread(target=self._feed_loop, name=f"stream-feed-{self.fmt}", daemon=True)]
+        self.threads[0].start()
+
+    def stop(self):
+        self.running = False
+        for t in self.threads:
+            if t is not threading.current_thread():
+                t.join(timeout=2.0)
+        self._close()
+
+    def _spawn(self, w, h):
+        import ffmpeg
+        muxer = self.FORMATS[self.fmt][0]
+        opts = {"vcodec": "libx264", "preset": "veryfast", "tune": "zerolatency", "pix_fmt": "yuv420p",
+                "g": self.gop, "keyint_min": self.gop, "sc_threshold": 0, "bf": 0,
+                "b:v": self.bitrate, "maxrate": self.bitrate, "bufsize": self.bitrate}
+        if muxer == "mp4":
+            # Every fragment starts at a keyframe: each one is a join point
+            opts["movflags"] = "frag_keyframe+empty_moov+default_base_moof"
+        self.proc = (
+            ffmpeg.input("pipe:", format="rawvideo", pix_fmt="bgr24", s=f"{w}x{h}", framerate=self.fps)
+            .output("pipe:", format=muxer, **opts)
+            .global_args("-loglevel", "error")
+            .run_async(pipe_stdin=True, pipe_stdout=True)
+        )
+        self.size = (w, h)
+        self.written = 0
+        self.epoch = None
+        self.init_segment = None
+        self.init_ready.clear()
+        reader = threading.Thread(target=self._read_loop, args=(self.proc,), name=f"stream-read-{self.fmt}", daemon=True)
+        reader.start()
+        self.threads.append(reader)
+        log.info(f"Live encoder {self.fmt} {w}x{h}@{self.fps} ({self.bitrate})")
+
+    def _close(self):
+        proc, self.proc = self.proc, None
+        if proc is not None:
+            try:
+                proc.stdin.close()
+                proc.wait(timeout=2.0)
+            except Exception:
+                proc.kill()
+        self.init_ready.clear()
+
+    def _feed_loop(self):
+        period = 1.0 / self.fps
+        last_id, frame = -1, None
+        next_t = time.time()
+        try:
+            while self.running:
+                with self.lock:
+                    if not self.viewers and time.time() - self.last_viewer > self.idle_timeout:
+                        self.running = False # A new viewer starts a fresh feeder
+                        break
+                new, fid, ts = self.shared.get_preview(last_id)
+                if new is not None:
+                    frame, last_id, capture_ts = new, fid, ts
+                if frame is None:
+                    time.sleep(0.05)
+                    continue
+                if self.proc is None:
+                    h, w = frame.shape[:2]
+                    self._spawn(w - w % 2, h - h % 2) # yuv420p needs even sizes
+                if frame.shape[1] != self.size[0] or frame.shape[0] != self.size[1]:
+                    frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+                try:
+                    self.proc.stdin.write(frame.tobytes())
+                except (BrokenPipeError, OSError, ValueError):
+                    log.error("Live encoder exited")
+                    break
+                if self.epoch is None:
+                    self.epoch = capture_ts
+                self.frame_ids.append((self.written, last_id, capture_ts))
+                self.written += 1
+                next_t += period
+                time.sleep(max(next_t - time.time(), 0.0))
+                if time.time() - next_t > 1.0:
+                    next_t = time.time() # Fell behind (slow encoder): don't burst
+        finally:
+            self.running = False
+            self._close()
+
+    def _read_loop(self, proc):
+        read = proc.stdout.read
+        segments = iter_mp4_segments(read) if self.fmt == "fmp4" else iter_ts_segments(read)
+        try:
+            for kind, data in segments:
+                if kind == "init":
+                    self.init_segment = data
+                    self.init_ready.set()
+                elif self.fmt == "fmp4":
+                    self._broadcast(data, True)
+                else:
+                    self._broadcast(data, bool(_ts_random_access(data)))
+        except Exception as e:
+            log.warning(f"Live stream reader stopped: {e}")
+
+    def info(self):
+        with self.lock:
+            viewers = len(self.viewers)
+        last = self.frame_ids[-1] if self.frame_ids else None
+        return dict(self.stats, format=self.fmt, running=self.running, viewers=viewers, fps=self.fps,
+                    size=self.size, epoch=self.epoch,
+                    last_frame={"index": last[0], "frame_id": last[1], "timestamp": last[2]} if last else None)
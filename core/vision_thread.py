@@ -1,18 +1,44 @@
-import cv2
+import os
 import time
 import threading
 import logging
+import cv2
 from core.shared_state import SharedState
+from core.capture import open_capture
+from core.roi import RoiLayout
+
+def _env_int(name):
+    value = os.getenv(name)
+    return int(value) if value else None
 
 class VisionThread:
-    def __init__(self, source=0):
+    def __init__(self, source=0, backend=None, width=None, height=None, fps=None, fourcc=None,
+                 reconnect_base=0.5, reconnect_max=30.0, preview_width=None):
         self.source = source
         self.running = False
         self.cap = None
         self.shared = SharedState()
         self.thread = None
         self.lock = threading.Lock()
-        
+
+        # Capture negotiation (falls back to .env, then device defaults)
+        self.backend = backend or os.getenv("CAMERA_BACKEND", "opencv")
+        self.capture_options = {
+            "width": width or _env_int("CAMERA_WIDTH"),
+            "height": height or _env_int("CAMERA_HEIGHT"),
+            "fps": fps or _env_int("CAMERA_FPS"),
+            "fourcc": fourcc or os.getenv("CAMERA_FOURCC") or None,
+        }
+
+        # Reconnect with exponential backoff: base, 2*base, 4*base ... capped at max
+        self.reconnect_base = reconnect_base
+        self.reconnect_max = reconnect_max
+        self.failures = 0
+
+        # Dual-resolution path: model-sized RGB letterbox + downscaled preview
+        self.preview_width = preview_width or _env_int("PREVIEW_WIDTH") or 960
+        self.layout = None
+
     def start(self):
         if self.running: return
         self.running = True
@@ -33,41 +59,65 @@ class VisionThread:
 
     def _init_camera(self):
         try:
-            logging.getLogger("panoptes.vision").info(f"Connecting to camera {self.source}...")
-            cap = cv2.VideoCapture(self.source)
-            if not cap.isOpened():
-                return None
-            
-            # Request High FPS
-            cap.set(cv2.CAP_PROP_FPS, 60) 
-            # cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-            # cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-            return cap
+            logging.getLogger("panoptes.vision").info(f"Connecting to camera {self.source} ({self.backend})...")
+            return open_capture(self.source, backend=self.backend, **self.capture_options)
         except Exception as e:
             print(f"[VISION] Error init camera: {e}")
             return None
 
+    def _backoff(self):
+        delay = min(self.reconnect_base * (2 ** self.failures), self.reconnect_max)
+        self.failures += 1
+        logging.getLogger("panoptes.vision").warning(f"Camera unavailable, retry #{self.failures} in {delay:.1f}s")
+        # Sleep in small slices so stop() is not blocked by a long backoff
+        deadline = time.time() + delay
+        while self.running and time.time() < deadline:
+            time.sleep(0.1)
+
     def _capture_loop(self):
         while self.running:
             # 1. Check Camera
             if self.cap is None or not self.cap.isOpened():
+                self._release_camera()
                 self.cap = self._init_camera()
                 if self.cap is None:
-                    time.sleep(2.0) # Retry delay
+                    self._backoff()
                     continue
-            
-            # 2. Capture
+
+            # 2. Capture (latest frame only for network streams, see core.capture)
             ret, frame = self.cap.read()
+            if not ret and getattr(self.cap, "finished", False):
+                # Non-looping replay / image sequence: done, keep the last frame published
+                logging.getLogger("panoptes.vision").info(f"Source {self.source} finished")
+                self._release_camera()
+                self.running = False
+                break
             if not ret:
                 print("[VISION] Frame drop / Camera disconnect")
                 self._release_camera()
-                time.sleep(1.0)
+                self._backoff()
                 continue
-            
-            # 3. Push to Shared State (Fast)
-            self.shared.update_frame(frame)
-            
-            # 4. Yield slightly to prevent CPU hogging (1ms), relying on blocking read() usually
-            # But read() blocks until frame arrives, so we don't need sleep if camera is sync.
-            # However, for safety in tight loops:
-            # time.sleep(0.001) 
+            self.failures = 0
+
+            # 3. Derive, once per capture, what each consumer actually needs
+            model_input, layout = self._prepare_model_input(frame)
+            preview = self._prepare_preview(frame)
+
+            # 4. Push to Shared State (Fast). Capture time from the source: grab
+            # time for cameras, virtual clock for replay / synthetic (core.sources)
+            self.shared.update_frame(frame, model_input=model_input, layout=layout, preview=preview,
+                                     timestamp=getattr(self.cap, "timestamp", None) or None)
+
+    def _prepare_model_input(self, frame):
+        rois, imgsz = self.shared.get_model_config()
+        if self.layout is None or not self.layout.matches(rois, frame.shape, imgsz):
+            self.layout = RoiLayout(rois, frame.shape, size=imgsz)
+        return self.layout.build(frame), self.layout
+
+    def _prepare_preview(self, frame):
+        h, w = frame.shape[:2]
+        if w <= self.preview_width:
+            # Recorder / MJPEG / live encoder hold the preview for many frames
+            return frame.copy() if getattr(self.cap, "reuses_buffers", False) else frame
+        ph = int(round(h * self.preview_width / w))
+        return cv2.resize(frame, (self.preview_width, ph), interpolation=cv2.INTER_AREA)
@@ -1,109 +1,197 @@
 import cv2
 import numpy as np
+from collections import OrderedDict
+
+# Standard COCO Skeleton Connectivity
+# 5-7 (L Arm), 7-9 (L Forearm), 6-8 (R Arm), 8-10 (R Forearm)
+# 5-6 (Shoulders), 11-12 (Hips), 5-11 (L Side), 6-12 (R Side)
+# 11-13 (L Thigh), 13-15 (L Calf), 12-14 (R Thigh), 14-16 (R Calf)
+CONNECTIONS = np.array([
+    (5, 7), (7, 9), (6, 8), (8, 10),
+    (5, 6), (11, 12), (5, 11), (6, 12),
+    (11, 13), (13, 15), (12, 14), (14, 16)
+])
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
+def _disc(radius):
+    """(dy, dx) offsets of a filled disc, for stamping all joints with one indexed assignment."""
+    r = np.arange(-radius, radius + 1)
+    dy, dx = np.meshgrid(r, r, indexing="ij")
+    inside = dy ** 2 + dx ** 2 <= radius ** 2 + radius # Same footprint as cv2.circle(r, -1)
+    return dy[inside], dx[inside]
+
 
 class Visualizer:
-    def __init__(self):
+    """
+    HUD renderer with a per-frame cost that stays flat as the crowd grows:
+    - Box corners and skeleton bones of ALL persons go out in one cv2.polylines
+      call per color; joints are stamped with a single indexed assignment.
+    - Labels are pre-rendered sprites cached per (text, color) and blitted.
+    - When the detections (in pixels) are identical to the previous call, the
+      cached overlay pixels are written back in one indexed assignment instead
+      of drawing again.
+    - render_width: frames wider than this are downscaled first (e.g. to the
+      preview resolution) and the scaled frame is returned.
+    """
+    def __init__(self, render_width=None, sprite_cache=256):
         self.colors = {
             "NEUTRAL": (0, 255, 255), # Cyan
             "MANOS_ARRIBA": (0, 0, 255), # Red
             "AGRESION": (0, 0, 255), # Red
             "GOLPE": (0, 0, 255), # Red
+            "CAIDA": (0, 0, 255), # Red
+            "PELEA": (0, 0, 255), # Red
             "TEXT_BG": (0, 0, 0),
             "TEXT": (255, 255, 255),
             "SKELETON": (255, 0, 255) # Magenta
         }
-        
+        self.render_width = render_width
+        self.corner_length = 20
+        self.thickness = 2
+        self.font_scale = 0.6
+        self.joint = _disc(3)
+        self.sprites = OrderedDict() # {(text, color): (bgr, mask)}
+        self.sprite_cache = sprite_cache
+        # Cached overlay of the last scene: key, (pixel indices, BGR values)
+        self._key = None
+        self._overlay = None
+
     def draw_scene(self, frame, detections):
         """
         Main render function.
         frame: BGR uint8 numpy array (writable)
         detections: list of dicts from BehaviorEngine/Inference
+        Returns the annotated frame (the same array unless render_width downscaled it).
         """
         h, w = frame.shape[:2]
-        
-        for det in detections:
-            action = det.get('action', 'NEUTRAL')
-            color = self.colors.get(action, self.colors["NEUTRAL"])
-            
-            # 1. Unpack & Scale Box
-            box_norm = det.get('box_norm', [0,0,0,0])
-            x1 = int(box_norm[0] * w)
-            y1 = int(box_norm[1] * h)
-            x2 = int(box_norm[2] * w)
-            y2 = int(box_norm[3] * h)
-            
-            # Clamp
-            x1, y1 = max(0, x1), max(0, y1)
-            x2, y2 = min(w, x2), min(h, y2)
-            
-            # 2. Draw Corners
-            self._draw_corners(frame, (x1, y1, x2, y2), color)
-            
-            # 3. Draw Skeleton
-            kpts_norm = det.get('keypoints_norm', []) # List of [x, y] or [x, y, conf]
-            if len(kpts_norm) > 0:
-                self._draw_skeleton(frame, kpts_norm, w, h)
-                
-            # 4. Draw HUD Label
-            label = f"ID:{det.get('id', '?')} | {action}"
-            self._draw_hud_label(frame, (x1, y1), label, color)
-            
-    def _draw_corners(self, img, box, color, length=20, thickness=2):
-        x1, y1, x2, y2 = box
-        # Top-Left
-        cv2.line(img, (x1, y1), (x1 + length, y1), color, thickness)
-        cv2.line(img, (x1, y1), (x1, y1 + length), color, thickness)
-        # Top-Right
-        cv2.line(img, (x2, y1), (x2 - length, y1), color, thickness)
-        cv2.line(img, (x2, y1), (x2, y1 + length), color, thickness)
-        # Bottom-Left
-        cv2.line(img, (x1, y2), (x1 + length, y2), color, thickness)
-        cv2.line(img, (x1, y2), (x1, y2 - length), color, thickness)
-        # Bottom-Right
-        cv2.line(img, (x2, y2), (x2 - length, y2), color, thickness)
-        cv2.line(img, (x2, y2), (x2, y2 - length), color, thickness)
-
-    def _draw_skeleton(self, img, kpts, w, h):
-        # Kpts is list of [x, y] normalized
-        # Standard COCO Skeleton Connectivity
-        # 5-7 (L Arm), 7-9 (L Forearm)
-        # 6-8 (R Arm), 8-10 (R Forearm)
-        # 5-6 (Shoulders)
-        # 11-12 (Hips)
-        # 5-11 (L Side), 6-12 (R Side)
-        # 11-13 (L Thigh), 13-15 (L Calf)
-        # 12-14 (R Thigh), 14-16 (R Calf)
-        
-        connections = [
-            (5,7), (7,9), (6,8), (8,10),
-            (5,6), (11,12), (5,11), (6,12),
-            (11,13), (13,15), (12,14), (14,16)
-        ]
-        
-        # Convert to pixels
-        px_pts = {}
-        for i, pt in enumerate(kpts):
-            if len(pt) >= 2 and pt[0] > 0 and pt[1] > 0: # Valid?
-                px_pts[i] = (int(pt[0] * w), int(pt[1] * h))
-                
-        # Draw Lines
-        for i, j in connections:
-            if i in px_pts and j in px_pts:
-                cv2.line(img, px_pts[i], px_pts[j], self.colors["SKELETON"], 2)
-                
-        # Draw Joints
-        for i, pt in px_pts.items():
-            if i > 4: # Skip face (0-4)
-                cv2.circle(img, pt, 3, (255, 255, 255), -1)
-
-    def _draw_hud_label(self, img, pos, text, color):
-        x, y = pos
-        font = cv2.FONT_HERSHEY_SIMPLEX
-        scale = 0.6
+        if self.render_width and w > self.render_width:
+            h = int(round(h * self.render_width / w))
+            w = self.render_width
+            frame = cv2.resize(frame, (w, h), interpolation=cv2.INTER_AREA)
+        if not detections:
+            self._key = None
+            return frame
+
+        scene = self._layout(detections, w, h)
+        key = (w, h, scene["boxes"].tobytes(), scene["kpts"].tobytes(), tuple(scene["labels"]))
+        if key != self._key:
+            # Changed scene: draw straight on the frame (cheapest for a one-off)
+            self._key, self._overlay = key, None
+            self._draw(frame, None, scene)
+            return frame
+
+        if not frame.flags.c_contiguous:
+            self._draw(frame, None, scene)
+            return frame
+        if self._overlay is None:
+            # Same scene twice in a row: render it once into a layer and keep only
+            # the touched pixels (a few % of the frame) as flat indices + colors
+            layer = np.zeros_like(frame)
+            mask = np.zeros((h, w), dtype=np.uint8)
+            self._draw(layer, mask, scene)
+            idx = np.flatnonzero(mask)
+            self._overlay = (idx, layer.reshape(-1, 3)[idx])
+        idx, values = self._overlay
+        frame.reshape(-1, 3)[idx] = values
+        return frame
+
+    def _layout(self, detections, w, h):
+        """Pixel geometry of the whole scene as arrays (one conversion for all persons)."""
+        n = len(detections)
+        boxes = np.array([d.get('box_norm', [0, 0, 0, 0]) for d in detections], dtype=np.float32).reshape(n, 4)
+        boxes = (boxes * (w, h, w, h)).astype(np.int32)
+        np.clip(boxes, 0, (w, h, w, h), out=boxes)
+
+        kpts = np.zeros((n, 17, 2), dtype=np.int32)
+        for i, det in enumerate(detections):
+            kp = det.get('keypoints_norm') # List of [x, y] or [x, y, conf]
+            if kp is not None and len(kp) >= 17:
+                kpts[i] = (np.asarray(kp, dtype=np.float32)[:17, :2] * (w, h)).astype(np.int32)
+
+        actions = [d.get('action', 'NEUTRAL') for d in detections]
+        labels = [f"ID:{d.get('id', '?')} | {a}" for d, a in zip(detections, actions)]
+        return {"boxes": boxes, "kpts": kpts, "actions": actions, "labels": labels}
+
+    def _draw(self, img, mask, scene):
+        boxes, kpts, actions = scene["boxes"], scene["kpts"], scene["actions"]
+
+        # 1. Corners, one polylines call per color
+        corners = self._corner_polylines(boxes)
+        colors = [self.colors.get(a, self.colors["NEUTRAL"]) for a in actions]
+        for color in set(colors):
+            idx = [i for i, c in enumerate(colors) if c == color]
+            pts = list(corners[idx].reshape(-1, 3, 2))
+            self._polylines(img, mask, pts, color)
+
+        # 2. Skeletons: every valid bone of every person in one call
+        valid = (kpts > 0).all(axis=2) # (N, 17)
+        a, b = CONNECTIONS[:, 0], CONNECTIONS[:, 1]
+        bones = np.stack([kpts[:, a], kpts[:, b]], axis=2) # (N, 12, 2, 2)
+        bones = bones[valid[:, a] & valid[:, b]]
+        if len(bones):
+            self._polylines(img, mask, list(bones), self.colors["SKELETON"])
+
+        # 3. Joints (skip face 0-4): stamp a disc at every valid joint at once
+        joints = kpts[:, 5:][valid[:, 5:]]
+        if len(joints):
+            h, w = img.shape[:2]
+            dy, dx = self.joint
+            ys = np.clip(joints[:, 1, None] + dy, 0, h - 1)
+            xs = np.clip(joints[:, 0, None] + dx, 0, w - 1)
+            img[ys, xs] = (255, 255, 255)
+            if mask is not None:
+                mask[ys, xs] = 255
+
+        # 4. HUD Labels (cached sprites)
+        for (x1, y1), text, color in zip(boxes[:, :2].tolist(), scene["labels"], colors):
+            self._blit_label(img, mask, x1, y1, text, color)
+
+    def _corner_polylines(self, boxes):
+        """(N, 4, 3, 2): the 4 L-shaped corners of every box."""
+        L = self.corner_length
+        x1, y1, x2, y2 = (boxes[:, i] for i in range(4))
+        return np.stack([
+            np.stack([np.stack([x1 + L, y1], 1), np.stack([x1, y1], 1), np.stack([x1, y1 + L], 1)], 1), # Top-Left
+            np.stack([np.stack([x2 - L, y1], 1), np.stack([x2, y1], 1), np.stack([x2, y1 + L], 1)], 1), # Top-Right
+            np.stack([np.stack([x1 + L, y2], 1), np.stack([x1, y2], 1), np.stack([x1, y2 - L], 1)], 1), # Bottom-Left
+            np.stack([np.stack([x2 - L, y2], 1), np.stack([x2, y2], 1), np.stack([x2, y2 - L], 1)], 1), # Bottom-Right
+        ], 1).astype(np.int32)
+
+    def _polylines(self, img, mask, pts, color):
+        cv2.polylines(img, pts, False, color, self.thickness)
+        if mask is not None:
+            cv2.polylines(mask, pts, False, 255, self.thickness)
+
+    def _sprite(self, text, color):
+        key = (text, color)
+        sprite = self.sprites.get(key)
+        if sprite is not None:
+            self.sprites.move_to_end(key)
+            return sprite
         thick = 2
-        (fw, fh), _ = cv2.getTextSize(text, font, scale, thick)
-        
-        # BG
-        cv2.rectangle(img, (x, y - fh - 10), (x + fw + 10, y), (0,0,0), -1)
-        # Text
-        cv2.putText(img, text, (x + 5, y - 5), font, scale, color, thick)
+        (fw, fh), _ = cv2.getTextSize(text, FONT, self.font_scale, thick)
+        # BG box (TEXT_BG) with the text 5px in, like the legacy label
+        bgr = np.zeros((fh + 10, fw + 10, 3), dtype=np.uint8)
+        bgr[:] = self.colors["TEXT_BG"]
+        cv2.putText(bgr, text, (5, fh + 5), FONT, self.font_scale, color, thick)
+        sprite = self.sprites[key] = (bgr, np.full(bgr.shape[:2], 255, dtype=np.uint8))
+        while len(self.sprites) > self.sprite_cache:
+            self.sprites.popitem(last=False)
+        return sprite
+
+    def _blit_label(self, img, mask, x, y, text, color):
+        bgr, smask = self._sprite(text, color)
+        sh, sw = bgr.shape[:2]
+        h, w = img.shape[:2]
+        top = y - sh
+        # Clip the sprite to the frame
+        sx0, sy0 = max(0, -x), max(0, -top)
+        x0, y0 = max(x, 0), max(top, 0)
+        x1, y1 = min(x + sw, w), min(top + sh, h)
+        if x1 <= x0 or y1 <= y0:
+            return
+        img[y0:y1, x0:x1] = bgr[sy0:sy0 + (y1 - y0), sx0:sx0 + (x1 - x0)]
+        if mask is not None:
+            mask[y0:y1, x0:x1] = smask[sy0:sy0 + (y1 - y0), sx0:sx0 + (x1 - x0)]
@@ -0,0 +1,89 @@
+import numpy as np
+from core.roi import to_norm_rect
+
+
+class ZoneMonitor:
+    """
+    Per-zone presence tracking on top of the tracker IDs.
+    Uses the foot point of each box (bottom-center) and emits:
+    - ZONE_ENTRY when a track steps into a zone
+    - ZONE_EXIT when it has been outside (or lost) for longer than `exit_grace`
+    - LOITERING once per visit when dwell time exceeds `loitering_time`
+    """
+    def __init__(self, zones=None, loitering_time=5.0, exit_grace=1.0):
+        self.loitering_time = loitering_time
+        self.exit_grace = exit_grace
+        self.names = []
+        self.rects = np.zeros((0, 4), dtype=np.float32)
+        self._raw = None
+        self.inside = {}   # {zone: {track_id: {"entered": ts, "last": ts, "loitering": bool}}}
+        self.loitering = 0 # Tracks loitering after the last update() (read from other threads)
+        if zones:
+            self.configure(zones, (1, 1))
+
+    def configure(self, zones, frame_shape, loitering_time=None):
+        """zones: {name: [x1, y1, x2, y2]} in pixels or normalized coords."""
+        if loitering_time is not None:
+            self.loitering_time = float(loitering_time)
+        key = (repr(zones), tuple(frame_shape[:2]))
+        if key == self._raw:
+            return
+        self._raw = key
+        h, w = frame_shape[:2]
+        self.names = list(zones.keys())
+        self.rects = np.array([to_norm_rect(zones[n], w, h) for n in self.names], dtype=np.float32).reshape(-1, 4)
+        self.inside = {n: self.inside.get(n, {}) for n in self.names}
+
+    def update(self, detections, timestamp):
+        """
+        Tags each detection with the zones it is in (`det["zones"]`) and
+        returns the list of events produced in this frame.
+        """
+        events = []
+        if not self.names:
+            self.loitering = 0
+            return events
+
+        if detections:
+            boxes = np.array([d["box_norm"] for d in detections], dtype=np.float32)
+            fx = (boxes[:, 0] + boxes[:, 2]) / 2
+            fy = boxes[:, 3]
+            r = self.rects
+            # (N, Z) membership matrix
+            hit = ((fx[:, None] >= r[:, 0]) & (fx[:, None] <= r[:, 2]) &
+                   (fy[:, None] >= r[:, 1]) & (fy[:, None] <= r[:, 3]))
+        else:
+            hit = np.zeros((0, len(self.names)), dtype=bool)
+
+        for i, det in enumerate(detections):
+            det["zones"] = [self.names[z] for z in np.flatnonzero(hit[i])]
+
+        for z, name in enumerate(self.names):
+            state = self.inside[name]
+            for i in np.flatnonzero(hit[:, z]):
+                t_id = detections[i]["id"]
+                s = state.get(t_id)
+                if s is None:
+                    s = state[t_id] = {"entered": timestamp, "last": timestamp, "loitering": False}
+                    events.append(self._event("ZONE_ENTRY", name, t_id, timestamp, 0.0))
+                s["last"] = timestamp
+                dwell = timestamp - s["entered"]
+                if not s["loitering"] and dwell >= self.loitering_time:
+                    s["loitering"] = True
+                    events.append(self._event("LOITERING", name, t_id, timestamp, dwell))
+
+            for t_id in [k for k, s in state.items() if timestamp - s["last"] > self.exit_grace]:
+                s = state.pop(t_id)
+                events.append(self._event("ZONE_EXIT", name, t_id, timestamp, s["last"] - s["entered"]))
+
+        # Counted here, on the inference thread: iterating `inside` from the
+        # server threads races with the updates above
+        self.loitering = sum(1 for state in self.inside.values() for s in state.values() if s["loitering"])
+        return events
+
+    def loitering_count(self):
+        """Loitering tracks as of the last update(). Safe to call from any thread."""
+        return self.loitering
+
+    def _event(self, kind, zone, track_id, timestamp, dwell):
+        return {"type": kind, "zone": zone, "id": int(track_id), "timestamp": timestamp, "dwell": round(dwell, 2)}
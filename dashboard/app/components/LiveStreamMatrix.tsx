@@ -2,7 +2,6 @@
 import React from 'react';
 import { Shield, Video, VideoOff } from 'lucide-react';
 import FullscreenViewer from './FullscreenViewer';
-import { motion, AnimatePresence } from 'framer-motion';
 
 interface TelemetryData {
     fps: number;
@@ -14,16 +13,25 @@ interface TelemetryData {
     cam_active: boolean;
     camera_status?: string;
     frame?: string; // Base64 encoded frame
+    frame_id?: number | null; // Frame the detections were computed on (matches X-Frame-Id)
+    draw_on_server?: boolean;
 }
 
 interface Detection {
     id: number;
     box: [number, number, number, number];
-    conf: number;
+    box_norm?: [number, number, number, number]; // 0-1 of the full frame
+    keypoints_norm?: number[][]; // 17 x [x, y] (0 = missing)
+    conf?: number;
     action?: string;
+    severity?: string;
     emotion?: string;
     emotion_conf?: number;
-    landmarks?: [number, number, number, number][]; // [id, x, y, conf]
+}
+
+interface DetectionBatch {
+    frame_id: number;
+    detections: Detection[];
 }
 
 // COCO Skeleton Connections (pairs of indices)
@@ -34,6 +42,76 @@ const SKELETON_PAIRS = [
     [5, 11], [6, 12] // Torso
 ];
 
+const MAX_BATCHES = 30;
+const HEADER_END = [13, 10, 13, 10]; // \r\n\r\n
+
+function indexOfSeq(buf: Uint8Array, seq: number[]): number {
+    outer: for (let i = 0; i <= buf.length - seq.length; i++) {
+        for (let j = 0; j < seq.length; j++) {
+            if (buf[i + j] !== seq[j]) continue outer;
+        }
+        return i;
+    }
+    return -1;
+}
+
+// Newest batch computed on a frame not newer than the one on screen (else the oldest we have)
+function batchFor(batches: DetectionBatch[], frameId: number): DetectionBatch | undefined {
+    let best: DetectionBatch | undefined;
+    for (const b of batches) {
+        if (b.frame_id <= frameId && (!best || b.frame_id > best.frame_id)) best = b;
+    }
+    return best ?? batches[0];
+}
+
+function drawHud(ctx: CanvasRenderingContext2D, detections: Detection[], w: number, h: number) {
+    ctx.lineWidth = 2;
+    ctx.font = 'bold 14px monospace';
+    for (const det of detections) {
+        if (!det.box_norm) continue;
+        const danger = det.severity === 'HIGH' || det.severity === 'CRITICAL';
+        const color = danger ? '#ff0000' : '#00ffff';
+        const [x1, y1, x2, y2] = [det.box_norm[0] * w, det.box_norm[1] * h, det.box_norm[2] * w, det.box_norm[3] * h];
+        const L = 20;
+
+        // Corners
+        ctx.strokeStyle = color;
+        ctx.beginPath();
+        ctx.moveTo(x1 + L, y1); ctx.lineTo(x1, y1); ctx.lineTo(x1, y1 + L);
+        ctx.moveTo(x2 - L, y1); ctx.lineTo(x2, y1); ctx.lineTo(x2, y1 + L);
+        ctx.moveTo(x1 + L, y2); ctx.lineTo(x1, y2); ctx.lineTo(x1, y2 - L);
+        ctx.moveTo(x2 - L, y2); ctx.lineTo(x2, y2); ctx.lineTo(x2, y2 - L);
+        ctx.stroke();
+
+        // Skeleton + joints (skip face 0-4)
+        const kp = det.keypoints_norm;
+        if (kp && kp.length >= 17) {
+            const ok = (i: number) => kp[i][0] > 0 && kp[i][1] > 0;
+            ctx.strokeStyle = '#ff00ff';
+            ctx.beginPath();
+            for (const [a, b] of SKELETON_PAIRS) {
+                if (ok(a) && ok(b)) {
+                    ctx.moveTo(kp[a][0] * w, kp[a][1] * h);
+                    ctx.lineTo(kp[b][0] * w, kp[b][1] * h);
+                }
+            }
+            ctx.stroke();
+            ctx.fillStyle = '#ffffff';
+            for (let i = 5; i < 17; i++) {
+                if (ok(i)) ctx.fillRect(kp[i][0] * w - 3, kp[i][1] * h - 3, 6, 6);
+            }
+        }
+
+        // Label
+        const label = `ID:${det.id} | ${det.action || 'DESCONOCIDO'}${det.emotion && det.emotion !== 'NEUTRAL' ? ` // ${det.emotion}` : ''}`;
+        const tw = ctx.measureText(label).width;
+        ctx.fillStyle = '#000000';
+        ctx.fillRect(x1, y1 - 24, tw + 10, 24);
+        ctx.fillStyle = color;
+        ctx.fillText(label, x1 + 5, y1 - 7);
+    }
+}
+
 export default function LiveStreamMatrix({ telemetry }: { telemetry: TelemetryData | null }) {
     const [fullscreen, setFullscreen] = React.useState(false);
     const [toggling, setToggling] = React.useState(false);
@@ -64,6 +142,92 @@ export default function LiveStreamMatrix({ telemetry }: { telemetry: TelemetryDa
     };
 
     const canvasRef = React.useRef<HTMLCanvasElement>(null);
+    const overlayRef = React.useRef<HTMLCanvasElement>(null);
+    const batchesRef = React.useRef<DetectionBatch[]>([]);
+
+    // Raw-video mode: the server sends unannotated frames, we draw the HUD
+    const clientOverlay = telemetry?.draw_on_server === false && !!telemetry?.cam_active;
+
+    // Keep the last detection batches by frame_id to match them with the frames on screen
+    React.useEffect(() => {
+        if (telemetry?.frame_id == null) return;
+        const batches = batchesRef.current;
+        if (batches.length && batches[batches.length - 1].frame_id === telemetry.frame_id) return;
+        batches.push({ frame_id: telemetry.frame_id, detections: telemetry.detections || [] });
+        if (batches.length > MAX_BATCHES) batches.shift();
+    }, [telemetry?.frame_id, telemetry?.detections]);
+
+    // Read the MJPEG stream ourselves to get each frame's X-Frame-Id
+    React.useEffect(() => {
+        if (!clientOverlay) return;
+        const controller = new AbortController();
+        let pending: { jpeg: Uint8Array; frameId: number } | null = null;
+        let drawing = false;
+
+        const draw = async () => {
+            if (drawing || !pending) return;
+            drawing = true;
+            const { jpeg, frameId } = pending;
+            pending = null;
+            try {
+                const bitmap = await createImageBitmap(new Blob([jpeg as BlobPart], { type: 'image/jpeg' }));
+                const canvas = overlayRef.current;
+                const ctx = canvas?.getContext('2d');
+                if (canvas && ctx) {
+                    if (canvas.width !== bitmap.width || canvas.height !== bitmap.height) {
+                        canvas.width = bitmap.width;
+                        canvas.height = bitmap.height;
+                    }
+                    ctx.drawImage(bitmap, 0, 0);
+                    const batch = batchFor(batchesRef.current, frameId);
+                    if (batch) drawHud(ctx, batch.detections, canvas.width, canvas.height);
+                }
+                bitmap.close();
+            } catch (e) {
+                console.error("Frame decode error", e);
+            } finally {
+                drawing = false;
+                if (pending) draw(); // Only the newest frame waiting is kept
+            }
+        };
+
+        const run = async () => {
+            const resp = await fetch(streamSrc, { signal: controller.signal });
+            if (!resp.body) return;
+            const reader = resp.body.getReader();
+            const decoder = new TextDecoder();
+            let buf = new Uint8Array(0);
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                const next = new Uint8Array(buf.length + value.length);
+                next.set(buf);
+                next.set(value, buf.length);
+                buf = next;
+                // Parts: --frame / headers (Content-Length, X-Frame-Id) / JPEG
+                while (true) {
+                    const headerEnd = indexOfSeq(buf, HEADER_END);
+                    if (headerEnd < 0) break;
+                    const headers = decoder.decode(buf.subarray(0, headerEnd));
+                    const length = parseInt(/Content-Length:\s*(\d+)/i.exec(headers)?.[1] ?? '-1', 10);
+                    const start = headerEnd + HEADER_END.length;
+                    if (length < 0) {
+                        buf = buf.subarray(start);
+                        continue;
+                    }
+                    if (buf.length < start + length) break;
+                    const frameId = parseInt(/X-Frame-Id:\s*(\d+)/i.exec(headers)?.[1] ?? '-1', 10);
+                    pending = { jpeg: buf.slice(start, start + length), frameId };
+                    buf = buf.slice(start + length);
+                    draw();
+                }
+            }
+        };
+        run().catch(e => {
+            if (!controller.signal.aborted) console.error("Stream reader error", e);
+        });
+        return () => controller.abort();
+    }, [clientOverlay, streamSrc]);
 
     React.useEffect(() => {
         if (telemetry?.frame && canvasRef.current) {
@@ -100,9 +264,19 @@ export default function LiveStreamMatrix({ telemetry }: { telemetry: TelemetryDa
                     )}
 
                     {/* MJPEG Stream Implementation */}
-                    {telemetry?.cam_active ? (
+                    {clientOverlay ? (
                         <div className="relative w-full h-full">
-                            {/* Primary MJPEG Stream */}
+                            {/* Raw MJPEG frames + HUD drawn here (draw_on_server off) */}
+                            <canvas
+                                ref={overlayRef}
+                                className="w-full h-full object-cover"
+                                style={{ filter: "contrast(1.06) brightness(1.02) saturate(1.05)" }}
+                                onClick={() => setFullscreen(true)}
+                            />
+                        </div>
+                    ) : telemetry?.cam_active ? (
+                        <div className="relative w-full h-full">
+                            {/* Primary MJPEG Stream (HUD burned in by the server) */}
                             {/* eslint-disable-next-line @next/next/no-img-element */}
                             <img
                                 src={streamSrc}
@@ -141,63 +315,6 @@ export default function LiveStreamMatrix({ telemetry }: { telemetry: TelemetryDa
                 </div>
             )}
 
-            {/* SVG OVERLAY LAYER */}
-            <svg
-                className="absolute inset-0 w-full h-full pointer-events-none z-20"
-                viewBox="0 0 1280 720"
-                preserveAspectRatio="xMidYMid slice"
-            >
-                <AnimatePresence>
-                    {telemetry?.detections?.map((det) => {
-                        const [x1, y1, x2, y2] = det.box;
-                        return (
-                            <motion.g
-                                key={det.id}
-                                initial={{ opacity: 0 }}
-                                animate={{ opacity: 1 }}
-                                exit={{ opacity: 0 }}
-                            >
-                                <rect
-                                    x={x1} y={y1} width={x2 - x1} height={y2 - y1}
-                                    fill="none" stroke="#60a5fa" strokeWidth="1"
-                                    className="opacity-40"
-                                />
-                                <path d={`M ${x1} ${y1 + 15} V ${y1} H ${x1 + 15}`} stroke="#60a5fa" strokeWidth="2" fill="none" />
-                                <path d={`M ${x2 - 15} ${y1} H ${x2} V ${y1 + 15}`} stroke="#60a5fa" strokeWidth="2" fill="none" />
-                                <path d={`M ${x1} ${y2 - 15} V ${y2} H ${x1 + 15}`} stroke="#60a5fa" strokeWidth="2" fill="none" />
-                                <path d={`M ${x2 - 15} ${y2} H ${x2} V ${y2 - 15}`} stroke="#60a5fa" strokeWidth="2" fill="none" />
-
-                                <text x={x1} y={y1 - 6} className="fill-blue-400 text-[12px] font-bold font-mono italic">
-                                    ID_{det.id} [{det.action || "DESCONOCIDO"}] {det.emotion && det.emotion !== "NEUTRAL" ? ` // ${det.emotion}` : ""}
-                                </text>
-
-                                {/* Skeleton Rendering */}
-                                {det.landmarks && det.landmarks.length > 0 && det.landmarks.map((lm, i) => (
-                                    <circle key={`lm-${det.id}-${i}`} cx={lm[1]} cy={lm[2]} r="3" fill="#00e5ff" className="opacity-80" />
-                                ))}
-                                {det.landmarks && det.landmarks.length > 0 && SKELETON_PAIRS.map((pair, i) => {
-                                    const p1 = det.landmarks!.find(l => l[0] === pair[0]);
-                                    const p2 = det.landmarks!.find(l => l[0] === pair[1]);
-                                    if (p1 && p2 && p1[3] > 0.5 && p2[3] > 0.5) {
-                                        return (
-                                            <line
-                                                key={`bone-${det.id}-${i}`}
-                                                x1={p1[1]} y1={p1[2]}
-                                                x2={p2[1]} y2={p2[2]}
-                                                stroke="#00e5ff"
-                                                strokeWidth="2"
-                                                className="opacity-70 shadow-[0_0_10px_#00e5ff]"
-                                            />
-                                        );
-                                    }
-                                    return null;
-                                })}
-                            </motion.g>
-                        );
-                    })}
-                </AnimatePresence>
-            </svg>
-
             {/* Overlay UI Layer */}
             <div className="absolute inset-0 pointer-events-none p-6 flex flex-col justify-between z-30">
                 <div className="flex justify-between items-start">
@@ -36,6 +36,7 @@ interface TelemetryData {
     cam_active: boolean;
     logs: Array<{ id: number; time: string; msg: string; type: string }>;
     db_mode?: string;
+    draw_on_server?: boolean;
 }
 
 interface VaultItem {
@@ -124,6 +125,14 @@ export default function Home() {
         };
     }, []);
 
+    // The server owns draw_on_server: reflect its value in the settings toggle
+    useEffect(() => {
+        const serverDraws = telemetry?.draw_on_server;
+        if (serverDraws !== undefined) {
+            setSettings(prev => prev.draw_on_server === serverDraws ? prev : { ...prev, draw_on_server: serverDraws });
+        }
+    }, [telemetry?.draw_on_server]);
+
     // Simple REST fetch helpers
     const fetchVaultData = useCallback(() => {
         fetch('http://localhost:8000/vault')
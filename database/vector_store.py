@@ -1,71 +1,359 @@
-from pymilvus import connections, FieldSchema, CollectionSchema, DataType, Collection, utility
 import numpy as np
 import time
 import os
 import sqlite3
 import json
+import threading
+
+def _milvus_str(value):
+    """Quoted Milvus expression string literal (user input must not end the literal)."""
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
 
 class SQLiteDB:
     """
     Fallback ligero para cuando Milvus no está disponible.
     Guarda metadatos y vectores en base de datos local SQLite.
-    No soporta búsqueda vectorial real, pero permite persistencia de logs.
+
+    Particionado por día (UTC): una tabla `behaviors_YYYYMMDD` por día, con
+    índices por tiempo, persona, acción y tipo, y un catálogo `partitions`
+    con el rango temporal de cada una. Las consultas solo tocan las
+    particiones del rango pedido (de la más reciente a la más antigua, parando
+    al llenar `limit`).
+    Retención: las particiones más viejas que `compact_after_days` se
+    compactan (1 fila por persona/acción/`downsample_seconds`, sin vectores
+    salvo las filas de re-ID) y las más viejas que `retention_days` se
+    eliminan. El mantenimiento corre en segundo plano como mucho cada
+    `maintenance_interval` segundos, y también migra por bloques la tabla
+    legacy `behaviors` (que se sigue consultando mientras exista).
     """
-    def __init__(self, db_path="panoptes_lite.db"):
+    LEGACY = "behaviors"
+
+    def __init__(self, db_path="panoptes_lite.db", retention_days=None, compact_after_days=None,
+                 downsample_seconds=None, maintenance_interval=3600.0):
         self.db_path = db_path
+        self.retention_days = float(retention_days or os.getenv('DB_RETENTION_DAYS', 30))
+        self.compact_after_days = float(compact_after_days or os.getenv('DB_COMPACT_AFTER_DAYS', 7))
+        self.downsample_seconds = float(downsample_seconds or os.getenv('DB_DOWNSAMPLE_SECONDS', 60))
+        self.maintenance_interval = maintenance_interval
+        self._known = set() # Partitions created by this process
+        self._maint_lock = threading.Lock()
+        self._last_maintenance = 0.0
         self._init_db()
 
+    def _connect(self, new_file=False):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        if new_file:
+            # Space of dropped partitions is returned with incremental_vacuum.
+            # Must precede journal_mode=WAL, which already writes the header.
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL") # Readers don't block the writer
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
     def _init_db(self):
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            new_file = not os.path.exists(self.db_path)
+            with self._connect(new_file) as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS partitions (
+                        name TEXT PRIMARY KEY,
+                        start REAL, -- Day start (UTC epoch)
+                        end REAL,
+                        compacted INTEGER DEFAULT 0
+                    )
+                """)
+                # Event clips written by core.recorder.ClipRecorder (files on disk, index here)
                 conn.execute("""
-                    CREATE TABLE IF NOT EXISTS behaviors (
+                    CREATE TABLE IF NOT EXISTS clips (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        person_id INTEGER,
-                        timestamp REAL,
-                        vector TEXT, -- JSON string
+                        camera TEXT,
+                        start REAL,
+                        end REAL,
+                        action TEXT,
+                        severity TEXT,
+                        path TEXT,
                         metadata TEXT -- JSON string
                     )
                 """)
+                conn.execute("CREATE INDEX IF NOT EXISTS clips_start ON clips (start)")
         except Exception as e:
             print(f"ALERTA_SQLITE: Error init {e}")
 
+    @staticmethod
+    def partition_of(timestamp):
+        return "behaviors_" + time.strftime("%Y%m%d", time.gmtime(timestamp))
+
+    def _ensure_partition(self, conn, name, timestamp):
+        if name in self._known:
+            return
+        day_start = timestamp - timestamp % 86400
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {name} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                person_id INTEGER,
+                timestamp REAL,
+                action TEXT,
+                kind TEXT,
+                vector TEXT, -- JSON string
+                metadata TEXT -- JSON string
+            )
+        """)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name}_ts ON {name} (timestamp)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name}_person ON {name} (person_id, timestamp)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name}_action ON {name} (action, timestamp)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name}_kind ON {name} (kind)")
+        conn.execute("INSERT OR IGNORE INTO partitions (name, start, end) VALUES (?, ?, ?)",
+                     (name, day_start, day_start + 86400))
+        self._known.add(name)
+
+    @staticmethod
+    def _record(r):
+        meta = r.get("metadata") or {}
+        return (int(r["person_id"]), float(r["timestamp"]), meta.get("action"), meta.get("type"),
+                json.dumps(r.get("behavior_vector") or []), json.dumps(meta))
+
     def insert(self, row):
+        return self.insert_many([row]) == 1
+
+    def insert_many(self, rows):
+        """Inserción masiva en una sola transacción (agrupada por partición diaria)."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute(
-                    "INSERT INTO behaviors (person_id, timestamp, vector, metadata) VALUES (?, ?, ?, ?)",
-                    (row["person_id"], row["timestamp"], json.dumps(row["behavior_vector"]), json.dumps(row["metadata"]))
-                )
-            return True
+            by_day = {}
+            for r in rows:
+                by_day.setdefault(self.partition_of(float(r["timestamp"])), []).append(self._record(r))
+            with self._connect() as conn:
+                for name, records in by_day.items():
+                    self._ensure_partition(conn, name, records[0][1])
+                    conn.executemany(
+                        f"INSERT INTO {name} (person_id, timestamp, action, kind, vector, metadata) VALUES (?, ?, ?, ?, ?, ?)",
+                        records
+                    )
+            self._maybe_maintain()
+            return len(rows)
         except Exception as e:
             print(f"ALERTA_SQLITE: Insert error {e}")
-            return False
+            return 0
 
-    def query(self, limit=50):
+    def _tables(self, conn, start=None, end=None):
+        """Partitions overlapping [start, end), newest first; legacy table last while it exists."""
+        sql, args = "SELECT name FROM partitions WHERE 1=1", []
+        if start is not None:
+            sql += " AND end > ?"
+            args.append(start)
+        if end is not None:
+            sql += " AND start < ?"
+            args.append(end)
+        names = [r[0] for r in conn.execute(sql + " ORDER BY start DESC", args)]
+        if self._has_legacy(conn):
+            names.append(self.LEGACY)
+        return names
+
+    def _has_legacy(self, conn):
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (self.LEGACY,)).fetchone() is not None
+
+    @staticmethod
+    def _where(table, start, end, person_id, action, kind):
+        clauses, args = [], []
+        if start is not None:
+            clauses.append("timestamp >= ?"); args.append(start)
+        if end is not None:
+            clauses.append("timestamp < ?"); args.append(end)
+        if person_id is not None:
+            clauses.append("person_id = ?"); args.append(int(person_id))
+        legacy = table == SQLiteDB.LEGACY
+        if action is not None:
+            # Legacy rows have no action column: match inside the JSON
+            clauses.append("metadata LIKE ?" if legacy else "action = ?")
+            args.append(f'%"action": "{action}"%' if legacy else action)
+        if kind is not None:
+            clauses.append("metadata LIKE ?" if legacy else "kind = ?")
+            args.append(f'%"type": "{kind}"%' if legacy else kind)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", args
+
+    def query(self, limit=50, start=None, end=None, person_id=None, action=None):
+        """Últimos `limit` registros (más recientes primero), filtrados por rango/persona/acción."""
+        result = []
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                # Retorna los últimos 'limit' registros
-                cursor = conn.execute("SELECT id, person_id, timestamp, metadata FROM behaviors ORDER BY timestamp DESC LIMIT ?", (limit,))
-                rows = cursor.fetchall()
-                result = []
-                for r in rows:
-                    result.append({
-                        "id": r[0],
-                        "person_id": r[1],
-                        "timestamp": r[2],
-                        "metadata": json.loads(r[3]) if r[3] else {}
-                    })
-                return result
+            with self._connect() as conn:
+                for table in self._tables(conn, start, end):
+                    where, args = self._where(table, start, end, person_id, action, None)
+                    cursor = conn.execute(
+                        f"SELECT id, person_id, timestamp, metadata FROM {table}{where} ORDER BY timestamp DESC LIMIT ?",
+                        args + [limit - len(result)])
+                    for r in cursor.fetchall():
+                        result.append({
+                            "id": r[0],
+                            "person_id": r[1],
+                            "timestamp": r[2],
+                            "metadata": json.loads(r[3]) if r[3] else {}
+                        })
+                    if len(result) >= limit:
+                        break
+            # Partitions don't overlap in time, but the legacy table may
+            result.sort(key=lambda r: -r["timestamp"])
+            return result[:limit]
+        except Exception:
+            return result
+
+    def search(self, query_vector, limit=5, kind=None, chunk=4096, start=None, end=None):
+        """
+        Brute-force cosine search (no vector index in SQLite), streamed in chunks
+        so memory stays bounded. kind: only rows whose metadata "type" matches.
+        Returns the same dicts as VectorDB.search_behavior.
+        """
+        q = np.asarray(query_vector, dtype=np.float32)
+        q = q / (np.linalg.norm(q) + 1e-12)
+        best = []
+        try:
+            with self._connect() as conn:
+                for table in self._tables(conn, start, end):
+                    where, args = self._where(table, start, end, None, None, kind)
+                    cursor = conn.execute(f"SELECT id, person_id, timestamp, vector, metadata FROM {table}{where}", args)
+                    while True:
+                        rows = cursor.fetchmany(chunk)
+                        if not rows:
+                            break
+                        rows = [r for r in rows if r[3] and r[3] != "[]"]
+                        vecs = [json.loads(r[3]) for r in rows]
+                        keep = [i for i, v in enumerate(vecs) if len(v) == len(q)]
+                        if not keep:
+                            continue
+                        m = np.asarray([vecs[i] for i in keep], dtype=np.float32)
+                        scores = m @ q / (np.linalg.norm(m, axis=1) + 1e-12)
+                        top = np.argsort(-scores)[:limit]
+                        best.extend((float(scores[t]), rows[keep[t]]) for t in top)
+                        best = sorted(best, key=lambda x: -x[0])[:limit]
+        except Exception as e:
+            print(f"ALERTA_SQLITE: Search error {e}")
+            return []
+        return [{"id": r[0], "score": score, "person_id": r[1], "timestamp": r[2],
+                 "metadata": json.loads(r[4]) if r[4] else {}} for score, r in best]
+
+    # --- Clips index ---------------------------------------------------------
+    def insert_clip(self, clip):
+        """clip: {camera, start, end, action, severity, path, **metadata}. Returns the row id."""
+        try:
+            meta = {k: v for k, v in clip.items() if k not in ("camera", "start", "end", "action", "severity", "path")}
+            with self._connect() as conn:
+                cursor = conn.execute(
+                    "INSERT INTO clips (camera, start, end, action, severity, path, metadata) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (str(clip.get("camera")), clip["start"], clip["end"], clip.get("action"),
+                     clip.get("severity"), clip["path"], json.dumps(meta)))
+                return cursor.lastrowid
+        except Exception as e:
+            print(f"ALERTA_SQLITE: Clip insert error {e}")
+            return None
+
+    def query_clips(self, limit=50, start=None, end=None, action=None, clip_id=None):
+        """Latest clips first."""
+        sql, args = "SELECT id, camera, start, end, action, severity, path, metadata FROM clips WHERE 1=1", []
+        if clip_id is not None:
+            sql += " AND id = ?"; args.append(int(clip_id))
+        if start is not None:
+            sql += " AND end >= ?"; args.append(start)
+        if end is not None:
+            sql += " AND start < ?"; args.append(end)
+        if action is not None:
+            sql += " AND action = ?"; args.append(action)
+        try:
+            with self._connect() as conn:
+                rows = conn.execute(sql + " ORDER BY start DESC LIMIT ?", args + [limit]).fetchall()
         except Exception:
             return []
+        return [dict({"id": r[0], "camera": r[1], "start": r[2], "end": r[3], "action": r[4], "severity": r[5],
+                      "path": r[6]}, **(json.loads(r[7]) if r[7] else {})) for r in rows]
+
+    # --- Retention / compaction ---------------------------------------------
+    def _maybe_maintain(self):
+        now = time.time()
+        if now - self._last_maintenance < self.maintenance_interval or self._maint_lock.locked():
+            return
+        self._last_maintenance = now
+        threading.Thread(target=self.maintain, kwargs={"wait": False}, daemon=True).start()
+
+    def maintain(self, now=None, wait=True):
+        """Drops expired partitions, compacts old ones, migrates legacy rows. Returns a summary."""
+        if not self._maint_lock.acquire(blocking=wait):
+            return None
+        try:
+            now = now or time.time()
+            out = {"dropped": [], "compacted": [], "migrated": 0}
+            with self._connect() as conn:
+                out["migrated"] = self._migrate_legacy(conn)
+                parts = conn.execute("SELECT name, end, compacted FROM partitions").fetchall()
+                for name, p_end, compacted in parts:
+                    age_days = (now - p_end) / 86400
+                    if age_days > self.retention_days:
+                        conn.execute(f"DROP TABLE IF EXISTS {name}")
+                        conn.execute("DELETE FROM partitions WHERE name = ?", (name,))
+                        self._known.discard(name)
+                        out["dropped"].append(name)
+                    elif age_days > self.compact_after_days and not compacted:
+                        self._compact(conn, name)
+                        out["compacted"].append(name)
+                conn.commit()
+                if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2 and not self._has_legacy(conn):
+                    # Database created before partitioning (auto_vacuum only applies to new
+                    # files): switch it once the legacy table is gone. One-time full VACUUM.
+                    print(f"SQLITE: enabling incremental auto_vacuum on {self.db_path} (one-time VACUUM)...")
+                    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                    conn.execute("VACUUM")
+                    out["vacuumed"] = True
+                elif out["dropped"] or out["compacted"] or out["migrated"]:
+                    conn.execute("PRAGMA incremental_vacuum")
+            return out
+        except Exception as e:
+            print(f"ALERTA_SQLITE: Maintenance error {e}")
+            return None
+        finally:
+            self._maint_lock.release()
+
+    def _compact(self, conn, name):
+        # Downsample: first row per (person, action, bucket); re-ID rows keep their vectors
+        bucket = self.downsample_seconds
+        conn.execute(f"""
+            DELETE FROM {name} WHERE kind IS NOT 'REID' AND id NOT IN (
+                SELECT MIN(id) FROM {name} WHERE kind IS NOT 'REID'
+                GROUP BY person_id, action, CAST(timestamp / ? AS INTEGER)
+            )
+        """, (bucket,))
+        conn.execute(f"UPDATE {name} SET vector = '[]' WHERE kind IS NOT 'REID'")
+        conn.execute("UPDATE partitions SET compacted = 1 WHERE name = ?", (name,))
+
+    def _migrate_legacy(self, conn, batch=20000, max_rows=200000):
+        """Moves rows of the old single `behaviors` table into day partitions, in bounded chunks."""
+        if not self._has_legacy(conn):
+            return 0
+        moved = 0
+        while moved < max_rows:
+            rows = conn.execute(f"SELECT id, person_id, timestamp, vector, metadata FROM {self.LEGACY} ORDER BY id LIMIT ?",
+                                (batch,)).fetchall()
+            if not rows:
+                conn.execute(f"DROP TABLE {self.LEGACY}")
+                break
+            by_day = {}
+            for r in rows:
+                meta = json.loads(r[4]) if r[4] else {}
+                by_day.setdefault(self.partition_of(r[2] or 0.0), []).append(
+                    (r[1], r[2], meta.get("action"), meta.get("type"), r[3], r[4]))
+            for name, records in by_day.items():
+                self._ensure_partition(conn, name, records[0][1] or 0.0)
+                conn.executemany(
+                    f"INSERT INTO {name} (person_id, timestamp, action, kind, vector, metadata) VALUES (?, ?, ?, ?, ?, ?)",
+                    records)
+            conn.execute(f"DELETE FROM {self.LEGACY} WHERE id <= ?", (rows[-1][0],))
+            conn.commit()
+            moved += len(rows)
+        return moved
 
 class VectorDB:
     def __init__(self, host=None, port=None, collection_name=None, dim=128):
         """
         Initialize a Milvus client connection and ensure the collection exists.
         Reads `MILVUS_HOST` and `MILVUS_PORT` from environment when not provided.
-        Falls back to SQLite if Milvus is unreachable.
+        Falls back to SQLite if Milvus is unreachable or pymilvus is not installed.
+        VECTOR_BACKEND=sqlite skips Milvus entirely (pymilvus is never imported).
         """
         self.collection_name = collection_name or os.getenv('MILVUS_COLLECTION', 'behaviors')
         self.dim = dim or int(os.getenv('EMBED_DIM', 128))
@@ -74,8 +362,15 @@ class VectorDB:
         self.active = False
         self.mode = "MILVUS"
         self.sqlite = None
+        self.collection = None
+
+        if os.getenv('VECTOR_BACKEND', 'milvus').lower() == 'sqlite':
+            self.mode = "SQLITE"
+            self.sqlite = SQLiteDB()
+            return
 
         try:
+            from pymilvus import connections, Collection # Lazy: heavy (grpc) import
             connections.connect(alias='default', host=host, port=str(port))
             self._init_collection()
             self.collection = Collection(self.collection_name)
@@ -87,6 +382,7 @@ class VectorDB:
             self.sqlite = SQLiteDB()
 
     def _init_collection(self):
+        from pymilvus import FieldSchema, CollectionSchema, DataType, Collection, utility
         if utility.has_collection(self.collection_name):
             return
 
@@ -135,10 +431,40 @@ class VectorDB:
             print(f"ALERTA_DB: insert_behavior error: {e}")
             return None
 
-    def search_behavior(self, query_vector, limit=5):
+    def insert_behaviors(self, rows):
+        """
+        Bulk insert. rows: list of dicts with person_id, timestamp, vector, metadata.
+        One round-trip per call instead of one per row. Returns number of rows written.
+        """
+        if not rows:
+            return 0
+        rows = [{
+            "person_id": int(r["person_id"]),
+            "timestamp": float(r["timestamp"]),
+            "behavior_vector": list(r.get("vector") or []),
+            "metadata": r.get("metadata") or {}
+        } for r in rows]
+
+        if self.mode == "SQLITE" and self.sqlite:
+            return self.sqlite.insert_many(rows)
+
+        if not self.active or self.collection is None:
+            return 0
+
+        try:
+            valid = [r for r in rows if len(r["behavior_vector"]) == self.dim]
+            if valid:
+                self.collection.insert(valid)
+            return len(valid)
+        except Exception as e:
+            print(f"ALERTA_DB: insert_behaviors error: {e}")
+            return 0
+
+    def search_behavior(self, query_vector, limit=5, kind=None):
+        """Nearest stored vectors (cosine). kind: only rows with metadata["type"] == kind."""
         if self.mode == "SQLITE":
-            # No vector search in SQLite fallback
-            return []
+            # No vector index in SQLite fallback: brute force
+            return self.sqlite.search(query_vector, limit=limit, kind=kind) if self.sqlite else []
 
         if not self.active or self.collection is None:
             return []
@@ -149,6 +475,7 @@ class VectorDB:
                 anns_field="behavior_vector",
                 param=search_params,
                 limit=limit,
+                expr=f'metadata["type"] == {_milvus_str(kind)}' if kind else None,
                 output_fields=["person_id", "timestamp", "metadata"]
             )
             # format results
@@ -167,18 +494,23 @@ class VectorDB:
             print(f"ALERTA_DB: search_behavior error: {e}")
             return []
 
-    def query(self, expr=None, output_fields=None, limit=50):
+    def query(self, expr=None, output_fields=None, limit=50, start=None, end=None, person_id=None, action=None):
         # Fallback browse
         if self.mode == "SQLITE" and self.sqlite:
-            # If expr is empty (browse all), return latest
+            # If expr is empty (browse / filter by range, person, action), return latest
             if not expr:
-                return self.sqlite.query(limit=limit)
+                return self.sqlite.query(limit=limit, start=start, end=end, person_id=person_id, action=action)
             return []
 
         if not self.active or self.collection is None:
             return []
+        filters = [expr] if expr else []
+        if start is not None: filters.append(f"timestamp >= {float(start)}")
+        if end is not None: filters.append(f"timestamp < {float(end)}")
+        if person_id is not None: filters.append(f"person_id == {int(person_id)}")
+        if action is not None: filters.append(f'metadata["action"] == {_milvus_str(action)}')
         try:
-            return self.collection.query(expr=expr or "", output_fields=output_fields or ["person_id", "timestamp", "metadata"], limit=limit)
+            return self.collection.query(expr=" and ".join(filters), output_fields=output_fields or ["person_id", "timestamp", "metadata"], limit=limit)
         except Exception as e:
             print(f"ALERTA_DB: query error: {e}")
             return []
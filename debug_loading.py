@@ -8,6 +8,8 @@ try:
     print("Step 1: numpy imported")
     from ultralytics import YOLO
     print("Step 1: ultralytics imported")
+    from core.model_registry import ModelRegistry
+    print("Step 1: model registry imported")
     import mediapipe as mp
     print("Step 1: mediapipe imported")
     from pymilvus import connections
@@ -18,13 +20,23 @@ except Exception as e:
 
 print("Step 2: Model Loading...")
 try:
+    registry = ModelRegistry()
     print("Loading YOLO...")
-    model = YOLO("yolo11n.pt")
-    print("YOLO Loaded")
+    t0 = time.time()
+    model = registry.acquire("yolo11n.pt")
+    print(f"YOLO Loaded on {model.device} ({time.time() - t0:.2f}s incl. warmup)")
     
     print("Loading Pose...")
-    pose_model = YOLO("yolo11n-pose.pt")
-    print("Pose Loaded")
+    t0 = time.time()
+    pose_model = registry.acquire("yolo11n-pose.pt")
+    print(f"Pose Loaded on {pose_model.device} ({time.time() - t0:.2f}s incl. warmup)")
+    
+    # Same key -> same instance, no second load
+    again = registry.acquire("yolo11n-pose.pt")
+    print(f"Pose shared: {again.model is pose_model.model}")
+    for h in (model, pose_model, again):
+        h.release()
+    print(f"Registry: {registry.stats()}")
 except Exception as e:
     print(f"Step 2 ERROR: {e}")
     sys.exit(1)
@@ -1,5 +1,35 @@
 import numpy as np
 import os
+import threading
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', '.cache')
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+def reid_model_path(dim, quantized=False):
+    """Compact re-ID model exported by detectors/export_onnx.py --reid."""
+    return os.path.join(CACHE_DIR, f'reid_{dim}{".int8" if quantized else ""}.onnx')
+
+
+def crop_box(frame, box):
+    """BGR crop of [x1, y1, x2, y2] px, clipped to the frame (at least 1x1)."""
+    x1, y1, x2, y2 = map(int, box)
+    h, w = frame.shape[:2]
+    x1 = max(0, min(x1, w-1))
+    x2 = max(0, min(x2, w-1))
+    y1 = max(0, min(y1, h-1))
+    y2 = max(0, min(y2, h-1))
+    return frame[y1:y2 if y2>y1 else y1+1, x1:x2 if x2>x1 else x1+1]
+
+
+def preprocess(crops_bgr, size=224):
+    """BGR crops -> (B, 3, size, size) float32 ImageNet-normalized RGB (one array op for the batch)."""
+    import cv2
+    batch = np.stack([cv2.resize(c, (size, size), interpolation=cv2.INTER_LINEAR) for c in crops_bgr])
+    batch = batch[..., ::-1].astype(np.float32) / 255.0
+    batch = (batch - IMAGENET_MEAN) / IMAGENET_STD
+    return np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
 
 
 class EmbeddingExtractor:
@@ -8,53 +38,81 @@ class EmbeddingExtractor:
     (MobileNetV2) for image-based features. If PyTorch is not available or
     model load fails, falls back to a deterministic lightweight extractor
     based on bbox geometry and pose features.
+    The backend is initialized on first embed() (or warmup()), not in the
+    constructor: importing torchvision / downloading weights costs seconds.
+    Once the ONNX file is cached, later runs only import onnxruntime.
+    backend (or EMBED_BACKEND): auto (onnx > torch > deterministic), onnx, torch, deterministic.
     """
-    def __init__(self, dim=128, device=None):
+    def __init__(self, dim=128, device=None, backend=None):
         self.dim = dim
         self.device = device
+        self.backend = (backend or os.getenv('EMBED_BACKEND', 'auto')).lower()
         self._use_torch = False
         self._torch_model = None
+        self._use_onnx = False
+        self._ort_session = None
+        self.model_path = None # ONNX file in use
+        self._ready = False
+        self._init_lock = threading.Lock()
+
+    def warmup(self):
+        """Initializes the backend now (e.g. from a background thread)."""
+        self._ensure_backend()
+        return self
+
+    def _ensure_backend(self):
+        if self._ready:
+            return
+        with self._init_lock:
+            if self._ready:
+                return
+            if self.backend in ('auto', 'onnx'):
+                self._init_onnx()
+            if not self._use_onnx and self.backend in ('auto', 'torch'):
+                self._init_torch()
+            self._ready = True
+
+    @staticmethod
+    def _load_mobilenet():
+        import torch
+        import torchvision
+        # small MobileNetV2 backbone without classifier
+        try:
+            # Try new API first (weights parameter)
+            from torchvision.models import MobileNet_V2_Weights
+            model = torchvision.models.mobilenet_v2(weights=MobileNet_V2_Weights.IMAGENET1K_V1)
+        except (ImportError, AttributeError):
+            # Fallback for older torchvision versions
+            model = torchvision.models.mobilenet_v2(pretrained=True)
+        # use feature extractor by removing classifier
+        model.classifier = torch.nn.Identity()
+        model.eval()
+        return model
+
+    def _init_torch(self):
         try:
             import torch
-            import torchvision
             from torchvision import transforms
 
-            # small MobileNetV2 backbone without classifier
-            try:
-                # Try new API first (weights parameter)
-                from torchvision.models import MobileNet_V2_Weights
-                model = torchvision.models.mobilenet_v2(weights=MobileNet_V2_Weights.IMAGENET1K_V1)
-            except (ImportError, AttributeError):
-                # Fallback for older torchvision versions
-                model = torchvision.models.mobilenet_v2(pretrained=True)
-            # use feature extractor by removing classifier
-            model.classifier = torch.nn.Identity()
-            model.eval()
+            model = self._load_mobilenet()
+            device = self.device
             if device is None:
                 device = torch.device('cpu')
             model.to(device)
-            # CPU optimizations: limit threads and attempt compilation/tracing
+            # CPU optimizations: limit threads
             try:
-                import os
                 num_threads = max(1, (os.cpu_count() or 1) - 1)
                 torch.set_num_threads(num_threads)
             except Exception:
                 pass
 
             self._torch_model = model
-            # Try to compile (torch>=2.0) for performance
-            try:
-                if hasattr(torch, 'compile'):
-                    self._torch_model = torch.compile(self._torch_model)
-            except Exception:
-                pass
-
             # Try to trace/jit the model for faster CPU inference
             try:
                 dummy = torch.randn(1, 3, 224, 224, device=device)
                 self._torch_model = torch.jit.trace(self._torch_model, dummy)
             except Exception:
-                # tracing failed; continue with compiled/regular model
+                # tracing failed; continue with regular model
                 pass
             self._torch_transforms = transforms.Compose([
                 transforms.ToPILImage(),
@@ -64,58 +122,61 @@ class EmbeddingExtractor:
             ])
             self._torch = torch
             self._use_torch = True
-            # Try to enable ONNXRuntime backend for faster CPU inference if available
-            try:
-                import onnxruntime as ort
-                cache_dir = os.path.join(os.path.dirname(__file__), '..', '.cache')
-                os.makedirs(cache_dir, exist_ok=True)
-                onnx_path = os.path.join(cache_dir, 'mobilenetv2.onnx')
-                # Export ONNX if not present
-                if not os.path.exists(onnx_path):
-                    try:
-                        try:
-                            from torchvision.models import MobileNet_V2_Weights
-                            export_model = torchvision.models.mobilenet_v2(weights=MobileNet_V2_Weights.IMAGENET1K_V1)
-                        except (ImportError, AttributeError):
-                            export_model = torchvision.models.mobilenet_v2(pretrained=True)
-                        export_model.classifier = torch.nn.Identity()
-                        export_model.eval()
-                        export_model.to('cpu')
-                        dummy = torch.randn(1, 3, 224, 224)
-                        torch.onnx.export(
-                            export_model,
-                            dummy,
-                            onnx_path,
-                            opset_version=11,
-                            input_names=['input'],
-                            output_names=['output'],
-                            dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}}
-                        )
-                    except Exception:
-                        # If export fails, continue without ONNX
-                        pass
-
-                # If ONNX file exists, try to create a session
-                if os.path.exists(onnx_path):
-                    so = ort.SessionOptions()
-                    try:
-                        so.intra_op_num_threads = max(1, (os.cpu_count() or 1) - 1)
-                    except Exception:
-                        pass
-                    try:
-                        sess = ort.InferenceSession(onnx_path, sess_options=so, providers=['CPUExecutionProvider'])
-                        self._ort_session = sess
-                        self._use_onnx = True
-                    except Exception:
-                        self._use_onnx = False
-                else:
-                    self._use_onnx = False
-            except Exception:
-                self._use_onnx = False
         except Exception:
             # fallback to deterministic extractor
             self._use_torch = False
 
+    def _onnx_candidates(self):
+        # EMBED_MODEL overrides; else compact re-ID model, else the legacy 1280-d
+        # backbone (truncated to dim). FP32 first: INT8 ConvInteger is not faster
+        # on every CPU, set EMBED_QUANTIZED=1 once tests/eval_embedding.py shows it is.
+        if os.getenv('EMBED_MODEL'):
+            return [os.getenv('EMBED_MODEL')]
+        reid = [reid_model_path(self.dim), reid_model_path(self.dim, quantized=True)]
+        if os.getenv('EMBED_QUANTIZED', '0') == '1':
+            reid.reverse()
+        return reid + [os.path.join(CACHE_DIR, 'mobilenetv2.onnx')]
+
+    def _init_onnx(self):
+        # ONNXRuntime backend for faster CPU inference if available
+        try:
+            import onnxruntime as ort
+            candidates = self._onnx_candidates()
+            onnx_path = next((p for p in candidates if os.path.exists(p)), candidates[-1])
+            # Export the legacy backbone if nothing is present (the only time torch is needed)
+            if not os.path.exists(onnx_path) and onnx_path.endswith('mobilenetv2.onnx'):
+                try:
+                    import torch
+                    os.makedirs(CACHE_DIR, exist_ok=True)
+                    export_model = self._load_mobilenet().to('cpu')
+                    dummy = torch.randn(1, 3, 224, 224)
+                    torch.onnx.export(
+                        export_model,
+                        dummy,
+                        onnx_path,
+                        opset_version=11,
+                        input_names=['input'],
+                        output_names=['output'],
+                        dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}}
+                    )
+                except Exception:
+                    # If export fails, continue without ONNX
+                    pass
+
+            # If ONNX file exists, try to create a session
+            if os.path.exists(onnx_path):
+                so = ort.SessionOptions()
+                try:
+                    so.intra_op_num_threads = max(1, (os.cpu_count() or 1) - 1)
+                except Exception:
+                    pass
+                self._ort_session = ort.InferenceSession(onnx_path, sess_options=so, providers=['CPUExecutionProvider'])
+                self._ort_input = self._ort_session.get_inputs()[0].name
+                self.model_path = onnx_path
+                self._use_onnx = True
+        except Exception:
+            self._use_onnx = False
+
     def _normalize_box(self, box, frame_shape):
         h, w = frame_shape[:2]
         x1, y1, x2, y2 = box
@@ -215,51 +276,62 @@ class EmbeddingExtractor:
         except Exception:
             return self._deterministic_embed(frame, box, lm_list)
 
+    def _fit_dim(self, feats):
+        """(B, F) features -> (B, dim) L2-normalized. Re-ID models already output dim."""
+        feats = np.asarray(feats, dtype=np.float32).reshape(len(feats), -1)
+        if feats.shape[1] >= self.dim:
+            vec = feats[:, :self.dim]
+        else:
+            vec = np.zeros((len(feats), self.dim), dtype=np.float32)
+            vec[:, :feats.shape[1]] = feats
+            for row in vec:
+                # fill rest deterministically
+                seed = int(row.sum() * 1e6) & 0xFFFFFFFF
+                rng = np.random.RandomState(seed)
+                row[feats.shape[1]:] = rng.rand(self.dim - feats.shape[1]).astype(np.float32)
+        norm = np.linalg.norm(vec, axis=1, keepdims=True)
+        return vec / np.where(norm > 0, norm, 1.0)
+
     def _onnx_embed(self, frame, box, lm_list=None):
         try:
-            import cv2
-            x1, y1, x2, y2 = map(int, box)
-            h, w = frame.shape[:2]
-            x1 = max(0, min(x1, w-1))
-            x2 = max(0, min(x2, w-1))
-            y1 = max(0, min(y1, h-1))
-            y2 = max(0, min(y2, h-1))
-            crop = frame[y1:y2 if y2>y1 else y1+1, x1:x2 if x2>x1 else x1+1]
-            if crop.size == 0:
-                crop = cv2.resize(frame, (224,224))
-            else:
-                crop = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
-
-            img = cv2.resize(crop, (224,224)).astype(np.float32) / 255.0
-            mean = np.array([0.485, 0.456, 0.406], dtype=np.float32)
-            std = np.array([0.229, 0.224, 0.225], dtype=np.float32)
-            img = (img - mean) / std
-            img = img.transpose(2,0,1)
-            img = np.expand_dims(img, 0).astype(np.float32)
+            return self._onnx_embed_batch(frame, [box])[0]
+        except Exception:
+            return self._deterministic_embed(frame, box, lm_list)
 
-            input_name = self._ort_session.get_inputs()[0].name
-            outputs = self._ort_session.run(None, {input_name: img})
-            feats = np.array(outputs[0]).squeeze().astype(np.float32)
+    def _onnx_embed_batch(self, frame, boxes):
+        crops = [crop_box(frame, b) for b in boxes]
+        outputs = self._ort_session.run(None, {self._ort_input: preprocess(crops)})
+        return self._fit_dim(outputs[0]).tolist()
 
-            if feats.size >= self.dim:
-                vec = feats[:self.dim]
-            else:
-                vec = np.zeros(self.dim, dtype=np.float32)
-                vec[:feats.size] = feats
-                seed = int(vec.sum() * 1e6) & 0xFFFFFFFF
-                rng = np.random.RandomState(seed)
-                vec[feats.size:] = rng.rand(self.dim - feats.size).astype(np.float32)
+    def embed_crops(self, crops):
+        """Embeddings for already-cropped BGR images (one ONNX call). Returns (K, dim) float32."""
+        if len(crops) == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        self._ensure_backend()
+        if self._use_onnx and self._ort_session is not None:
+            try:
+                return self._fit_dim(self._ort_session.run(None, {self._ort_input: preprocess(crops)})[0])
+            except Exception:
+                pass
+        return np.asarray([self.embed(c, [0, 0, c.shape[1], c.shape[0]]) for c in crops], dtype=np.float32)
 
-            norm = np.linalg.norm(vec)
-            if norm > 0:
-                vec = vec / norm
-            return vec.tolist()
-        except Exception:
-            return self._deterministic_embed(frame, box, lm_list)
+    def embed_batch(self, frame, boxes, lm_lists=None):
+        """Embeddings for several boxes of one frame (one ONNX call). Returns list of lists."""
+        if len(boxes) == 0:
+            return []
+        self._ensure_backend()
+        if self._use_onnx and self._ort_session is not None:
+            try:
+                return self._onnx_embed_batch(frame, boxes)
+            except Exception:
+                pass
+        lm_lists = lm_lists or [None] * len(boxes)
+        return [self.embed(frame, b, lm) for b, lm in zip(boxes, lm_lists)]
 
     def embed(self, frame, box, lm_list=None):
+        self._ensure_backend()
         # Prefer ONNXRuntime for CPU if available, then PyTorch, then deterministic
-        if getattr(self, '_use_onnx', False) and getattr(self, '_ort_session', None) is not None:
+        if self._use_onnx and self._ort_session is not None:
             return self._onnx_embed(frame, box, lm_list)
         if self._use_torch and self._torch_model is not None:
             return self._torch_embed(frame, box, lm_list)
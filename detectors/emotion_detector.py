@@ -1,107 +1,224 @@
+import math
 import cv2
-import mediapipe as mp
 import numpy as np
 
+# COCO-17 head joints (pose keypoints)
+NOSE, L_EYE, R_EYE, L_EAR, R_EAR, L_SH, R_SH = 0, 1, 2, 3, 4, 5, 6
+
+# Índices clave de MediaPipe FaceMesh
+# Labios: Superior 13, Inferior 14, Comisura Izq 61, Comisura Der 291
+# Mejillas (ancho bi-cigomático aprox): 234, 454
+LIP_TOP, LIP_BOTTOM, MOUTH_L, MOUTH_R, CHEEK_L, CHEEK_R = 13, 14, 61, 291, 234, 454
+
+
+def _face_mesh(max_num_faces, static_image_mode, refine_landmarks=False):
+    # Lazy: mediapipe is heavy and only needed when emotions are enabled
+    import mediapipe as mp
+    return mp.solutions.face_mesh.FaceMesh(
+        static_image_mode=static_image_mode,
+        max_num_faces=max_num_faces,
+        refine_landmarks=refine_landmarks,
+        min_detection_confidence=0.5,
+        min_tracking_confidence=0.5
+    )
+
+
+def landmarks_array(face_landmarks):
+    """MediaPipe NormalizedLandmarkList -> (468, 2) float32 [x, y] (0-1 of the processed image)."""
+    lms = face_landmarks.landmark
+    return np.fromiter((v for lm in lms for v in (lm.x, lm.y)), dtype=np.float32, count=2 * len(lms)).reshape(-1, 2)
+
+
+def analyze_geometry(landmarks):
+    """
+    Analiza distancias clave entre puntos de referencia, vectorizado sobre F caras.
+    landmarks: (F, 468, 2). Returns (emotions [F], scores (F,)).
+    """
+    L = np.asarray(landmarks, dtype=np.float32)
+    if len(L) == 0:
+        return [], np.zeros(0, dtype=np.float32)
+
+    def dist(i1, i2):
+        return np.linalg.norm(L[:, i1] - L[:, i2], axis=1)
+
+    # Normalización (ancho de la cara bi-zygomatic width aprox: 234 a 454)
+    face_width = dist(CHEEK_L, CHEEK_R)
+    ok = face_width > 0
+    face_width = np.where(ok, face_width, 1.0)
+
+    mouth_open = dist(LIP_TOP, LIP_BOTTOM) / face_width # Apertura de boca
+    mouth_wide = dist(MOUTH_L, MOUTH_R) / face_width # Sonrisa (ancho de boca)
+
+    # SORPRESA: Boca muy abierta / FELIZ: boca ancha (> 0.45 suele ser sonrisa amplia)
+    surprise = ok & (mouth_open > 0.15)
+    happy = ok & ~surprise & (mouth_wide > 0.45)
+    emotions = np.where(surprise, "SORPRESA", np.where(happy, "FELIZ", "NEUTRAL"))
+    scores = np.where(surprise, 0.8, np.where(happy, 0.85, np.where(ok, 0.5, 0.0))).astype(np.float32)
+    return emotions.tolist(), scores
+
+
+def head_boxes(kpts, aspect=1.0, margin=1.8):
+    """
+    Head regions (square in pixels) from pose keypoints, vectorized over N persons.
+    kpts: (N, 17, 2|3) normalized (0 = missing), aspect: frame width / height.
+    Returns ((N, 4) normalized [x1, y1, x2, y2], valid (N,) bool). Size comes from
+    the spread of nose/eyes/ears, with half the shoulder width as a floor for
+    frontal faces where the ears are hidden.
+    """
+    # Work in frame-height units so x and y distances are comparable
+    kpts = np.asarray(kpts, dtype=np.float32).reshape(len(kpts), 17, -1)[..., :2] * (aspect, 1.0)
+    head = kpts[:, NOSE:R_EAR + 1]
+    seen = head.any(axis=2)
+    count = seen.sum(axis=1)
+    valid = seen[:, NOSE] | (count >= 2)
+
+    masked_min = np.where(seen[..., None], head, np.inf).min(axis=1)
+    masked_max = np.where(seen[..., None], head, -np.inf).max(axis=1)
+    masked_min = np.where(count[:, None] > 0, masked_min, 0.0)
+    masked_max = np.where(count[:, None] > 0, masked_max, 0.0)
+    center = np.where(seen[:, NOSE, None], head[:, NOSE], (masked_min + masked_max) / 2)
+    spread = np.where(count[:, None] >= 2, masked_max - masked_min, 0.0).max(axis=1)
+
+    shoulders = kpts[:, L_SH].any(axis=1) & kpts[:, R_SH].any(axis=1)
+    sh_width = np.where(shoulders, np.abs(kpts[:, L_SH, 0] - kpts[:, R_SH, 0]), 0.0)
+    half = np.maximum(spread, 0.5 * sh_width) * margin / 2
+    valid &= half > 0
+    boxes = np.concatenate([center - half[:, None], center + half[:, None]], axis=1) / (aspect, 1.0, aspect, 1.0)
+    return np.clip(boxes, 0.0, 1.0), valid
+
+
 class EmotionDetector:
     """
     Detector de emociones faciales ligero basado en geometría de landmarks (FaceMesh).
     Optimizado para rendimiento y privacidad (procesamiento geométrico local).
     """
     def __init__(self, refine_landmarks=False):
-        self.mp_face_mesh = mp.solutions.face_mesh
         # Configuración "china-style": alta eficiencia
-        self.face_mesh = self.mp_face_mesh.FaceMesh(
-            static_image_mode=False,
-            max_num_faces=4, # Multiobjetivo
-            refine_landmarks=refine_landmarks,
-            min_detection_confidence=0.5,
-            min_tracking_confidence=0.5
-        )
+        self.face_mesh = _face_mesh(4, False, refine_landmarks) # Multiobjetivo
         self.last_results = None
 
     def detect(self, frame_bgr):
         """
         Procesa el frame y retorna lista de emociones por rostro detectado.
-        Retorna: List[Dict] -> [{'bbox': [x,y,w,h], 'emotion': 'NEUTRAL', 'score': 0.9}, ...]
+        Retorna: List[Dict] -> [{'box': [x,y,w,h], 'emotion': 'NEUTRAL', 'conf': 0.9}, ...]
         """
-        results = []
         h, w, _ = frame_bgr.shape
         frame_rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
         self.last_results = self.face_mesh.process(frame_rgb)
-        
-        if self.last_results.multi_face_landmarks:
-            for face_landmarks in self.last_results.multi_face_landmarks:
-                # 1. Bounding Box Estimada
-                x_min, y_min = w, h
-                x_max, y_max = 0, 0
-                for lm in face_landmarks.landmark:
-                    x, y = int(lm.x * w), int(lm.y * h)
-                    if x < x_min: x_min = x
-                    if x > x_max: x_max = x
-                    if y < y_min: y_min = y
-                    if y > y_max: y_max = y
-                
-                bbox = [x_min, y_min, x_max - x_min, y_max - y_min]
-                
-                # 2. Análisis Geométrico
-                emotion, score = self._analyze_geometry(face_landmarks.landmark)
-                
-                results.append({
-                    "box": bbox,
-                    "emotion": emotion,
-                    "conf": score
-                })
-        
-        return results
-
-    def _analyze_geometry(self, landmarks):
+        if not self.last_results.multi_face_landmarks:
+            return []
+
+        faces = np.stack([landmarks_array(f) for f in self.last_results.multi_face_landmarks])
+        # 1. Bounding Box Estimada (min/max over all landmarks of every face at once)
+        lo = (faces.min(axis=1) * (w, h)).astype(int)
+        hi = (faces.max(axis=1) * (w, h)).astype(int)
+        # 2. Análisis Geométrico
+        emotions, scores = analyze_geometry(faces)
+
+        return [{
+            "box": [int(lo[i, 0]), int(lo[i, 1]), int(hi[i, 0] - lo[i, 0]), int(hi[i, 1] - lo[i, 1])],
+            "emotion": emotions[i],
+            "conf": float(scores[i])
+        } for i in range(len(faces))]
+
+
+class TrackEmotionAnalyzer:
+    """
+    Emotions for tracked persons, bounded in CPU regardless of crowd size.
+    - Head crops come from pose keypoints (no face detector over the full frame).
+    - Each track is re-analyzed at most every `interval` frames; in between its
+      cached result is reused. At most `max_faces` heads are analyzed per call
+      (stalest first), packed into ONE mosaic and sent to FaceMesh in a single
+      process() call.
+    - Results are cached per track id and written into the detections as
+      `emotion` / `emotion_conf` (what the dashboard renders).
+    """
+    def __init__(self, interval=15, max_faces=6, cell=160, ttl=90):
+        self.interval = interval
+        self.max_faces = max_faces
+        self.cell = cell # Mosaic cell size (px) per head
+        self.ttl = ttl # Frames a lost track stays cached
+        self.cache = {} # {track_id: (emotion, conf, analyzed_at)}
+        self.last_seen = {}
+        self.frame = 0
+        self._mesh = None
+
+    @property
+    def face_mesh(self):
+        if self._mesh is None:
+            # Static mode: the mosaic holds different people on every call
+            self._mesh = _face_mesh(self.max_faces, True)
+        return self._mesh
+
+    def _due(self, detections):
+        """Indices of detections to analyze now, stalest first, capped at max_faces."""
+        ages = []
+        for i, det in enumerate(detections):
+            entry = self.cache.get(det["id"])
+            age = self.frame - entry[2] if entry else math.inf
+            if age >= self.interval and det.get("keypoints_norm"):
+                ages.append((age, i))
+        ages.sort(reverse=True)
+        return [i for _, i in ages[:self.max_faces]]
+
+    def _mosaic(self, crops):
+        cols = math.ceil(math.sqrt(len(crops)))
+        rows = math.ceil(len(crops) / cols)
+        c = self.cell
+        mosaic = np.zeros((rows * c, cols * c, 3), dtype=np.uint8)
+        for k, crop in enumerate(crops):
+            if crop is None or crop.size == 0:
+                continue
+            r, col = divmod(k, cols)
+            mosaic[r * c:(r + 1) * c, col * c:(col + 1) * c] = cv2.resize(crop, (c, c), interpolation=cv2.INTER_AREA)
+        return mosaic, cols, rows
+
+    def update(self, detections, get_crops, frame_shape=None):
         """
-        Analiza distancias clave entre puntos de referencia.
+        detections: output of InferenceEngine (keypoints_norm, id), frame_shape: (h, w).
+        get_crops: callable(list of normalized [x1, y1, x2, y2]) -> list of BGR crops
+        (e.g. SharedState.get_frame_crops). Annotates detections in place.
         """
-        # Índices clave de MediaPipe FaceMesh
-        # Labios: Superior 13, Inferior 14, Comisura Izq 61, Comisura Der 291
-        # Cejas: Izq sup 105, Der sup 334
-        # Ojos: Superiores (159, 386), Inferiores (145, 374)
-        
-        def dist(i1, i2):
-            p1 = np.array([landmarks[i1].x, landmarks[i1].y])
-            p2 = np.array([landmarks[i2].x, landmarks[i2].y])
-            return np.linalg.norm(p1 - p2)
-
-        # Normalización (ancho de la cara bi-zygomatic width aprox: 234 a 454)
-        face_width = dist(234, 454)
-        if face_width == 0: return "NEUTRAL", 0.0
-        
-        # Apertura de boca
-        mouth_open = dist(13, 14) / face_width
-        
-        # Sonrisa (ancho de boca)
-        mouth_wide = dist(61, 291) / face_width
-        
-        # Comisuras vs Centro (Sonrisa levanta comisuras? En 3D sí, en 2D a veces)
-        # Usamos curvatura simple: Y de comisuras vs Y de labio inferior
-        lips_y = (landmarks[61].y + landmarks[291].y) / 2
-        center_y = landmarks[13].y
-        smile_curve = center_y - lips_y # Si positivo, comisuras más altas (quizás) -> No siempre fiable en 2D directo
-        
-        # Heurísticas Simples & Rápidas
-        emotion = "NEUTRAL"
-        score = 0.5
-        
-        # SORPRESA: Boca muy abierta
-        if mouth_open > 0.15: # Umbral ajustado
-            emotion = "SORPRESA"
-            score = 0.8
-        
-        # FELICIDAD: Boca ancha + "Sonrisa" (esto necesita calibración, usamos mouth_wide por simplicidad)
-        # Un width > 0.45 suele ser sonrisa amplia
-        elif mouth_wide > 0.45: 
-            emotion = "FELIZ"
-            score = 0.85
-            
-        # IRA: Cejas juntas y bajas (requiere medir la distancia entre cejas y ojos)
-        # Distancia entre ceja(65) y ojo(159)
-        # brow_eye = dist(65, 159) / face_width
-        # if brow_eye < 0.05: ... (Complejo de tunear sin dataset)
-        
-        return emotion, score
+        self.frame += 1
+        due = self._due(detections)
+        if due:
+            kpts = np.asarray([detections[i]["keypoints_norm"] for i in due], dtype=np.float32)
+            aspect = frame_shape[1] / frame_shape[0] if frame_shape else 1.0
+            boxes, valid = head_boxes(kpts, aspect)
+            due = [i for i, ok in zip(due, valid) if ok]
+            if due:
+                self._analyze([detections[i]["id"] for i in due], get_crops(boxes[valid].tolist()))
+
+        for det in detections:
+            self.last_seen[det["id"]] = self.frame
+            entry = self.cache.get(det["id"])
+            if entry:
+                det["emotion"], det["emotion_conf"] = entry[0], entry[1]
+
+        for t_id in [t for t, f in self.last_seen.items() if self.frame - f > self.ttl]:
+            self.last_seen.pop(t_id)
+            self.cache.pop(t_id, None)
+        return detections
+
+    def _analyze(self, track_ids, crops):
+        faces = []
+        if any(c is not None and c.size for c in crops):
+            mosaic, cols, rows = self._mosaic(crops)
+            results = self.face_mesh.process(cv2.cvtColor(mosaic, cv2.COLOR_BGR2RGB))
+            faces = results.multi_face_landmarks or []
+
+        found = {}
+        if faces:
+            L = np.stack([landmarks_array(f) for f in faces])
+            emotions, scores = analyze_geometry(L)
+            # Which cell each face belongs to (landmark centroid)
+            center = L.mean(axis=1) * (cols, rows)
+            cells = np.clip(center[:, 1].astype(int), 0, rows - 1) * cols + np.clip(center[:, 0].astype(int), 0, cols - 1)
+            for k, cell in enumerate(cells.tolist()):
+                if cell < len(track_ids) and cell not in found:
+                    found[cell] = (emotions[k], round(float(scores[k]), 2))
+
+        for k, t_id in enumerate(track_ids):
+            # No face found (back turned, occluded): NEUTRAL, retried after `interval`
+            emotion, conf = found.get(k, ("NEUTRAL", 0.0))
+            self.cache[t_id] = (emotion, conf, self.frame)
@@ -1,12 +1,132 @@
 """Export MobileNetV2 backbone to ONNX for faster CPU inference.
 Run inside the project venv or inside the container after deps are installed.
+
+    python detectors/export_onnx.py
+        Legacy 1280-d backbone (.cache/mobilenetv2.onnx).
+    python detectors/export_onnx.py --reid --dim 128 --images data/crops --quantize
+        Compact re-ID model (.cache/reid_128.onnx): backbone + projection to
+        `dim` + L2 norm in the graph. The projection is PCA fitted on the
+        backbone features of a local set of person crops (or, without --images,
+        a fixed random orthogonal projection, which still preserves cosine
+        similarities far better than truncating to the first dims).
+        --quantize adds an INT8 dynamic-quantized copy (.cache/reid_128.int8.onnx)
+        used by EmbeddingExtractor with EMBED_QUANTIZED=1. Check latency/accuracy
+        on your CPU first with tests/eval_embedding.py.
 """
 import os
+import sys
+import json
+import inspect
+import argparse
+import numpy as np
 import torch
-import torchvision
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from detectors.embedding import EmbeddingExtractor, CACHE_DIR, reid_model_path, preprocess
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def find_images(root):
+    out = []
+    for dirpath, _, files in os.walk(root):
+        out.extend(os.path.join(dirpath, f) for f in sorted(files) if f.lower().endswith(IMAGE_EXTS))
+    return sorted(out)
+
+
+def export(model, path, opset=13):
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # TorchScript exporter: plain static graph that onnxruntime's quantizer handles
+        kwargs['dynamo'] = False
+    torch.onnx.export(
+        model,
+        torch.randn(1, 3, 224, 224),
+        path,
+        opset_version=opset,
+        input_names=['input'],
+        output_names=['output'],
+        dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}},
+        **kwargs
+    )
+
+
+class ReIDHead(torch.nn.Module):
+    """Backbone -> linear projection (PCA) -> L2 normalized `dim` embedding."""
+    def __init__(self, backbone, mean, components):
+        super().__init__()
+        self.backbone = backbone
+        self.proj = torch.nn.Linear(components.shape[1], components.shape[0])
+        with torch.no_grad():
+            w = torch.from_numpy(components.astype(np.float32))
+            self.proj.weight.copy_(w)
+            self.proj.bias.copy_(-(w @ torch.from_numpy(mean.astype(np.float32))))
+
+    def forward(self, x):
+        return torch.nn.functional.normalize(self.proj(self.backbone(x)), dim=1)
+
+
+def backbone_features(model, paths, batch=32):
+    import cv2
+    feats = []
+    with torch.inference_mode():
+        for i in range(0, len(paths), batch):
+            crops = [img for img in (cv2.imread(p) for p in paths[i:i + batch]) if img is not None]
+            if crops:
+                feats.append(model(torch.from_numpy(preprocess(crops))).numpy())
+    return np.concatenate(feats) if feats else np.zeros((0, 1280), dtype=np.float32)
+
+
+def fit_projection(features, dim, seed=0):
+    """PCA (top `dim` principal axes) if there are enough samples, else random orthogonal."""
+    n_feats = 1280 if len(features) == 0 else features.shape[1]
+    if len(features) > dim:
+        mean = features.mean(axis=0)
+        _, sv, vt = np.linalg.svd(features - mean, full_matrices=False)
+        explained = float((sv[:dim] ** 2).sum() / (sv ** 2).sum())
+        return mean, vt[:dim], "pca", explained
+    q, _ = np.linalg.qr(np.random.default_rng(seed).standard_normal((n_feats, dim)))
+    return np.zeros(n_feats), q.T, "random", None
+
+
+def export_reid(args):
+    backbone = EmbeddingExtractor._load_mobilenet().to('cpu')
+    paths = find_images(args.images) if args.images else []
+    feats = backbone_features(backbone, paths)
+    mean, components, method, explained = fit_projection(feats, args.dim)
+    print(f'Projection 1280 -> {args.dim}: {method} on {len(feats)} images'
+          + (f' ({explained:.1%} variance kept)' if explained is not None else ''))
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    out = reid_model_path(args.dim)
+    model = ReIDHead(backbone, mean, components).eval()
+    export(model, out)
+    with open(os.path.splitext(out)[0] + '.json', 'w') as f:
+        json.dump({'dim': args.dim, 'projection': method, 'images': len(feats),
+                   'explained_variance': explained, 'backbone': 'mobilenet_v2'}, f)
+    print('Export complete', out)
+
+    if args.quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        q_out = reid_model_path(args.dim, quantized=True)
+        # Dynamic: weights INT8 offline, activations quantized per batch at runtime
+        quantize_dynamic(out, q_out, weight_type=QuantType.QUInt8)
+        print(f'INT8 model {q_out} ({os.path.getsize(q_out) / 1e6:.1f} MB vs {os.path.getsize(out) / 1e6:.1f} MB)')
+
 
 def main():
-    cache_dir = os.path.join(os.path.dirname(__file__), '..', '.cache')
+    parser = argparse.ArgumentParser(description="Export embedding backbones to ONNX")
+    parser.add_argument('--reid', action='store_true', help='Compact projected re-ID model instead of the legacy backbone')
+    parser.add_argument('--dim', type=int, default=int(os.getenv('EMBED_DIM', 128)))
+    parser.add_argument('--images', help='Folder of person crops to fit the PCA projection')
+    parser.add_argument('--quantize', action='store_true', help='Also write an INT8 dynamic-quantized model')
+    args = parser.parse_args()
+
+    if args.reid:
+        export_reid(args)
+        return
+
+    cache_dir = CACHE_DIR
     os.makedirs(cache_dir, exist_ok=True)
     onnx_path = os.path.join(cache_dir, 'mobilenetv2.onnx')
     if os.path.exists(onnx_path):
@@ -14,20 +134,9 @@ def main():
         return
 
     print('Exporting MobileNetV2 to', onnx_path)
-    model = torchvision.models.mobilenet_v2(pretrained=True)
-    model.classifier = torch.nn.Identity()
-    model.eval()
-    dummy = torch.randn(1, 3, 224, 224)
+    model = EmbeddingExtractor._load_mobilenet()
     try:
-        torch.onnx.export(
-            model,
-            dummy,
-            onnx_path,
-            opset_version=11,
-            input_names=['input'],
-            output_names=['output'],
-            dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}}
-        )
+        export(model, onnx_path, opset=11)
         print('Export complete')
     except Exception as e:
         print('Export failed:', e)
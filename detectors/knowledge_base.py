@@ -49,6 +49,20 @@ BEHAVIOR_DB = {
             "torso_horizontal": True
         }
     },
+    "CAIDA": {
+        "description": "Caída al suelo (modelo temporal de esqueleto)",
+        "policy": "WARNING",
+        "severity": "CRITICAL",
+        "source": "temporal", # Aprendido, sin reglas geométricas
+        "features": {}
+    },
+    "PELEA": {
+        "description": "Intercambio de golpes entre personas (modelo temporal)",
+        "policy": "PROHIBITED",
+        "severity": "CRITICAL",
+        "source": "temporal",
+        "features": {}
+    },
     "CAMINANDO": {
         "description": "Desplazamiento activo",
         "policy": "ALLOWED",
@@ -1,30 +1,39 @@
 import cv2
-from ultralytics import YOLO
 import numpy as np
 import logging
+from core.model_registry import ModelRegistry
 
 class PoseEstimator:
-    def __init__(self, model_path="yolo11n-pose.pt", device=None):
+    def __init__(self, model_path="yolo11n-pose.pt", device=None, scope="shared"):
         """
         Initialize YOLOv11 Pose Estimator.
         Replaces MediaPipe to ensure compatibility with Python 3.13 and robust detections.
+        Weights come from the process-wide ModelRegistry. Pass a private `scope`
+        (e.g. "track:cam1") when using find_pose(track=True): tracker state lives
+        on the model instance.
         """
         self.pose_model = None
+        self.handle = None
         self.results = None
         
         try:
-            # Initialize with verbose=False to keep logs clean
-            self.pose_model = YOLO(model_path)
-            if device:
-                self.pose_model.to(device)
+            self.handle = ModelRegistry().acquire(model_path, device, scope=scope)
+            self.pose_model = self.handle.model
             logging.getLogger("panoptes.pose").info("YOLOv11-Pose Online")
         except Exception as e:
             print(f"CRITICAL_ERROR: Failed to load YOLO Pose model: {e}")
             self.pose_model = None
 
-    def find_pose(self, frame, draw=True):
+    def close(self):
+        if self.handle is not None:
+            self.handle.release()
+            self.handle = None
+            self.pose_model = None
+
+    def find_pose(self, frame, draw=True, track=False):
         """
         Process the frame to find pose landmarks using YOLO.
+        track=True runs ByteTrack so get_poses() also returns persistent IDs.
         Returns the annotated frame.
         """
         if not self.pose_model:
@@ -32,7 +41,11 @@ class PoseEstimator:
 
         # YOLO inference
         # Classes filter not strictly needed for pose model usually, but good practice
-        self.results = self.pose_model(frame, verbose=False)
+        with self.handle.lock:
+            if track:
+                self.results = self.pose_model.track(frame, persist=True, verbose=False, tracker="bytetrack.yaml")
+            else:
+                self.results = self.pose_model(frame, verbose=False)
         
         if draw and self.results:
             # Use Ultralytics' built-in plotter which handles skeletons beautifully
@@ -40,62 +53,81 @@ class PoseEstimator:
             
         return frame
 
+    def get_poses(self, frame=None, draw=False, track=False):
+        """
+        All persons of the frame at once.
+        Returns (keypoints (N, 17, 3) float32 [x, y, conf] in pixels,
+                 track_ids (N,) int64 or None when not tracking).
+        Keypoints come from ONE device->host transfer of `keypoints.data`.
+        """
+        if frame is not None:
+            self.find_pose(frame, draw=draw, track=track)
+
+        empty = np.zeros((0, 17, 3), dtype=np.float32)
+        if not self.results:
+            return empty, None
+        res = self.results[0]
+        if res.keypoints is None or res.keypoints.data.shape[0] == 0:
+            return empty, None
+
+        data = res.keypoints.data.cpu().numpy().astype(np.float32, copy=False)
+        if data.shape[-1] == 2:
+            # Confidences might be missing depending on model export
+            data = np.concatenate([data, np.ones(data.shape[:2] + (1,), dtype=np.float32)], axis=-1)
+
+        ids = None
+        if res.boxes is not None and res.boxes.id is not None:
+            ids = res.boxes.id.cpu().numpy().astype(np.int64)
+        return data, ids
+
     def get_position(self, frame, draw=True):
         """
         Extract landmark list from the processed results.
         Returns a list of [id, x, y, conf] for the primary detected person.
-        Standardizes output for ActionClassifier.
+        Standardizes output for ActionClassifier (see get_poses for all persons).
         """
         if not self.results:
             self.find_pose(frame, draw=draw)
 
-        lm_list = []
-        
-        # Check if we have results and keypoints
-        if self.results and len(self.results) > 0:
-            res = self.results[0]
-            if res.keypoints is not None and res.keypoints.xy.shape[1] > 0:
-                # We take the first person detected (index 0) to maintain single-subject logic for now
-                # In the future, we can loop over all persons.
-                # Shape is (NumPersons, NumKoins, 2)
-                if res.keypoints.xy.shape[0] > 0:
-                    person_kpts = res.keypoints.xy[0].cpu().numpy()
-                    
-                    # Confidences might be None depending on model export, handling that
-                    if res.keypoints.conf is not None:
-                        confs = res.keypoints.conf[0].cpu().numpy()
-                    else:
-                        confs = np.ones(len(person_kpts))
-
-                    for i in range(len(person_kpts)):
-                        x, y = person_kpts[i]
-                        c = confs[i]
-                        # Structure: [id, x, y, confidence]
-                        lm_list.append([i, x, y, c])
+        kpts, _ = self.get_poses()
+        if len(kpts) == 0:
+            return []
+        # Structure: [id, x, y, confidence]
+        return [[i, x, y, c] for i, (x, y, c) in enumerate(kpts[0].tolist())]
 
-        return lm_list
-
-    def get_gait_features(self, lm_list):
+    @staticmethod
+    def gait_features(kpts, min_conf=0.0):
         """
-        Compute basic gait features for COCO Keypoints.
+        Gait features for N persons at once. kpts: (N, 17, 2|3) COCO keypoints.
         COCO Indices:
         L_Ankle: 15, R_Ankle: 16
         L_Wrist: 9, R_Wrist: 10
+        Returns dict of (N,) arrays; NaN where a joint is missing / below min_conf.
+        """
+        kpts = np.asarray(kpts, dtype=np.float32)
+        xy = kpts[..., :2]
+        ok = xy.any(axis=-1)
+        if kpts.shape[-1] > 2:
+            ok &= kpts[..., 2] >= min_conf
+
+        def span(a, b):
+            d = np.linalg.norm(xy[:, a] - xy[:, b], axis=-1)
+            return np.where(ok[:, a] & ok[:, b], d, np.nan)
+
+        return {
+            "stride_length": span(15, 16), # Euclidean distance for stride
+            "arm_spread": span(9, 10) # Arm swing
+        }
+
+    def get_gait_features(self, lm_list):
+        """
+        Compute basic gait features for one [id, x, y, conf] list (legacy API).
         """
         features = {}
         if len(lm_list) >= 17:
-            # Euclidean distance for stride
-            left_ankle = np.array([lm_list[15][1], lm_list[15][2]])
-            right_ankle = np.array([lm_list[16][1], lm_list[16][2]])
-            stride_dist = np.linalg.norm(left_ankle - right_ankle)
-            
-            features['stride_length'] = stride_dist
-            
-            # Arm swing
-            left_wrist = np.array([lm_list[9][1], lm_list[9][2]])
-            right_wrist = np.array([lm_list[10][1], lm_list[10][2]])
-            arm_spread = np.linalg.norm(left_wrist - right_wrist)
-            
-            features['arm_spread'] = arm_spread
+            xy = np.asarray([row[1:3] for row in lm_list[:17]], dtype=np.float32)
+            # Legacy behavior: no missing-joint masking (see gait_features)
+            features['stride_length'] = float(np.linalg.norm(xy[15] - xy[16]))
+            features['arm_spread'] = float(np.linalg.norm(xy[9] - xy[10]))
             
         return features
@@ -1,107 +1,244 @@
 import numpy as np
-from collections import deque
 import time
 
+class KinematicsEngine:
+    """
+    Multi-track kinematics over ring-buffer arrays.
+    Every track owns a row of fixed-size ring buffers (t, x, y, speed) plus
+    running statistics over two sliding TIME windows:
+    - speed window: running sum of speeds -> average speed -> "Running"
+    - loiter window: Welford mean/M2 of positions (add + remove) -> spatial spread -> "Loitering"
+    Samples are evicted when they fall out of their window, so each update is
+    O(1) amortized per track and all tracks of a frame are updated in one
+    vectorized call. Only the timestamps passed in are used (replay-safe).
+    """
+    def __init__(self, capacity=64, max_samples=512, speed_window=1.0,
+                 run_speed=200.0, loiter_radius=50.0, loiter_time=5.0, min_loiter_samples=10):
+        self.max_samples = max_samples
+        self.speed_window = speed_window
+        self.run_speed = run_speed # px/sec at the caller's scale (640px reference width by default)
+        self.loiter_radius = loiter_radius
+        self.loiter_time = loiter_time
+        self.min_loiter_samples = min_loiter_samples
+
+        self.slots = {} # {track_id: row}
+        self.free = []
+        self._alloc(capacity)
+
+    def _alloc(self, capacity):
+        S = self.max_samples
+        old = getattr(self, "capacity", 0)
+        def grow(name, shape, dtype, fill=0):
+            arr = np.full(shape, fill, dtype=dtype)
+            if old:
+                arr[:old] = getattr(self, name)
+            setattr(self, name, arr)
+
+        # Ring buffers (capacity, S)
+        grow("t", (capacity, S), np.float64)
+        grow("x", (capacity, S), np.float64)
+        grow("y", (capacity, S), np.float64)
+        grow("spd", (capacity, S), np.float64)
+        # Sequence counters: head = samples written, tails = oldest sample inside each window
+        grow("head", capacity, np.int64)
+        grow("tail_spd", capacity, np.int64)
+        grow("tail_pos", capacity, np.int64)
+        # Running statistics
+        grow("spd_sum", capacity, np.float64)
+        grow("pos_n", capacity, np.int64)
+        grow("mean_x", capacity, np.float64)
+        grow("mean_y", capacity, np.float64)
+        grow("m2_x", capacity, np.float64)
+        grow("m2_y", capacity, np.float64)
+        grow("first_seen", capacity, np.float64)
+        grow("last_seen", capacity, np.float64)
+
+        self.free.extend(range(capacity - 1, old - 1, -1))
+        self.capacity = capacity
+
+    def _rows(self, track_ids, timestamp):
+        rows = np.empty(len(track_ids), dtype=np.int64)
+        for i, t_id in enumerate(track_ids):
+            row = self.slots.get(t_id)
+            if row is None:
+                if not self.free:
+                    self._alloc(self.capacity * 2)
+                row = self.slots[t_id] = self.free.pop()
+                self._reset(row, timestamp)
+            rows[i] = row
+        return rows
+
+    def _reset(self, row, timestamp):
+        for name in ("head", "tail_spd", "tail_pos", "pos_n"):
+            getattr(self, name)[row] = 0
+        for name in ("spd_sum", "mean_x", "mean_y", "m2_x", "m2_y"):
+            getattr(self, name)[row] = 0.0
+        self.first_seen[row] = timestamp
+        self.last_seen[row] = timestamp
+
+    # --- Window maintenance (vectorized over rows) ---
+
+    def _evict_speed(self, rows):
+        if len(rows) == 0: return
+        idx = self.tail_spd[rows] % self.max_samples
+        self.spd_sum[rows] -= self.spd[rows, idx]
+        self.tail_spd[rows] += 1
+
+    def _evict_pos(self, rows):
+        if len(rows) == 0: return
+        idx = self.tail_pos[rows] % self.max_samples
+        x, y = self.x[rows, idx], self.y[rows, idx]
+        n = self.pos_n[rows]
+        last = n <= 1
+        safe = np.maximum(n - 1, 1)
+        # Welford removal: mean_old = (n*mean - x) / (n-1); M2 -= (x - mean_old) * (x - mean)
+        for v, mean, m2 in ((x, self.mean_x, self.m2_x), (y, self.mean_y, self.m2_y)):
+            cur = mean[rows]
+            prev = (n * cur - v) / safe
+            m2[rows] = np.where(last, 0.0, np.maximum(m2[rows] - (v - prev) * (v - cur), 0.0))
+            mean[rows] = np.where(last, 0.0, prev)
+        self.pos_n[rows] = n - 1
+        self.tail_pos[rows] += 1
+
+    def _add_pos(self, rows, x, y):
+        n = self.pos_n[rows] + 1
+        for v, mean, m2 in ((x, self.mean_x, self.m2_x), (y, self.mean_y, self.m2_y)):
+            d = v - mean[rows]
+            mean[rows] += d / n
+            m2[rows] += d * (v - mean[rows])
+        self.pos_n[rows] = n
+
+    def _expire(self, rows, timestamp):
+        S = self.max_samples
+        # Loop count = max evictions any single track needs this frame (usually 0-1)
+        while True:
+            r = rows[(self.tail_spd[rows] < self.head[rows]) &
+                     (self.t[rows, self.tail_spd[rows] % S] < timestamp - self.speed_window)]
+            if len(r) == 0: break
+            self._evict_speed(r)
+        while True:
+            r = rows[(self.tail_pos[rows] < self.head[rows]) &
+                     (self.t[rows, self.tail_pos[rows] % S] < timestamp - self.loiter_time)]
+            if len(r) == 0: break
+            self._evict_pos(r)
+
+    # --- Public API ---
+
+    def update(self, track_ids, centers, timestamp=None):
+        """
+        track_ids: sequence of N ids, centers: (N, 2) positions, timestamp: frame time.
+        Returns dict of (N,) arrays: speed, vx, vy, avg_speed, spread, is_running, is_loitering.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        S = self.max_samples
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        rows = self._rows(track_ids, timestamp)
+        cx, cy = centers[:, 0], centers[:, 1]
+
+        # 1. Velocity vs previous sample
+        has_prev = self.head[rows] > 0
+        prev = (self.head[rows] - 1) % S
+        dt = timestamp - self.t[rows, prev]
+        valid = has_prev & (dt > 0)
+        safe_dt = np.where(valid, dt, 1.0)
+        vx = np.where(valid, (cx - self.x[rows, prev]) / safe_dt, 0.0)
+        vy = np.where(valid, (cy - self.y[rows, prev]) / safe_dt, 0.0)
+        speed = np.sqrt(vx ** 2 + vy ** 2)
+
+        # 2. Ring full -> the slot we overwrite must leave both windows first
+        self._evict_speed(rows[self.head[rows] - self.tail_spd[rows] >= S])
+        self._evict_pos(rows[self.head[rows] - self.tail_pos[rows] >= S])
+
+        # 3. Write sample + incremental stats
+        slot = self.head[rows] % S
+        self.t[rows, slot] = timestamp
+        self.x[rows, slot] = cx
+        self.y[rows, slot] = cy
+        self.spd[rows, slot] = speed
+        self.spd_sum[rows] += speed
+        self._add_pos(rows, cx, cy)
+        self.head[rows] += 1
+        self.last_seen[rows] = timestamp
+
+        # 4. Slide time windows
+        self._expire(rows, timestamp)
+
+        # 5. Patterns
+        n_spd = np.maximum(self.head[rows] - self.tail_spd[rows], 1)
+        avg_speed = self.spd_sum[rows] / n_spd
+        n_pos = np.maximum(self.pos_n[rows], 1)
+        spread = np.sqrt((self.m2_x[rows] + self.m2_y[rows]) / n_pos) # Std dev magnitude roughly
+        is_loitering = ((timestamp - self.first_seen[rows] > self.loiter_time) &
+                        (self.pos_n[rows] > self.min_loiter_samples) &
+                        (spread < self.loiter_radius))
+
+        return {
+            "speed": speed,
+            "vx": vx,
+            "vy": vy,
+            "avg_speed": avg_speed,
+            "spread": spread,
+            "is_running": avg_speed > self.run_speed,
+            "is_loitering": is_loitering
+        }
+
+    def remove(self, track_id):
+        row = self.slots.pop(track_id, None)
+        if row is not None:
+            self.free.append(row)
+
+    def prune(self, timestamp, max_age=10.0):
+        """Frees tracks not updated for `max_age` seconds."""
+        for t_id, row in list(self.slots.items()):
+            if timestamp - self.last_seen[row] > max_age:
+                self.remove(t_id)
+
+
 class PredictiveBrain:
     """
     Advanced State Tracker for a single unique ID.
     Handles:
     - Velocity Calculation (Speed + Direction)
-    - Trajectory Smoothing
-    - Intent Prediction (e.g. "Running", "Loitering", "Aggressive Approach")
-    - Anomaly Detection (Sudden stops, rapid acceleration)
+    - Intent Prediction (e.g. "Running", "Loitering")
+    Thin single-track view over KinematicsEngine (kept for the legacy detectors API).
     """
-    def __init__(self, track_id, max_history=30):
+    def __init__(self, track_id, max_history=30, engine=None):
         self.id = track_id
         self.max_history = max_history
-        
-        # History buffers (Time, X_center, Y_center)
-        self.history = deque(maxlen=max_history) 
-        self.velocities = deque(maxlen=max_history)
-        
+        self.engine = engine or KinematicsEngine(capacity=1)
+
         # State
         self.is_running = False
         self.is_loitering = False
-        self.first_seen = time.time()
-        self.last_seen = time.time()
-        
+        self.first_seen = None
+        self.last_seen = None
+
         # Config
         self.run_threshold = 15.0 # Pixels per frame (approx, depends on scale)
-        self.loiter_radius = 50.0 # Pixels
-        self.loiter_time_threshold = 5.0 # Seconds
-        
+        self.loiter_radius = self.engine.loiter_radius # Pixels
+        self.loiter_time_threshold = self.engine.loiter_time # Seconds
+
     def update(self, box, timestamp=None):
         """
         Update state with new bounding box [x1, y1, x2, y2].
         """
         if timestamp is None:
             timestamp = time.time()
-            
+        if self.first_seen is None:
+            self.first_seen = timestamp
         self.last_seen = timestamp
-            
-        # 1. Calculate Center
+
         cx = (box[0] + box[2]) / 2
         cy = (box[1] + box[3]) / 2
-        
-        # 2. Calculate Velocity
-        vx, vy = 0, 0
-        speed = 0
-        
-        if len(self.history) > 0:
-            last_t, last_x, last_y = self.history[-1]
-            dt = timestamp - last_t
-            
-            if dt > 0:
-                # Pixels per second would be better, but per frame is stable for now if FPS is constant.
-                # Let's use raw difference for simplicity in short bursts, or dt normalized.
-                # To be robust against FPS jitter, we use dt.
-                vx = (cx - last_x) / dt
-                vy = (cy - last_y) / dt
-                speed = np.sqrt(vx**2 + vy**2)
-        
-        self.history.append((timestamp, cx, cy))
-        self.velocities.append(speed)
-        
-        # 3. Analyze Patterns
-        self._analyze_intent(speed)
-        
+        out = self.engine.update([self.id], [[cx, cy]], timestamp)
+
+        self.is_running = bool(out["is_running"][0])
+        self.is_loitering = bool(out["is_loitering"][0])
         return {
-            "speed": speed,
-            "vx": vx,
-            "vy": vy,
+            "speed": float(out["speed"][0]),
+            "vx": float(out["vx"][0]),
+            "vy": float(out["vy"][0]),
             "is_running": self.is_running,
             "is_loitering": self.is_loitering
         }
-        
-    def _analyze_intent(self, current_speed):
-        # --- RUNNING DETECTION ---
-        # Simple threshold on current speed or smoothed speed
-        # Normalize speed: 640 width -> speed 100 is fast.
-        # If input is 640x360.
-        
-        avg_speed = np.mean(self.velocities) if self.velocities else 0
-        
-        # Heuristic: Running if speed > threshold
-        # We need to calibrate this. Let's assume 300px/sec is "fast" in 640px width.
-        # Adjusted for 640px width: 150px/sec is brisk walk, 300+ is run.
-        if avg_speed > 200: 
-            self.is_running = True
-        else:
-            self.is_running = False
-            
-        # --- LOITERING DETECTION ---
-        # Check variance of position over last N seconds
-        if time.time() - self.first_seen > self.loiter_time_threshold:
-            # Get points in last X seconds
-            recent_points = [p for p in self.history if p[0] > (time.time() - self.loiter_time_threshold)]
-            if len(recent_points) > 10:
-                xs = [p[1] for p in recent_points]
-                ys = [p[2] for p in recent_points]
-                
-                # Check spatial spread
-                spread = np.sqrt(np.var(xs) + np.var(ys)) # Std dev magnitude roughly
-                
-                if spread < self.loiter_radius: # Stayed within small area
-                    self.is_loitering = True
-                else:
-                    self.is_loitering = False
@@ -0,0 +1,179 @@
+import logging
+import numpy as np
+from detectors.knowledge_base import BEHAVIOR_DB, get_policy
+
+# COCO-17 indices
+NOSE, L_EYE, R_EYE, L_EAR, R_EAR = 0, 1, 2, 3, 4
+L_SH, R_SH, L_EL, R_EL, L_WR, R_WR = 5, 6, 7, 8, 9, 10
+L_HIP, R_HIP, L_KN, R_KN, L_AN, R_AN = 11, 12, 13, 14, 15, 16
+
+SEVERITY_RANK = {"INFO": 0, "LOW": 1, "MEDIUM": 2, "HIGH": 3, "CRITICAL": 4}
+
+# Movement thresholds in px/sec at the 640px reference width (see KinematicsEngine)
+WALK_SPEED = 50.0
+STILL_SPEED = 20.0
+
+
+def to_array(lm_list):
+    """Legacy [[id, x, y, conf], ...] (PoseEstimator) -> (17, 3) [x, y, conf]."""
+    out = np.zeros((17, 3), dtype=np.float32)
+    for item in lm_list:
+        i = int(item[0])
+        if 0 <= i < 17:
+            out[i] = (item[1], item[2], item[3] if len(item) > 3 else 1.0)
+    return out
+
+
+class SkeletonGeometry:
+    """
+    Shared per-frame geometry for N skeletons, computed lazily and once.
+    kpts: (N, 17, 2|3) in any consistent unit with Y growing downwards
+    (normalized 0-1 or pixels - every feature is torso-relative).
+    """
+    def __init__(self, kpts, conf=None, dynamics=None, min_conf=0.3):
+        kpts = np.asarray(kpts, dtype=np.float32)
+        self.xy = kpts[..., :2]
+        if conf is None:
+            conf = kpts[..., 2] if kpts.shape[-1] > 2 else np.ones(kpts.shape[:2], dtype=np.float32)
+        self.ok = (np.asarray(conf) >= min_conf) & self.xy.any(axis=2)
+        self.n = len(self.xy)
+        self.dynamics = dynamics or {}
+        self._cache = {}
+
+    def p(self, i):
+        return self.xy[:, i]
+
+    def has(self, *idx):
+        return np.all(self.ok[:, list(idx)], axis=1)
+
+    def _cached(self, key, fn):
+        if key not in self._cache:
+            self._cache[key] = fn()
+        return self._cache[key]
+
+    @property
+    def shoulder_mid(self):
+        return self._cached("sh_mid", lambda: (self.p(L_SH) + self.p(R_SH)) / 2)
+
+    @property
+    def hip_mid(self):
+        return self._cached("hip_mid", lambda: (self.p(L_HIP) + self.p(R_HIP)) / 2)
+
+    @property
+    def torso(self):
+        def fn():
+            t = np.linalg.norm(self.shoulder_mid - self.hip_mid, axis=1)
+            # No hips: approximate torso from shoulder width (old core heuristic)
+            alt = np.linalg.norm(self.p(L_SH) - self.p(R_SH), axis=1) * 2
+            t = np.where(self.has(L_SH, R_SH, L_HIP, R_HIP), t, alt)
+            return np.where(t > 1e-6, t, 1.0)
+        return self._cached("torso", fn)
+
+    def dist(self, a, b):
+        return np.linalg.norm(self.p(a) - self.p(b), axis=1) / self.torso
+
+    def verticality(self, top, bottom):
+        v = top - bottom
+        return np.abs(v[:, 1]) / (np.linalg.norm(v, axis=1) + 1e-6)
+
+    def angle_cos(self, a, b, c):
+        """cos of the angle at joint b (a-b-c). ~-1 = straight limb."""
+        u, v = self.p(a) - self.p(b), self.p(c) - self.p(b)
+        return np.sum(u * v, axis=1) / (np.linalg.norm(u, axis=1) * np.linalg.norm(v, axis=1) + 1e-6)
+
+    def speed(self):
+        return np.asarray(self.dynamics.get("speed", np.zeros(self.n)), dtype=np.float32)
+
+
+# --- Feature vocabulary used in BEHAVIOR_DB[...]["features"] ---
+# Each function maps SkeletonGeometry -> (N,) array (bool, or categorical for valued features).
+FEATURES = {
+    "hands_up": lambda g: g.has(L_WR, R_WR, L_SH, R_SH) & (g.p(L_WR)[:, 1] < g.p(L_SH)[:, 1]) & (g.p(R_WR)[:, 1] < g.p(R_SH)[:, 1]),
+    "hands_above_head": lambda g: g.has(L_WR, R_WR, NOSE) & (g.p(L_WR)[:, 1] < g.p(NOSE)[:, 1]) & (g.p(R_WR)[:, 1] < g.p(NOSE)[:, 1]),
+    "elbows_out": lambda g: g.has(L_EL, R_EL, L_SH, R_SH) & (np.abs(g.p(L_EL)[:, 0] - g.p(R_EL)[:, 0]) > 1.1 * np.abs(g.p(L_SH)[:, 0] - g.p(R_SH)[:, 0])),
+    "guard_width": lambda g: np.where(g.has(L_WR, R_WR, NOSE) & (np.maximum(g.dist(L_WR, NOSE), g.dist(R_WR, NOSE)) < 0.6), "narrow", "wide"),
+    "arms_straight": lambda g: g.has(L_SH, L_EL, L_WR, R_SH, R_EL, R_WR) & (g.angle_cos(L_SH, L_EL, L_WR) < -0.85) & (g.angle_cos(R_SH, R_EL, R_WR) < -0.85),
+    "hands_near_nose": lambda g: (g.has(L_WR, NOSE) & (g.dist(L_WR, NOSE) < 0.15)) | (g.has(R_WR, NOSE) & (g.dist(R_WR, NOSE) < 0.15)),
+    "hand_near_ear": lambda g: (g.has(L_WR, L_EAR) & (g.dist(L_WR, L_EAR) < 0.25)) | (g.has(R_WR, R_EAR) & (g.dist(R_WR, R_EAR) < 0.25)),
+    "head_tilted": lambda g: g.has(L_EYE, R_EYE) & (g.verticality(g.p(L_EYE), g.p(R_EYE)) > 0.35),
+    "head_low": lambda g: g.has(NOSE, L_SH, R_SH) & (g.p(NOSE)[:, 1] > g.shoulder_mid[:, 1]),
+    "torso_horizontal": lambda g: g.has(L_SH, R_SH, L_HIP, R_HIP) & (g.verticality(g.shoulder_mid, g.hip_mid) < 0.5),
+    "pose_vertical": lambda g: g.has(L_SH, R_SH, L_HIP, R_HIP) & (g.verticality(g.shoulder_mid, g.hip_mid) > 0.8),
+    "legs_bent": lambda g: g.has(L_HIP, R_HIP, L_KN, R_KN) & ((g.verticality(g.p(L_HIP), g.p(L_KN)) + g.verticality(g.p(R_HIP), g.p(R_KN))) / 2 < 0.6),
+    "legs_straight": lambda g: g.has(L_HIP, L_KN, L_AN, R_HIP, R_KN, R_AN) & (g.angle_cos(L_HIP, L_KN, L_AN) < -0.94) & (g.angle_cos(R_HIP, R_KN, R_AN) < -0.94),
+    "height_reduced": lambda g: g.has(NOSE, L_AN, R_AN) & ((np.maximum(g.p(L_AN)[:, 1], g.p(R_AN)[:, 1]) - g.p(NOSE)[:, 1]) / g.torso < 2.2),
+    "legs_moving": lambda g: g.speed() > WALK_SPEED,
+    "motion_low": lambda g: g.speed() < STILL_SPEED,
+}
+
+
+class RuleEngine:
+    """
+    Compiles BEHAVIOR_DB into a boolean rule matrix R (actions x predicates).
+    Per frame, every predicate is computed ONCE for all tracks as an (N,) array
+    (F: N x predicates) and all rules are evaluated together:
+        match[n, a] = no required predicate of action a is False for track n
+    Among matches the most severe action wins (ties: the more specific rule).
+    Adding behaviors to the DB only adds rows to R - no extra per-frame Python.
+    """
+    def __init__(self, db=None, default="NEUTRAL"):
+        self.db = BEHAVIOR_DB if db is None else db
+        self.default = default
+        self._compile()
+
+    def _compile(self):
+        actions = [a for a, spec in self.db.items() if spec.get("features")]
+        preds = sorted({(f, v) for a in actions for f, v in self.db[a]["features"].items()}, key=repr)
+        for f, _ in preds:
+            if f not in FEATURES:
+                logging.getLogger("panoptes.rules").warning(f"Unknown feature '{f}' in BEHAVIOR_DB: rule never fires")
+
+        self.actions = actions
+        self.predicates = preds
+        R = np.zeros((len(actions), len(preds)), dtype=np.int32)
+        for a, name in enumerate(actions):
+            for f, v in self.db[name]["features"].items():
+                R[a, preds.index((f, v))] = 1
+        self.R = R
+        rank = np.array([SEVERITY_RANK.get(self.db[a].get("severity"), 0) for a in actions])
+        # Priority: severity first, then number of required features
+        self.priority = rank * 100 + R.sum(axis=1) + 1
+
+    def features(self, geometry):
+        """(N, P) bool predicate matrix."""
+        g = geometry
+        F = np.zeros((g.n, len(self.predicates)), dtype=bool)
+        values = {}
+        for k, (f, v) in enumerate(self.predicates):
+            if f not in FEATURES:
+                continue
+            if f not in values:
+                values[f] = FEATURES[f](g)
+            F[:, k] = values[f] == v
+        return F
+
+    def evaluate(self, kpts, conf=None, dynamics=None):
+        """
+        kpts: (N, 17, 2|3), conf: (N, 17) or None, dynamics: {"speed": (N,)...}.
+        Returns (actions [N], policies [N], severities [N]).
+        """
+        n = len(kpts)
+        if n == 0 or len(self.actions) == 0:
+            return [self.default] * n, [get_policy(self.default)] * n, ["INFO"] * n
+        F = self.features(SkeletonGeometry(kpts, conf, dynamics))
+        # Count of violated requirements per (track, action); 0 = rule matches
+        violated = (~F).astype(np.int32) @ self.R.T
+        score = np.where(violated == 0, self.priority[None, :], 0)
+        best = score.argmax(axis=1)
+        hit = score[np.arange(n), best] > 0
+
+        actions = [self.actions[b] if h else self.default for b, h in zip(best, hit)]
+        policies = [get_policy(a) for a in actions]
+        severities = [self.db.get(a, {}).get("severity", "INFO") for a in actions]
+        return actions, policies, severities
+
+
+def is_high_priority(action, db=None):
+    """Actions that bypass smoothing/decay: severity HIGH or CRITICAL."""
+    spec = (BEHAVIOR_DB if db is None else db).get(action)
+    return spec is not None and SEVERITY_RANK.get(spec.get("severity"), 0) >= SEVERITY_RANK["HIGH"]
@@ -0,0 +1,144 @@
+import os
+import json
+import logging
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DEFAULT_MODEL = os.path.join(ROOT, '.cache', 'temporal_action.onnx')
+
+# COCO-17
+L_SH, R_SH, L_HIP, R_HIP = 5, 6, 11, 12
+
+
+def normalize_skeletons(kpts, conf=None):
+    """
+    Pose-invariant skeletons for the temporal model, vectorized over N persons.
+    kpts: (N, 17, 2) normalized frame coords (0 = missing), conf: (N, 17) or None.
+    Centers on the hip midpoint (shoulders if hips are missing) and divides by
+    torso length, so the model sees shape/motion and not position/scale.
+    Returns (N, 17, 3) float32 [x, y, conf] with missing joints zeroed.
+    """
+    kpts = np.asarray(kpts, dtype=np.float32)[..., :2]
+    valid = kpts.any(axis=2)
+    if conf is None:
+        conf = valid.astype(np.float32)
+    conf = np.where(valid, np.asarray(conf, dtype=np.float32), 0.0)
+
+    def mid(a, b):
+        both = valid[:, a] & valid[:, b]
+        return np.where(both[:, None], (kpts[:, a] + kpts[:, b]) / 2, kpts[:, a] + kpts[:, b]), both
+
+    hips, hips_ok = mid(L_HIP, R_HIP)
+    shoulders, sh_ok = mid(L_SH, R_SH)
+    center = np.where(hips_ok[:, None], hips, shoulders)
+    torso = np.linalg.norm(shoulders - hips, axis=1)
+    torso = np.where(hips_ok & sh_ok & (torso > 1e-4), torso, 1.0)
+
+    out = np.empty(kpts.shape[:2] + (3,), dtype=np.float32)
+    out[..., :2] = (kpts - center[:, None]) / torso[:, None, None]
+    out[..., 2] = conf
+    out[~valid] = 0.0
+    return out
+
+
+class TemporalActionModel:
+    """
+    Learned action classifier over sliding windows of normalized COCO-17
+    skeletons (small 1D-conv + GRU exported to ONNX, see train_temporal.py).
+    Keeps a per-track ring buffer of the last `window` skeletons in one
+    (capacity, window, 17, 3) array and classifies ALL tracks with a full window
+    in a single batched onnxruntime call per frame.
+    If the ONNX file (or onnxruntime) is missing the model is disabled and
+    update() returns {} so the rule classifier keeps working alone.
+    """
+    def __init__(self, model_path=None, capacity=64, threads=1):
+        self.model_path = model_path or os.getenv('TEMPORAL_MODEL') or DEFAULT_MODEL
+        # Relative paths (e.g. from .env) are relative to the repo, not the cwd
+        self.model_path = os.path.join(ROOT, self.model_path)
+        self.session = None
+        self.labels = []
+        self.window = 16
+        self.slots = {}
+        self.free = []
+        self.capacity = 0
+
+        meta_path = os.path.splitext(self.model_path)[0] + '.json'
+        if os.path.exists(self.model_path) and os.path.exists(meta_path):
+            try:
+                import onnxruntime as ort
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                self.labels = meta['labels']
+                self.window = int(meta['window'])
+                so = ort.SessionOptions()
+                # Tiny model: one thread keeps it from competing with the pose model
+                so.intra_op_num_threads = threads
+                so.inter_op_num_threads = 1
+                self.session = ort.InferenceSession(self.model_path, sess_options=so, providers=['CPUExecutionProvider'])
+                self.input_name = self.session.get_inputs()[0].name
+                logging.getLogger("panoptes.temporal").info(f"Temporal action model online ({len(self.labels)} labels, window={self.window})")
+            except Exception as e:
+                print(f"[TEMPORAL] Model load failed: {e}")
+                self.session = None
+
+        self._alloc(capacity)
+
+    @property
+    def enabled(self):
+        return self.session is not None
+
+    def _alloc(self, capacity):
+        old = self.capacity
+        buf = np.zeros((capacity, self.window, 17, 3), dtype=np.float32)
+        head = np.zeros(capacity, dtype=np.int64)
+        if old:
+            buf[:old] = self.buf
+            head[:old] = self.head
+        self.buf, self.head = buf, head
+        self.free.extend(range(capacity - 1, old - 1, -1))
+        self.capacity = capacity
+
+    def _rows(self, track_ids):
+        rows = np.empty(len(track_ids), dtype=np.int64)
+        for i, t_id in enumerate(track_ids):
+            row = self.slots.get(t_id)
+            if row is None:
+                if not self.free:
+                    self._alloc(self.capacity * 2)
+                row = self.slots[t_id] = self.free.pop()
+                self.head[row] = 0
+            rows[i] = row
+        return rows
+
+    def update(self, track_ids, kpts, conf=None):
+        """
+        Appends one skeleton per track and classifies tracks with a full window.
+        Returns {track_id: (label, probability)}.
+        """
+        if not self.enabled or len(track_ids) == 0 or kpts is None:
+            return {}
+        rows = self._rows(track_ids)
+        self.buf[rows, self.head[rows] % self.window] = normalize_skeletons(kpts, conf)
+        self.head[rows] += 1
+
+        ready = self.head[rows] >= self.window
+        if not ready.any():
+            return {}
+        r = rows[ready]
+        # Chronological order: oldest sample first
+        order = (self.head[r][:, None] + np.arange(self.window)[None, :]) % self.window
+        batch = self.buf[r[:, None], order].reshape(len(r), self.window, 17 * 3)
+
+        logits = self.session.run(None, {self.input_name: np.ascontiguousarray(batch)})[0]
+        logits = logits - logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=1, keepdims=True)
+        best = probs.argmax(axis=1)
+
+        ids = [t for t, ok in zip(track_ids, ready) if ok]
+        return {t_id: (self.labels[b], float(probs[i, b])) for i, (t_id, b) in enumerate(zip(ids, best))}
+
+    def remove(self, track_id):
+        row = self.slots.pop(track_id, None)
+        if row is not None:
+            self.free.append(row)
@@ -0,0 +1,112 @@
+"""Train the temporal skeleton action model and export it to ONNX.
+
+Dataset: an .npz with
+    X: (M, T, 17, 3) keypoint windows [x, y, conf] in normalized frame coords
+    y: (M,) integer labels
+    labels: (C,) label names, e.g. ["NEUTRAL", "CAIDA", "PELEA"]
+Windows are normalized here with the same function used at runtime, so the
+exported model (.cache/temporal_action.onnx + .json sidecar) is picked up by
+detectors.temporal_action.TemporalActionModel without further changes.
+
+Usage:
+    python detectors/train_temporal.py dataset.npz --epochs 30
+"""
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import torch
+import torch.nn as nn
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from detectors.temporal_action import normalize_skeletons, DEFAULT_MODEL
+
+
+class TemporalNet(nn.Module):
+    """1D temporal convs for local motion + GRU for the whole window. ~60k params."""
+    def __init__(self, num_classes, in_features=51, hidden=64):
+        super().__init__()
+        self.conv = nn.Sequential(
+            nn.Conv1d(in_features, hidden, kernel_size=3, padding=1),
+            nn.BatchNorm1d(hidden),
+            nn.ReLU(),
+            nn.Conv1d(hidden, hidden, kernel_size=3, padding=2, dilation=2),
+            nn.BatchNorm1d(hidden),
+            nn.ReLU(),
+        )
+        self.gru = nn.GRU(hidden, hidden, batch_first=True)
+        self.head = nn.Linear(hidden, num_classes)
+
+    def forward(self, x):
+        # x: (B, T, 51)
+        h = self.conv(x.transpose(1, 2)).transpose(1, 2)
+        _, last = self.gru(h)
+        return self.head(last[-1])
+
+
+def load_dataset(path):
+    data = np.load(path, allow_pickle=False)
+    X, y, labels = data['X'], data['y'].astype(np.int64), [str(l) for l in data['labels']]
+    M, T = X.shape[:2]
+    flat = X.reshape(M * T, 17, 3)
+    Xn = normalize_skeletons(flat[..., :2], flat[..., 2]).reshape(M, T, 51)
+    return Xn, y, labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train + export temporal action model")
+    parser.add_argument('dataset')
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--batch', type=int, default=128)
+    parser.add_argument('--lr', type=float, default=1e-3)
+    parser.add_argument('--out', default=DEFAULT_MODEL)
+    args = parser.parse_args()
+
+    X, y, labels = load_dataset(args.dataset)
+    window = X.shape[1]
+    rng = np.random.default_rng(0)
+    idx = rng.permutation(len(X))
+    split = int(len(X) * 0.85)
+    tr, va = idx[:split], idx[split:]
+
+    model = TemporalNet(len(labels))
+    opt = torch.optim.AdamW(model.parameters(), lr=args.lr, weight_decay=1e-4)
+    # Falls/fights are rare: weight classes by inverse frequency
+    counts = np.bincount(y, minlength=len(labels)).astype(np.float32)
+    weights = torch.tensor(counts.sum() / np.maximum(counts, 1) / len(labels))
+    loss_fn = nn.CrossEntropyLoss(weight=weights)
+    Xt, yt = torch.from_numpy(X), torch.from_numpy(y)
+
+    for epoch in range(args.epochs):
+        model.train()
+        perm = torch.from_numpy(rng.permutation(tr))
+        for i in range(0, len(perm), args.batch):
+            b = perm[i:i + args.batch]
+            opt.zero_grad()
+            loss = loss_fn(model(Xt[b]), yt[b])
+            loss.backward()
+            opt.step()
+        model.eval()
+        with torch.inference_mode():
+            acc = (model(Xt[va]).argmax(1) == yt[va]).float().mean().item() if len(va) else float('nan')
+        print(f"epoch {epoch + 1}/{args.epochs} loss={loss.item():.4f} val_acc={acc:.3f}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    model.eval()
+    torch.onnx.export(
+        model,
+        torch.zeros(1, window, 51),
+        args.out,
+        opset_version=13,
+        input_names=['skeletons'],
+        output_names=['logits'],
+        dynamic_axes={'skeletons': {0: 'batch'}, 'logits': {0: 'batch'}}
+    )
+    with open(os.path.splitext(args.out)[0] + '.json', 'w') as f:
+        json.dump({'labels': labels, 'window': window}, f)
+    print('Exported', args.out)
+
+
+if __name__ == '__main__':
+    main()
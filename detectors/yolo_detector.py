@@ -1,27 +1,23 @@
 import cv2
-from ultralytics import YOLO
 import numpy as np
+from core.model_registry import ModelRegistry
 
 class YOLODetector:
     def __init__(self, model_path="yolo11n.pt", device=None):
         """
         Initialize the YOLO detector.
         Uses the nano model by default for speed.
+        The model is shared through the process-wide ModelRegistry, which also
+        verifies the device with a warmup inference (falling back to CPU).
         """
-        self.model = YOLO(model_path)
-        
-        if device:
-            try:
-                self.model.to(device)
-                print(f"[YOLO] Testing device {device}...")
-                # Test inference
-                dummy_frame = np.zeros((640, 640, 3), dtype=np.uint8)
-                self.model(dummy_frame, verbose=False)
-                print(f"[YOLO] Device {device} verified successfully.")
-            except Exception as e:
-                print(f"[YOLO] ⚠️ Failed on {device}: {e}")
-                print("[YOLO] Falling back to CPU.")
-                self.model.to("cpu")
+        self.handle = ModelRegistry().acquire(model_path, device)
+        self.model = self.handle.model
+        print(f"[YOLO] Device {self.handle.device} verified successfully.")
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.release()
+            self.handle = None
     
     def detect(self, frame):
         """
@@ -30,7 +26,8 @@ class YOLODetector:
         """
         # Run inference with defensive handling — return an empty-like result on failure
         try:
-            results = self.model(frame, verbose=False)
+            with self.handle.lock:
+                results = self.model(frame, verbose=False)
             return results[0]  # Return the first result (single frame)
         except Exception as e:
             print(f"[YOLO] Inference Error: {e}")
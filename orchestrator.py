@@ -1,38 +1,78 @@
+import os
 import time
-import cv2
 import threading
 import logging
 from core.shared_state import SharedState
 from core.vision_thread import VisionThread
 from core.inference_engine import InferenceEngine
 from core.visualizer import Visualizer
+from core.reid import ReIDService
+from core.analytics import AnalyticsAggregator
+from core.heatmap import HeatmapAccumulator
+from core.recorder import ClipRecorder
+from core.stream_encoder import LiveEncoder
+from core.jpeg_encoder import JpegEncoder
 
 class Orchestrator:
     def __init__(self, source=0):
         self.source = source
         self.shared = SharedState()
-        self.vision = VisionThread(source=source)
-        self.brain = InferenceEngine(model_path="yolo11n-pose.pt")
-        self.visualizer = Visualizer()
-        
-        logging.getLogger("panoptes.orch").info("Orchestrator V2 (Parallel Core) Initialized")
         
         self.settings = {
             "conf_threshold": 0.40,
             "loitering_time": 5.0,
             "intrusion_zone": [300, 200, 980, 520],
+            # Inference ROIs [x1, y1, x2, y2] (px or 0-1). Empty = full frame.
+            # Per camera: {"0": [[...], [...]], "rtsp://...": [...]}
+            "rois": [],
+            # Extra named zones for entry/exit/loitering events {name: [x1, y1, x2, y2]}
+            "zones": {},
+            # Facial emotion per tracked person (needs mediapipe); re-analyzed every N frames
+            "emotion_enabled": False,
+            "emotion_interval": 15,
+            # Global person IDs across track breaks / cameras (embeddings + vector store)
+            "reid_enabled": False,
+            # Pre-roll + post-roll clips when a track enters one of these actions (see /clips)
+            "record_enabled": False,
+            "record_actions": ["AGRESION", "MANOS_ARRIBA"],
+            # MJPEG bytes/second target in kbit/s (0 = fixed quality); quality drops first, then resolution
+            "stream_budget_kbps": float(os.getenv('STREAM_BUDGET_KBPS') or 0),
             "draw_on_server": True
         }
+        
+        self.vision = VisionThread(source=source)
+        self.reid = ReIDService() # Idle until the first update (settings["reid_enabled"])
+        self.analytics = AnalyticsAggregator()
+        self.heatmap = HeatmapAccumulator()
+        self.recorder = ClipRecorder(camera=source)
+        self.brain = InferenceEngine(model_path="yolo11n-pose.pt", settings=self.settings, source=source,
+                                     reid=self.reid, analytics=self.analytics, heatmap=self.heatmap,
+                                     recorder=self.recorder)
+        # HUD is drawn at preview resolution (never on the full-res frame)
+        self.visualizer = Visualizer(render_width=int(os.getenv('PREVIEW_WIDTH') or 960))
+        self.encoders = {} # {"fmp4" | "mpegts": LiveEncoder}, created by the first viewer
+        self._encode_lock = threading.Lock()
+        self._encoded = None # (key, packet) of the last encoded MJPEG frame, shared by viewers
+        self.jpeg = JpegEncoder(budget_kbps=self.settings["stream_budget_kbps"])
+        
+        logging.getLogger("panoptes.orch").info("Orchestrator V2 (Parallel Core) Initialized")
 
     def start(self):
         logging.getLogger("panoptes.orch").info("Starting Engines...")
         self.vision.start()
         self.brain.start()
+        self.shared.system_status = "ONLINE"
 
     def stop(self):
         logging.getLogger("panoptes.orch").info("Stopping Engines...")
         self.vision.stop()
         self.brain.stop()
+        self.reid.stop()
+        self.heatmap.stop()
+        self.recorder.stop()
+        for encoder in self.encoders.values():
+            encoder.stop()
+        self.analytics.save()
 
     def get_frame(self):
         """
@@ -40,20 +80,53 @@ class Orchestrator:
         Fetches latest frame (low latency), fetches latest AI results (async),
         renders HUD, returns JPEG.
         """
-        # 1. Get snapshot
-        data = self.shared.get_snapshot()
-        if data is None or data["frame"] is None:
-            return None
+        packet = self.get_frame_packet()
+        return packet[0] if packet else None
+
+    def get_frame_packet(self):
+        """
+        (jpeg bytes, frame_id, frame_timestamp) of the latest frame.
+        settings["draw_on_server"] False: the raw preview is encoded as-is (no
+        copy, no HUD); clients draw the overlay from telemetry, matching on
+        frame_id. Either way each frame is encoded ONCE and the bytes are
+        shared by every viewer.
+        """
+        draw = self.settings.get("draw_on_server", True)
+        if not draw:
+            frame, frame_id, ts = self.shared.get_preview()
+            if frame is None:
+                return None
+            key = (frame_id, False, None)
+        else:
+            # 1. Get snapshot
+            data = self.shared.get_snapshot()
+            if data is None or data["frame"] is None:
+                return None
+            frame_id, ts = data["frame_id"], data["frame_timestamp"]
+            key = (frame_id, True, id(data["detections"]))
+
+        with self._encode_lock:
+            if self._encoded is not None and self._encoded[0] == key:
+                return self._encoded[1]
+            if draw:
+                frame = data["frame"]
+                # Detections arrive at model rate; extrapolate them (Kalman) to the
+                # capture time of this frame so boxes move smoothly at display rate.
+                detections = self.brain.behavior.predict_detections(data["detections"], ts)
+                
+                # 2. Render HUD (Cyberpunk Style)
+                frame = self.visualizer.draw_scene(frame, detections)
             
-        frame = data["frame"]
-        detections = data["detections"]
-        
-        # 2. Render HUD (Cyberpunk Style)
-        self.visualizer.draw_scene(frame, detections)
-        
-        # 3. Encode
-        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-        return buffer.tobytes()
+            # 3. Encode
+            self.jpeg.configure(budget_kbps=self.settings.get("stream_budget_kbps") or 0)
+            try:
+                jpeg = self.jpeg.encode(frame)
+            except Exception as e:
+                logging.getLogger("panoptes.orch").error(f"JPEG encode failed: {e}")
+                return None
+            packet = (jpeg, frame_id, ts)
+            self._encoded = (key, packet)
+            return packet
 
     def get_telemetry(self):
         """
@@ -71,13 +144,31 @@ class Orchestrator:
             "fps": int(data["fps"]),
             "camera_status": "ONLINE" if data["cam_active"] else "CONNECTING",
             "detections": data["detections"],
+            # Frame the detections belong to (clients drawing the HUD over /stream match on it)
+            "frame_id": data["detections_frame_id"],
+            "frame_timestamp": data["detections_timestamp"],
+            "draw_on_server": self.settings.get("draw_on_server", True),
+            "zone_events": data["zone_events"][-20:],
             # Legacy compatibility fields
-            "anomalies": 0,
+            "anomalies": self.brain.zones.loitering_count(),
             "track_count": len(data["detections"]),
             "latest_analysis": "SISTEMA ACTIVO",
             "cam_active": data["cam_active"]
         }
 
+    def get_status(self):
+        """Readiness of each subsystem (for /status)."""
+        snap = self.shared.get_snapshot()
+        return {
+            "camera": bool(self.vision.running and snap is not None and snap["cam_active"]),
+            "model": self.brain.model is not None,
+            "device": self.brain.device,
+            "inference_fps": round(snap["fps"], 1) if snap else 0.0,
+            "reid": self.reid.summary() if self.reid.running else None,
+            "jpeg": self.jpeg.metrics(),
+            "system_status": self.shared.system_status
+        }
+
     # Legacy Methods for Server Compatibility
     def toggle_camera(self, state: bool):
         if state:
@@ -85,11 +176,39 @@ class Orchestrator:
         else:
             self.vision.stop()
             
-    def get_history(self):
-        return []
+    def get_history(self, limit=50):
+        return self.analytics.recent(limit)
         
     def get_analytics_summary(self):
-        return {"total_incidents": 0}
+        return self.analytics.summary()
         
-    def get_vault_data(self, limit=50):
-        return []
+    def get_heatmap(self, camera=None, start=None, end=None, kind="occupancy", width=640):
+        """PNG overlay of where people stood (occupancy) or walked (trajectory)."""
+        return self.heatmap.render_png(self.source if camera is None else camera, start, end, kind, width)
+
+    def get_encoder(self, fmt="fmp4"):
+        """Shared H.264 live encoder (one FFmpeg process per format for all viewers)."""
+        encoder = self.encoders.get(fmt)
+        if encoder is None:
+            encoder = self.encoders.setdefault(fmt, LiveEncoder(fmt))
+        return encoder
+
+    def get_clips(self, limit=50, start=None, end=None, action=None, clip_id=None):
+        from database.vector_store import SQLiteDB
+        if self.recorder.db is None:
+            self.recorder.db = SQLiteDB()
+        return self.recorder.db.query_clips(limit=limit, start=start, end=end, action=action, clip_id=clip_id)
+
+    def _vault(self):
+        # Lazy: connecting to Milvus (or opening SQLite) is only needed for the vault / re-ID
+        if self.reid.db is None:
+            from database.vector_store import VectorDB
+            self.reid.db = VectorDB(dim=self.reid.dim)
+        return self.reid.db
+
+    def get_vault_data(self, limit=50, start=None, end=None, person_id=None, action=None):
+        try:
+            return self._vault().query(limit=limit, start=start, end=end, person_id=person_id, action=action)
+        except Exception as e:
+            logging.getLogger("panoptes.orch").warning(f"Vault query failed: {e}")
+            return []
@@ -1,17 +1,16 @@
 import os
 os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"
 
-from fastapi import FastAPI, Response, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, Response, Request, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
-from orchestrator import Orchestrator
 import uvicorn
 import asyncio
 import time
 import json
+import threading
+from typing import Optional
 from contextlib import asynccontextmanager
-import logging
-
 import logging
 import warnings
 warnings.filterwarnings("ignore") # Suppress noisy deprecation warnings
@@ -22,16 +21,52 @@ logger = logging.getLogger("panoptes.server")
 import sys
 sys.stdout.reconfigure(line_buffering=True)
 
-# Global Orchestrator
-panoptes = Orchestrator(source=0)
+# Global Orchestrator. Created in the background: importing torch/ultralytics and
+# loading the model takes seconds, the HTTP server must bind and answer /health now.
+panoptes = None
+startup = {"phase": "STARTING", "started_at": time.time(), "ready_at": None, "error": None}
+_stopping = threading.Event()
+
+def _init_orchestrator():
+    global panoptes
+    try:
+        startup["phase"] = "IMPORTING"
+        from orchestrator import Orchestrator # Heavy imports happen here
+        from core.sources import parse_source
+        startup["phase"] = "LOADING"
+        orch = Orchestrator(source=parse_source(os.getenv("CAMERA_SOURCE", "0")))
+        orch.start()
+        panoptes = orch
+        if _stopping.is_set():
+            orch.stop()
+            return
+        if orch.brain.model is None:
+            # HTTP + video keep working, but there is no AI: not ready
+            startup["phase"] = "DEGRADED"
+            startup["error"] = "model load failed"
+            return
+        startup["phase"] = "READY"
+        startup["ready_at"] = time.time()
+        logger.info(f"Orchestrator ready in {startup['ready_at'] - startup['started_at']:.1f}s")
+    except Exception as e:
+        startup["phase"] = "FAILED"
+        startup["error"] = str(e)
+        logger.error(f"Orchestrator startup failed: {e}")
+
+def _require():
+    if panoptes is None:
+        raise HTTPException(status_code=503, detail=f"Engine {startup['phase']}")
+    return panoptes
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup
-    panoptes.start()
+    # Startup (non-blocking)
+    threading.Thread(target=_init_orchestrator, name="orchestrator-init", daemon=True).start()
     yield
     # Shutdown
-    panoptes.stop()
+    _stopping.set()
+    if panoptes is not None:
+        panoptes.stop()
 
 app = FastAPI(title="PANOPTES QUANTUM API", lifespan=lifespan)
 
@@ -56,13 +91,43 @@ class ConnectionManager:
 
 manager = ConnectionManager()
 
+@app.get("/health")
+def health():
+    """Liveness: the HTTP server is up (engine may still be starting)."""
+    return {"status": "ok", "uptime": round(time.time() - startup["started_at"], 1)}
+
+@app.get("/ready")
+def ready():
+    """Readiness: 200 while the model is loaded and the camera delivers frames, 503 otherwise."""
+    body = {"ready": startup["phase"] == "READY", "phase": startup["phase"], "error": startup["error"]}
+    if body["ready"]:
+        # Camera checked live: it can still be connecting, or drop out later
+        body["camera"] = body["ready"] = panoptes.get_status()["camera"]
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+@app.get("/status")
+def status():
+    uptime = time.time() - startup["started_at"]
+    cpu = time.process_time() # CPU seconds of this process (all threads)
+    return {
+        "phase": startup["phase"],
+        "error": startup["error"],
+        "uptime": round(uptime, 1),
+        "startup_seconds": round(startup["ready_at"] - startup["started_at"], 2) if startup["ready_at"] else None,
+        "process_cpu_seconds": round(cpu, 2),
+        "process_cpu_percent": round(100.0 * cpu / uptime, 1) if uptime > 0 else 0.0,
+        "subsystems": panoptes.get_status() if panoptes is not None else {},
+        "clients": len(manager.active_connections)
+    }
+
 @app.websocket("/ws/telemetry")
 async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
     try:
         while True:
             # Enviar telemetría a alta frecuencia (30 FPS)
-            data = panoptes.get_telemetry()
+            data = panoptes.get_telemetry() if panoptes is not None else {
+                "fps": 0, "camera_status": startup["phase"], "detections": []}
             await websocket.send_json(data)
             await asyncio.sleep(0.033)
     except WebSocketDisconnect:
@@ -82,31 +147,62 @@ async def websocket_endpoint(websocket: WebSocket):
             pass
 
 def generate_frames():
+    last_id = None
     while True:
-        frame_bytes = panoptes.get_frame()
-        if frame_bytes:
+        packet = panoptes.get_frame_packet() if panoptes is not None else None
+        # Each frame once per viewer; the JPEG itself is shared by all viewers
+        if packet and packet[1] != last_id:
+            frame_bytes, last_id, ts = packet
+            # X-Frame-Id matches telemetry["frame_id"] (client-side overlay)
             yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+                   b'Content-Type: image/jpeg\r\n'
+                   b'Content-Length: %d\r\n'
+                   b'X-Frame-Id: %d\r\n'
+                   b'X-Frame-Timestamp: %.3f\r\n\r\n' % (len(frame_bytes), last_id, ts) + frame_bytes + b'\r\n')
         time.sleep(0.03) # Cap at 30 FPS for bandwidth stability
 
 @app.get("/video_feed")
 def video_feed():
     return StreamingResponse(generate_frames(), media_type="multipart/x-mixed-replace; boundary=frame")
 
+@app.get("/stream.mp4")
+def live_stream_mp4():
+    """H.264 fragmented MP4, encoded once for every viewer (HUD not burned in: see /ws/telemetry)."""
+    return _live_stream("fmp4")
+
+@app.get("/stream.ts")
+def live_stream_ts():
+    """Same live stream as MPEG-TS (players / hls.js-style consumers)."""
+    return _live_stream("mpegts")
+
+@app.get("/stream/info")
+def live_stream_info():
+    """Per-format encoder state; epoch + n / fps = capture time of stream frame n."""
+    return {fmt: encoder.info() for fmt, encoder in _require().encoders.items()}
+
+def _live_stream(fmt):
+    from core.stream_encoder import LiveEncoder
+    if not LiveEncoder.available():
+        raise HTTPException(status_code=503, detail="FFmpeg / ffmpeg-python not available, use /video_feed")
+    encoder = _require().get_encoder(fmt)
+    return StreamingResponse(encoder.stream(), media_type=encoder.media_type,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.get("/telemetry")
 def get_telemetry():
-    return panoptes.get_telemetry()
+    return _require().get_telemetry()
 
 @app.post("/camera/toggle")
 async def toggle_camera(request: Request):
     data = await request.json()
     enabled = data.get("enabled", True)
-    panoptes.toggle_camera(enabled)
+    _require().toggle_camera(enabled)
     return {"status": "success", "cam_active": enabled}
 
 @app.post("/update_settings")
 async def update_settings(request: Request):
     settings = await request.json()
+    panoptes = _require()
     # Apply settings directly to the orchestrator mapping
     for key, value in settings.items():
         if key in panoptes.settings:
@@ -114,22 +210,49 @@ async def update_settings(request: Request):
     return {"status": "success", "settings": panoptes.settings}
 
 @app.get("/vault")
-def get_vault_data(limit: int = 50):
+def get_vault_data(limit: int = 50, start: Optional[float] = None, end: Optional[float] = None,
+                   person_id: Optional[int] = None, action: Optional[str] = None):
     """
     Fetch historical detection data from the Milvus Intelligence Vault.
+    Optional filters: time range [start, end) (epoch seconds), person and action.
     """
-    return panoptes.get_vault_data(limit=limit)
+    return _require().get_vault_data(limit=limit, start=start, end=end, person_id=person_id, action=action)
+
+@app.get("/heatmap")
+def get_heatmap(camera: Optional[str] = None, start: Optional[float] = None, end: Optional[float] = None,
+                kind: str = "occupancy", width: int = 640):
+    """
+    Occupancy / trajectory heatmap as a transparent PNG overlay.
+    Without start/end: recent activity (exponentially decayed).
+    """
+    if kind not in ("occupancy", "trajectory"):
+        raise HTTPException(status_code=400, detail="kind must be occupancy or trajectory")
+    png = _require().get_heatmap(camera, start, end, kind, max(32, min(width, 1920)))
+    return Response(content=png, media_type="image/png", headers={"Cache-Control": "no-cache"})
+
+@app.get("/clips")
+def get_clips(limit: int = 50, start: Optional[float] = None, end: Optional[float] = None, action: Optional[str] = None):
+    """Event clips (pre-roll + post-roll) recorded on high-severity actions."""
+    return _require().get_clips(limit=limit, start=start, end=end, action=action)
+
+@app.get("/clips/{clip_id}")
+def get_clip(clip_id: int):
+    clips = _require().get_clips(limit=1, clip_id=clip_id)
+    if not clips or not os.path.exists(clips[0]["path"]):
+        raise HTTPException(status_code=404, detail="Clip not found")
+    path = clips[0]["path"]
+    return FileResponse(path, media_type="video/mp4" if path.endswith(".mp4") else "video/x-msvideo")
 
 @app.get("/analytics")
 def get_analytics():
     """
     Fetch system-wide behavior analytics and trends.
     """
-    return panoptes.get_analytics_summary()
+    return _require().get_analytics_summary()
 
 @app.get("/history")
-def get_history():
-    return panoptes.get_history()
+def get_history(limit: int = 50):
+    return _require().get_history(limit=limit)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
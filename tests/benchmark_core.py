@@ -8,6 +8,7 @@ sys.path.append(os.getcwd())
 from core.vision_thread import VisionThread
 from core.inference_engine import InferenceEngine
 from core.shared_state import SharedState
+from core.sources import parse_source
 
 def main():
     print("--- CHALAS AI: M2 BENCHMARK START ---")
@@ -15,7 +16,8 @@ def main():
     shared = SharedState()
     
     # Start Vision
-    vision = VisionThread(source=0)
+    # CAMERA_SOURCE=synthetic / replay://clip.mp4 for camera-less, reproducible runs
+    vision = VisionThread(source=parse_source(os.getenv("CAMERA_SOURCE", "0")))
     vision.start()
     
     # Start Brain
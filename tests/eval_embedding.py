@@ -0,0 +1,147 @@
+"""Latency + retrieval accuracy of the embedding models vs the FP32 baseline.
+
+Usage:
+    python tests/eval_embedding.py IMAGES_DIR [--dim 128] [--runs 30]
+
+IMAGES_DIR is a local image set:
+  - IMAGES_DIR/<identity>/*.jpg  (re-ID layout: same folder = same person), or
+  - a flat folder of crops: every image becomes an identity with two
+    augmented views (flip / crop / brightness) as its positives.
+Models compared (whatever exists in .cache, see detectors/export_onnx.py):
+  fp32-1280   legacy backbone, full 1280-d features (baseline)
+  fp32-trunc  legacy backbone truncated to the first `dim` (previous runtime path)
+  reid-fp32   backbone + PCA projection to `dim`
+  reid-int8   same, INT8 dynamic quantized
+Reports per model: batch-1 latency, batch-16 throughput, rank-1 and mAP
+(leave-one-out cosine retrieval) and deltas vs the baseline.
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import cv2
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from detectors.embedding import CACHE_DIR, reid_model_path, preprocess
+from detectors.export_onnx import find_images
+
+
+def load_set(root, seed=0):
+    images, labels = [], []
+    subdirs = sorted(d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d)))
+    if subdirs:
+        for label, d in enumerate(subdirs):
+            for p in find_images(os.path.join(root, d)):
+                img = cv2.imread(p)
+                if img is not None:
+                    images.append(img)
+                    labels.append(label)
+        return images, np.array(labels)
+
+    rng = np.random.default_rng(seed)
+    for label, p in enumerate(find_images(root)):
+        img = cv2.imread(p)
+        if img is None:
+            continue
+        h, w = img.shape[:2]
+        views = [img, img[:, ::-1]]
+        y, x = int(rng.integers(0, h // 10 + 1)), int(rng.integers(0, w // 10 + 1))
+        views.append(cv2.convertScaleAbs(img[y:y + int(h * 0.9), x:x + int(w * 0.9)], alpha=1.0, beta=float(rng.integers(-30, 30))))
+        images.extend(np.ascontiguousarray(v) for v in views)
+        labels.extend([label] * len(views))
+    return images, np.array(labels)
+
+
+def retrieval(emb, labels):
+    """Leave-one-out cosine retrieval: (rank-1, mAP) over queries that have a positive."""
+    e = emb / np.maximum(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12)
+    sim = e @ e.T
+    np.fill_diagonal(sim, -np.inf)
+    order = np.argsort(-sim, axis=1)[:, :-1] # drop self (last)
+    match = labels[order] == labels[:, None]
+    has_pos = match.any(axis=1)
+    if not has_pos.any():
+        return float('nan'), float('nan')
+    match = match[has_pos]
+    rank1 = match[:, 0].mean()
+    hits = np.cumsum(match, axis=1)
+    precision = hits / np.arange(1, match.shape[1] + 1)
+    ap = (precision * match).sum(axis=1) / match.sum(axis=1)
+    return float(rank1), float(ap.mean())
+
+
+def run_model(path, images, dim=None, runs=30, batch=16):
+    import onnxruntime as ort
+    so = ort.SessionOptions()
+    so.intra_op_num_threads = max(1, (os.cpu_count() or 1) - 1)
+    sess = ort.InferenceSession(path, sess_options=so, providers=['CPUExecutionProvider'])
+    name = sess.get_inputs()[0].name
+
+    feats = np.concatenate([sess.run(None, {name: preprocess(images[i:i + batch])})[0]
+                            for i in range(0, len(images), batch)])
+    if dim is not None:
+        feats = feats[:, :dim]
+
+    x1 = preprocess(images[:1])
+    xb = preprocess((images * batch)[:batch])
+    sess.run(None, {name: x1}) # warmup
+    lat = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        sess.run(None, {name: x1})
+        lat.append(time.perf_counter() - t)
+    t = time.perf_counter()
+    for _ in range(max(1, runs // 5)):
+        sess.run(None, {name: xb})
+    throughput = batch * max(1, runs // 5) / (time.perf_counter() - t)
+    return feats, float(np.median(lat) * 1000), throughput
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding latency / accuracy evaluation")
+    parser.add_argument('images')
+    parser.add_argument('--dim', type=int, default=int(os.getenv('EMBED_DIM', 128)))
+    parser.add_argument('--runs', type=int, default=30)
+    args = parser.parse_args()
+
+    images, labels = load_set(args.images)
+    if len(images) < 2:
+        print('Need at least 2 images in', args.images)
+        return
+    print(f'{len(images)} images, {len(set(labels.tolist()))} identities\n')
+
+    legacy = os.path.join(CACHE_DIR, 'mobilenetv2.onnx')
+    models = [
+        ('fp32-1280', legacy, None),
+        ('fp32-trunc', legacy, args.dim),
+        ('reid-fp32', reid_model_path(args.dim), None),
+        ('reid-int8', reid_model_path(args.dim, quantized=True), None),
+    ]
+    rows, base, ref = [], None, {}
+    for label, path, trunc in models:
+        if not os.path.exists(path):
+            print(f'skip {label}: {path} not found (run detectors/export_onnx.py)')
+            continue
+        feats, lat, thr = run_model(path, images, trunc, runs=args.runs)
+        r1, mAP = retrieval(feats, labels)
+        ref[label] = feats
+        rows.append((label, feats.shape[1], os.path.getsize(path) / 1e6, lat, thr, r1, mAP))
+        if base is None:
+            base = rows[-1]
+
+    print(f"\n{'model':<11} {'dim':>5} {'MB':>6} {'ms/img':>7} {'img/s@16':>9} {'rank-1':>7} {'mAP':>7} {'d-rank1':>8} {'d-mAP':>7} {'speedup':>8}")
+    for label, d, mb, lat, thr, r1, mAP in rows:
+        print(f"{label:<11} {d:>5} {mb:>6.1f} {lat:>7.2f} {thr:>9.1f} {r1:>7.3f} {mAP:>7.3f} "
+              f"{r1 - base[5]:>+8.3f} {mAP - base[6]:>+7.3f} {base[3] / lat:>7.2f}x")
+
+    if 'reid-fp32' in ref and 'reid-int8' in ref:
+        a, b = ref['reid-fp32'], ref['reid-int8']
+        cos = (a * b).sum(1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1) + 1e-12)
+        print(f"\nINT8 vs FP32 embedding cosine: mean {cos.mean():.4f}, min {cos.min():.4f}")
+
+
+if __name__ == '__main__':
+    main()
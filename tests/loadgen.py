@@ -0,0 +1,307 @@
+"""How many viewers one box sustains: ramps /video_feed, /ws/telemetry and /telemetry clients.
+
+Usage:
+    python tests/loadgen.py --spawn [--video 20] [--ws 50] [--poll 20] [--steps 5] [--step-seconds 10]
+    python tests/loadgen.py --url http://127.0.0.1:8000 ...   (server already running)
+
+--spawn starts `server:app` on a free local port with CAMERA_SOURCE=synthetic
+(no camera needed; the model may still load, a DEGRADED engine serves video
+too), logs its output to --server-log and stops it at the end.
+Each step adds clients of every kind (step k of S runs round(N * k / S)) and
+measures, per kind:
+  fps        frames / messages / responses per client per second
+  kbps       total kbit/s delivered
+  latency    p50/p95/p99 ms: receive time - capture time (X-Frame-Timestamp /
+             telemetry frame_timestamp), i.e. end-to-end incl. encode and queueing.
+             Pollers also report the request round-trip. Same-clock assumption:
+             run the load on the server machine. Not measured when a spawned
+             paced source runs on a virtual clock (rate != 1 or a fixed epoch).
+  errors     failed connects / dropped streams
+plus server CPU% (process_cpu_seconds from /status over the step).
+Writes the table to stdout and everything to --report (JSON).
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+from urllib.parse import urlsplit, parse_qsl
+import numpy as np
+import httpx
+import websockets
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+KINDS = ("video", "ws", "poll")
+
+
+class Meter:
+    """Counters of one client kind, reset at every step."""
+    def __init__(self, latency=True):
+        self.clients = 0
+        self.measure_latency = latency # Frame timestamps are wall-clock times
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.bytes = 0
+        self.errors = 0
+        self.latency = []
+        self.rtt = []
+
+    def add(self, size, capture_ts=None, rtt=None):
+        self.count += 1
+        self.bytes += size
+        if capture_ts and self.measure_latency:
+            self.latency.append(time.time() - capture_ts)
+        if rtt is not None:
+            self.rtt.append(rtt)
+
+
+def _pct(values):
+    if not values:
+        return None
+    ms = np.asarray(values) * 1000
+    return {p: round(float(np.percentile(ms, q)), 1) for p, q in (("p50", 50), ("p95", 95), ("p99", 99))}
+
+
+# --- clients -----------------------------------------------------------------
+async def video_client(client, url, meter, stop):
+    """Parses the multipart MJPEG stream (part headers carry Content-Length / X-Frame-Timestamp)."""
+    try:
+        async with client.stream("GET", url + "/video_feed") as resp:
+            buf = b""
+            async for chunk in resp.aiter_bytes():
+                buf += chunk
+                while True:
+                    head_end = buf.find(b"\r\n\r\n")
+                    if head_end < 0:
+                        break
+                    headers = {}
+                    for line in buf[:head_end].split(b"\r\n"):
+                        if b":" in line:
+                            k, v = line.split(b":", 1)
+                            headers[k.strip().lower()] = v.strip()
+                    length = int(headers.get(b"content-length", -1))
+                    if length < 0:
+                        # Legacy server without Content-Length: cut at the next boundary
+                        nxt = buf.find(b"--frame", head_end)
+                        if nxt < 0:
+                            break
+                        length = nxt - head_end - 6
+                    end = head_end + 4 + length
+                    if len(buf) < end:
+                        break
+                    ts = headers.get(b"x-frame-timestamp")
+                    meter.add(length, float(ts) if ts else None)
+                    buf = buf[end:].lstrip(b"\r\n")
+                if stop.is_set():
+                    return
+    except Exception:
+        if not stop.is_set():
+            meter.errors += 1
+
+
+async def ws_client(url, meter, stop):
+    try:
+        async with websockets.connect(url.replace("http", "ws", 1) + "/ws/telemetry", max_size=None) as ws:
+            while not stop.is_set():
+                msg = await ws.recv()
+                data = json.loads(msg)
+                meter.add(len(msg), data.get("frame_timestamp"))
+    except Exception:
+        if not stop.is_set():
+            meter.errors += 1
+
+
+async def poll_client(client, url, meter, stop, hz):
+    period = 1.0 / hz
+    while not stop.is_set():
+        t0 = time.time()
+        try:
+            resp = await client.get(url + "/telemetry")
+            if resp.status_code == 200:
+                meter.add(len(resp.content), resp.json().get("frame_timestamp"), time.time() - t0)
+            else:
+                meter.errors += 1
+        except Exception:
+            meter.errors += 1
+        await asyncio.sleep(max(period - (time.time() - t0), 0.0))
+
+
+async def _keep(meter, factory):
+    """Runs one client, reconnecting after a dropped stream (counted as an error)."""
+    meter.clients += 1
+    try:
+        while True:
+            await factory()
+            await asyncio.sleep(0.5)
+    finally:
+        meter.clients -= 1
+
+
+async def _cpu_seconds(client, url):
+    try:
+        return (await client.get(url + "/status")).json().get("process_cpu_seconds")
+    except Exception:
+        return None
+
+
+# --- driver ------------------------------------------------------------------
+async def run(args, url, wall_clock=True):
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    meters = {k: Meter(latency=wall_clock) for k in KINDS}
+    stop = asyncio.Event()
+    tasks = []
+    steps = []
+    targets = {"video": args.video, "ws": args.ws, "poll": args.poll}
+
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(10.0, read=30.0)) as client:
+        factories = {
+            "video": lambda: video_client(client, url, meters["video"], stop),
+            "ws": lambda: ws_client(url, meters["ws"], stop),
+            "poll": lambda: poll_client(client, url, meters["poll"], stop, args.poll_hz),
+        }
+        for step in range(1, args.steps + 1):
+            for kind in KINDS:
+                want = round(targets[kind] * step / args.steps)
+                while len([t for t in tasks if t[0] == kind]) < want:
+                    tasks.append((kind, asyncio.create_task(_keep(meters[kind], factories[kind]))))
+            # Let new connections settle before measuring
+            await asyncio.sleep(min(1.0, args.step_seconds / 4))
+            for m in meters.values():
+                m.reset()
+            cpu0, t0 = await _cpu_seconds(client, url), time.time()
+            await asyncio.sleep(args.step_seconds)
+            cpu1, elapsed = await _cpu_seconds(client, url), time.time() - t0
+
+            row = {"step": step, "seconds": round(elapsed, 2),
+                   "server_cpu_percent": round(100 * (cpu1 - cpu0) / elapsed, 1) if cpu0 is not None and cpu1 is not None else None}
+            for kind, m in meters.items():
+                row[kind] = {
+                    "clients": m.clients,
+                    "fps": round(m.count / elapsed / m.clients, 2) if m.clients else 0.0,
+                    "kbps": round(m.bytes * 8 / 1000 / elapsed, 1),
+                    "latency_ms": _pct(m.latency),
+                    "errors": m.errors,
+                }
+                if m.rtt:
+                    row[kind]["rtt_ms"] = _pct(m.rtt)
+            steps.append(row)
+            _print_row(row)
+
+        stop.set()
+        for _, task in tasks:
+            task.cancel()
+        await asyncio.gather(*(t for _, t in tasks), return_exceptions=True)
+    return steps
+
+
+def _print_row(row):
+    cpu = row["server_cpu_percent"]
+    parts = [f"step {row['step']:>2}  cpu {cpu if cpu is not None else '?':>6}%"]
+    for kind in KINDS:
+        r = row[kind]
+        if not r["clients"]:
+            continue
+        lat = r["latency_ms"]["p95"] if r["latency_ms"] else "-"
+        parts.append(f"{kind} x{r['clients']}: {r['fps']:.1f} fps/client {r['kbps']:.0f} kbps p95 {lat} ms err {r['errors']}")
+    print(" | ".join(parts), flush=True)
+
+
+def _wall_clock(source):
+    """False for a paced source (core.sources) whose frame timestamps run on a virtual clock."""
+    scheme, _, rest = source.partition(":")
+    if scheme.lower() not in ("synthetic", "replay", "images"):
+        return True
+    params = dict(parse_qsl(urlsplit(source).query)) if rest.startswith("//") else {}
+    return "epoch" not in params and float(params.get("rate", 1)) == 1
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def stop_server(proc, log):
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+    log.close()
+
+
+def spawn_server(args):
+    """Starts the server; returns (proc, url, log file). Stops it again if it never gets ready."""
+    port = _free_port()
+    env = dict(os.environ, CAMERA_SOURCE=os.getenv("CAMERA_SOURCE", "synthetic"))
+    log = open(args.server_log, "w") # Engine output would drown the table
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1",
+                             "--port", str(port), "--log-level", "warning"], cwd=ROOT, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + args.startup_timeout
+    try:
+        while time.time() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"Server exited during startup (see {args.server_log})")
+            try:
+                # Video only needs the orchestrator (READY or DEGRADED without a model)
+                body = httpx.get(url + "/status", timeout=1.0).json()
+                if body["phase"] in ("READY", "DEGRADED"):
+                    return proc, url, log
+                if body["phase"] == "FAILED":
+                    raise RuntimeError(f"Engine failed: {body['error']}")
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.5)
+        raise RuntimeError("Server not ready in time")
+    except BaseException: # Incl. Ctrl-C: never leave the server running
+        stop_server(proc, log)
+        raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent viewer load test")
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--spawn', action='store_true', help='start a local server on the synthetic source')
+    parser.add_argument('--video', type=int, default=20, help='/video_feed viewers at the last step')
+    parser.add_argument('--ws', type=int, default=50, help='/ws/telemetry sockets at the last step')
+    parser.add_argument('--poll', type=int, default=20, help='/telemetry pollers at the last step')
+    parser.add_argument('--poll-hz', type=float, default=10.0)
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--step-seconds', type=float, default=10.0)
+    parser.add_argument('--startup-timeout', type=float, default=180.0)
+    parser.add_argument('--server-log', default='load_server.log', help='output of the --spawn server')
+    parser.add_argument('--report', default='load_report.json')
+    args = parser.parse_args()
+
+    proc = log = None
+    url = args.url.rstrip("/")
+    if args.spawn:
+        print("Starting server (CAMERA_SOURCE=synthetic)...", flush=True)
+        proc, url, log = spawn_server(args)
+    wall_clock = not args.spawn or _wall_clock(os.getenv("CAMERA_SOURCE", "synthetic"))
+    if not wall_clock:
+        print("CAMERA_SOURCE paces a virtual clock: capture latency not measured", flush=True)
+    try:
+        server = httpx.get(url + "/status", timeout=5.0).json()
+        print(f"Server {url}: phase {server['phase']}", flush=True)
+        steps = asyncio.run(run(args, url, wall_clock))
+    finally:
+        if proc is not None:
+            stop_server(proc, log)
+
+    report = {"url": url, "spawned": args.spawn, "config": vars(args), "server": server, "steps": steps}
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report: {args.report}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Behavior-stack benchmark from recorded detections (no model, no camera).
+
+Usage:
+    DETECTION_LOG=run.pdet python server.py              # record (any source)
+    python tests/replay_detections.py run.pdet [--repeat 10] [--stack all] [--profile 25]
+    python tests/replay_detections.py --synthesize synth.pdet --people 50 --frames 3000
+
+Replays the log at maximum speed through:
+  behavior  core.behavior.BehaviorEngine.process_batch (what the live engine runs)
+  legacy    detectors.predictive_brain.PredictiveBrain + detectors.action_classifier.ActionClassifier
+            per track, plus core.behavior.ActionClassifier (single-skeleton views)
+--synthesize writes a log from the walking figures of the synthetic source
+(core.sources.SyntheticCapture ground truth) for runs with no recording at all.
+Reports frames/s, detections per minute and per-frame latency; --profile N
+prints the top N functions (cProfile, cumulative time).
+"""
+import os
+import sys
+import json
+import cProfile
+import pstats
+import argparse
+import numpy as np
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from core.detection_log import DetectionWriter, DetectionLog, replay
+
+
+def synthesize(path, people, frames, fps, width=1280, height=720, seed=0):
+    from core.sources import SyntheticCapture
+    source = SyntheticCapture(width=width, height=height, fps=fps, people=people, seed=seed, epoch=0.0)
+    writer = DetectionWriter(path, meta={"source": f"synthetic people={people} seed={seed}"})
+    ids = list(range(1, people + 1))
+    for n in range(frames):
+        kpts = source.keypoints(n) / (width, height)
+        inside = ((kpts > 0) & (kpts < 1)).all(axis=2)
+        kpts[~inside] = 0.0 # Off-frame joints are missing, like the model output
+        visible = inside.any(axis=1)
+        k = kpts[visible]
+        lo = np.where(inside[visible][..., None], k, np.inf).min(axis=1)
+        hi = np.where(inside[visible][..., None], k, -np.inf).max(axis=1)
+        boxes = np.clip(np.concatenate([lo - 0.01, hi + 0.01], axis=1), 0.0, 1.0)
+        conf = np.where(inside[visible], 0.9, 0.0)
+        writer.write(n / fps, (height, width), [i for i, v in zip(ids, visible) if v], boxes, k, conf)
+    writer.close()
+
+
+def legacy_step():
+    from detectors.predictive_brain import PredictiveBrain
+    from detectors.action_classifier import ActionClassifier as PoseClassifier
+    from core.behavior import ActionClassifier
+    brains, classifiers = {}, {}
+    skeleton = ActionClassifier()
+
+    def step(ts, shape, ids, boxes, kpts, conf):
+        h, w = shape
+        for i, t_id in enumerate(ids):
+            brain = brains.get(t_id)
+            if brain is None:
+                brain = brains[t_id] = PredictiveBrain(t_id)
+                classifiers[t_id] = PoseClassifier()
+            dyn = brain.update((boxes[i] * (w, h, w, h)).tolist(), ts)
+            if kpts is None:
+                continue
+            c = conf[i] if conf is not None else np.ones(17)
+            lm = [[j, float(x), float(y), float(c[j])] for j, (x, y) in enumerate(kpts[i]) if x or y]
+            classifiers[t_id].classify(lm, timestamp=ts, dynamics=dyn)
+            skeleton.classify(kpts[i])
+    return step
+
+
+def run(log, stack, repeat, profile):
+    step = legacy_step() if stack == "legacy" else None
+    if not profile:
+        return replay(log, repeat=repeat, step=step)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    stats = replay(log, repeat=repeat, step=step)
+    profiler.disable()
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(profile)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded detections through the behavior stack")
+    parser.add_argument('log', nargs='?')
+    parser.add_argument('--synthesize', metavar='PATH', help='write a synthetic log (and replay it)')
+    parser.add_argument('--people', type=int, default=20)
+    parser.add_argument('--frames', type=int, default=3000)
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--stack', choices=('behavior', 'legacy', 'all'), default='behavior')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--profile', type=int, default=0, metavar='N')
+    parser.add_argument('--json', help='write the results here')
+    args = parser.parse_args()
+
+    path = args.log
+    if args.synthesize:
+        synthesize(args.synthesize, args.people, args.frames, args.fps)
+        path = args.synthesize
+    if not path:
+        parser.error("a detection log or --synthesize PATH is required")
+
+    log = DetectionLog(path)
+    print(f"{path}: {log.num_frames} frames, {log.num_detections} detections, {log.duration:.1f}s "
+          f"({os.path.getsize(path) / 1e6:.1f} MB) {log.meta}")
+    results = {}
+    for stack in (('behavior', 'legacy') if args.stack == 'all' else (args.stack,)):
+        results[stack] = r = run(log, stack, args.repeat, args.profile)
+        print(f"[{stack}] {r['frames']} frames in {r['seconds']}s: {r['fps']} FPS, "
+              f"{r['detections_per_minute']:,} detections/min, frame ms {r['frame_ms']}")
+    log.close()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"log": path, "repeat": args.repeat, "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()